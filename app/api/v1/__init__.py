@@ -5,11 +5,13 @@ from .base import router as base_router
 from .health import router as health_router
 from .messages import router as messages_router
 from .metrics import router as metrics_router
+from .ws import router as ws_router
 
 v1_router = APIRouter()
 v1_router.include_router(base_router)
 v1_router.include_router(health_router)
 v1_router.include_router(messages_router)
 v1_router.include_router(metrics_router)
+v1_router.include_router(ws_router)
 
 __all__ = ["v1_router"]
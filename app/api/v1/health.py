@@ -1,5 +1,5 @@
 """健康探针端点 - 用于K8s/负载均衡器探活。"""
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from app.settings.config import get_settings
 
 router = APIRouter(tags=["health"])
@@ -26,13 +26,21 @@ async def livez():
 
 
 @router.get("/readyz")
-async def readyz():
+async def readyz(request: Request):
     """
     就绪探针 - 检查服务是否准备好接收流量。
     
     K8s使用此端点判断是否将流量路由到此Pod。
+
+    附带各上游 AI 后端的熔断状态。上游由所有实例共享，全部熔断时返回 degraded 而非 503，
+    避免所有 Pod 同时被摘除；消息请求会快速失败并携带重试建议。
     """
-    # 简化实现：只要服务启动就认为就绪
-    # 未来可以添加数据库连接检查、依赖服务检查等
-    return {"status": "ready", "service": get_settings().app_name}
+    payload = {"status": "ready", "service": get_settings().app_name}
+    ai_service = getattr(request.app.state, "ai_service", None)
+    if ai_service is not None:
+        model_router = ai_service.router
+        payload["upstream"] = model_router.snapshot()
+        if not model_router.available():
+            payload["status"] = "degraded"
+    return payload
 
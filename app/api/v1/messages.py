@@ -1,17 +1,32 @@
 """对话消息相关路由。"""
 from __future__ import annotations
 
-import asyncio
-import json
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional
+from uuid import uuid4
 
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status
-from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 from app.auth import AuthenticatedUser, get_current_user
-from app.core.sse_guard import check_sse_concurrency, unregister_sse_connection
-from app.services.ai_service import AIMessageInput, AIService, MessageEventBroker
+from app.core.metrics import ai_generations_cancelled_total
+from app.core.heartbeat import get_heartbeat_scheduler
+from app.core.sse_guard import bind_sse_cancel, check_sse_concurrency, unregister_sse_connection
+from app.core.sse_stream import (
+    EventStreamResponse,
+    jittered_retry_ms,
+    negotiate_stream_encoding,
+    stream_subscription,
+)
+from app.services.ai_service import AIMessageInput, AIService
+from app.services.generation_scheduler import GenerationJob, SchedulerQueueFull, get_generation_scheduler
+from app.services.message_broker import (
+    FrameEncoding,
+    MessageBrokerBackend,
+    MessageEvent,
+    available_encodings,
+    encode_frame,
+    encode_mux_sse_frame,
+)
 from app.settings.config import get_settings
 
 router = APIRouter(tags=["messages"])
@@ -30,6 +45,11 @@ class MessageCreateResponse(BaseModel):
     message_id: str
 
 
+class MessageCancelResponse(BaseModel):
+    message_id: str
+    state: str = Field(..., description="cancelled：排队中已移除；cancelling：正在中止生成")
+
+
 @router.post("/messages", response_model=MessageCreateResponse, status_code=status.HTTP_202_ACCEPTED)
 async def create_message(
     payload: MessageCreateRequest,
@@ -37,11 +57,11 @@ async def create_message(
     background_tasks: BackgroundTasks,
     current_user: AuthenticatedUser = Depends(get_current_user),
 ) -> MessageCreateResponse:
-    broker: MessageEventBroker = request.app.state.message_broker
+    broker: MessageBrokerBackend = request.app.state.message_broker
     ai_service: AIService = request.app.state.ai_service
 
     message_id = AIService.new_message_id()
-    await broker.create_channel(message_id)
+    await broker.create_channel(message_id, owner=current_user.uid)
 
     message_input = AIMessageInput(
         text=payload.text,
@@ -50,26 +70,170 @@ async def create_message(
     )
 
     async def runner() -> None:
-        await ai_service.run_conversation(message_id, current_user, message_input, broker)
+        try:
+            await ai_service.run_conversation(message_id, current_user, message_input, broker)
+        finally:
+            # 兜底关闭，避免生成任务异常退出或被取消时通道一直等待清扫
+            await broker.close(message_id)
+
+    async def announce(position: int, depth: int) -> None:
+        await broker.publish(
+            message_id,
+            MessageEvent(
+                event="status",
+                data={"state": "queued", "message_id": message_id, "position": position, "queue_depth": depth},
+            ),
+        )
 
-    asyncio.create_task(runner())
+    # 任务由调度器持有，排队期间按位置变化推送 queued 状态
+    job = GenerationJob(
+        message_id=message_id,
+        user_id=current_user.uid,
+        user_class=current_user.user_type,
+        run=runner,
+        on_position=announce,
+    )
+    try:
+        get_generation_scheduler().submit(job)
+    except SchedulerQueueFull:
+        await broker.close(message_id)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="generation queue is full",
+            headers={"Retry-After": "5"},
+        )
     return MessageCreateResponse(message_id=message_id)
 
 
+@router.delete(
+    "/messages/{message_id}", response_model=MessageCancelResponse, status_code=status.HTTP_202_ACCEPTED
+)
+async def cancel_message(
+    message_id: str,
+    request: Request,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+) -> MessageCancelResponse:
+    """
+    停止生成：排队中的任务直接移除；运行中的任务中止上游请求，已生成的部分回复照常保存，
+    订阅者随后收到 cancelled 事件。只能取消自己的消息，已结束或不属于当前用户的消息返回 404。
+
+    生成任务只存在于创建消息的 worker 进程内；多 worker 部署时由粘性路由（sticky_dispatch 或
+    deploy/web.conf 示例）按消息 ID 中的 worker 标识把该请求送到持有任务的 worker。
+    """
+    broker: MessageBrokerBackend = request.app.state.message_broker
+    scheduler = get_generation_scheduler()
+    job = scheduler.find(message_id)
+    if job is None or job.user_id != current_user.uid:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="message not found or already finished")
+
+    queued = job.task is None
+    scheduler.cancel(message_id, reason="user")
+    if not queued:
+        return MessageCancelResponse(message_id=message_id, state="cancelling")
+
+    ai_generations_cancelled_total.labels(reason="user").inc()
+    await broker.publish(
+        message_id,
+        MessageEvent(event="cancelled", data={"message_id": message_id, "reason": "user", "reply": ""}),
+    )
+    await broker.close(message_id)
+    return MessageCancelResponse(message_id=message_id, state="cancelled")
+
+
+def _parse_last_event_id(request: Request) -> int:
+    """解析断线重连携带的 Last-Event-ID，非法值视为从头回放。"""
+
+    raw = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+    try:
+        return max(int(raw), 0) if raw else 0
+    except ValueError:
+        return 0
+
+
+def _wants_reply(request: Request) -> bool:
+    """客户端可通过 include_reply=false 让 completed 事件省略完整回复，由 content_delta 自行拼接。"""
+
+    return request.query_params.get("include_reply", "true").lower() not in {"0", "false", "no"}
+
+
+def _stream_compression(request: Request) -> Dict[str, Any]:
+    """启用压缩时按 Accept-Encoding 协商，返回 EventStreamResponse 的压缩参数。"""
+
+    settings = get_settings()
+    if not settings.sse_compression_enabled:
+        return {}
+    encoding = negotiate_stream_encoding(request.headers.get("accept-encoding"))
+    if encoding is None:
+        return {}
+    return {"content_encoding": encoding, "compression_level": settings.sse_compression_level}
+
+
+# 原生客户端可通过 Accept 协商长度前缀的 MessagePack 帧，其余客户端使用 SSE 文本
+_MSGPACK_MEDIA_TYPES = ("application/vnd.msgpack", "application/x-msgpack", "application/msgpack")
+_MEDIA_TYPES: Dict[str, str] = {"sse": "text/event-stream", "msgpack": "application/vnd.msgpack"}
+
+
+def _negotiate_encoding(request: Request) -> FrameEncoding:
+    """按 Accept 的媒体类型与 q 值选择帧编码；显式列出 MessagePack 且权重不低于 SSE 时才使用。"""
+
+    if "msgpack" not in available_encodings():
+        return "sse"
+    msgpack_q = sse_q = 0.0
+    for item in request.headers.get("accept", "").lower().split(","):
+        media, *params = item.split(";")
+        media = media.strip()
+        q = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media in _MSGPACK_MEDIA_TYPES:
+            msgpack_q = max(msgpack_q, q)
+        elif media == _MEDIA_TYPES["sse"]:
+            sse_q = max(sse_q, q)
+    # 通配符不算选择 MessagePack，q=0 表示明确拒绝
+    if msgpack_q > 0 and msgpack_q >= sse_q:
+        return "msgpack"
+    return "sse"
+
+
+def _retry_hint_ms() -> int:
+    settings = get_settings()
+    return jittered_retry_ms(settings.sse_reconnect_retry_ms, settings.sse_reconnect_jitter_ms)
+
+
+def _drain_handle(
+    response: EventStreamResponse, encoding: FrameEncoding = "sse", message_id: Optional[str] = None
+) -> Callable[[int], None]:
+    """下线排空时先推送 reconnect 控制事件（不带 id，不影响 Last-Event-ID），再结束流。"""
+
+    def drain(reconnect_in_ms: int) -> None:
+        data: Dict[str, Any] = {"reconnect_in_ms": reconnect_in_ms}
+        if message_id is not None:
+            data["message_id"] = message_id
+        response.drain(reconnect_in_ms, encode_frame(MessageEvent(event="reconnect", data=data), encoding))
+
+    return drain
+
+
 @router.get("/messages/{message_id}/events")
 async def stream_message_events(
     message_id: str,
     request: Request,
     current_user: AuthenticatedUser = Depends(get_current_user),
-) -> StreamingResponse:
-    broker: MessageEventBroker = request.app.state.message_broker
-    queue = broker.get_channel(message_id)
-    if queue is None:
+) -> EventStreamResponse:
+    broker: MessageBrokerBackend = request.app.state.message_broker
+    # 他人的消息与不存在的消息同样返回 404，不暴露消息是否存在
+    if not await broker.is_visible_to(message_id, current_user.uid):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="message not found")
 
     # 检查SSE并发限制
     conversation_id = request.query_params.get("conversation_id")
-    connection_id = f"{current_user.uid}:{message_id}"
+    # 同一消息可被多个设备同时订阅，连接标识需逐连接唯一
+    connection_id = f"{current_user.uid}:{message_id}:{uuid4().hex[:8]}"
 
     concurrency_error = await check_sse_concurrency(
         connection_id, current_user, conversation_id, message_id, request
@@ -77,35 +241,113 @@ async def stream_message_events(
     if concurrency_error:
         return concurrency_error
 
-    settings = get_settings()
-    heartbeat_interval = max(settings.event_stream_heartbeat_seconds, 0.5)
+    # 并发检查期间通道可能已过保留期被回收
+    subscription = await broker.subscribe(message_id, _parse_last_event_id(request))
+    if subscription is None:
+        await unregister_sse_connection(connection_id)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="message not found")
 
-    async def event_generator():
-        try:
-            while True:
-                if await request.is_disconnected():
-                    break
-                try:
-                    item = await asyncio.wait_for(queue.get(), timeout=heartbeat_interval)
-                except asyncio.TimeoutError:
-                    heartbeat = json.dumps({"message_id": message_id, "event": "heartbeat"})
-                    yield f"event: heartbeat\ndata: {heartbeat}\n\n"
-                    continue
+    encoding = _negotiate_encoding(request)
+    # 心跳帧每条流只编码一次，由全局调度器在空闲时唤醒写出
+    heartbeat_frame = encode_frame(
+        MessageEvent(event="heartbeat", data={"message_id": message_id, "event": "heartbeat"}), encoding
+    )
+    heartbeats = get_heartbeat_scheduler()
+    heartbeat = heartbeats.register(subscription.wake)
 
-                if item is None:
-                    break
+    omit_reply = not _wants_reply(request)
+    event_generator = stream_subscription(
+        subscription,
+        heartbeat,
+        heartbeat_frame,
+        render=lambda item: encode_frame(item, encoding, omit_reply),
+        coalesce_seconds=get_settings().sse_coalesce_window_ms / 1000,
+    )
 
-                yield f"event: {item.event}\ndata: {json.dumps(item.data)}\n\n"
-        finally:
-            # 清理连接
-            await broker.close(message_id)
-            await unregister_sse_connection(connection_id)
-
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-        }
+    async def release() -> None:
+        # 通道由生产者关闭并在保留期后回收，这里只释放自己的游标、心跳与连接名额
+        heartbeats.unregister(heartbeat)
+        subscription.close()
+        await unregister_sse_connection(connection_id)
+
+    response = EventStreamResponse(
+        event_generator,
+        on_close=release,
+        media_type=_MEDIA_TYPES[encoding],
+        headers={"Vary": "Accept"},
+        retry_hint_ms=_retry_hint_ms() if encoding == "sse" else None,
+        **_stream_compression(request),
+    )
+    # 强制断开、回收空闲与超龄连接或下线排空时由守卫直接终止写出
+    bound = bind_sse_cancel(
+        connection_id, response.cancel, lambda: response.last_write, _drain_handle(response, encoding, message_id)
+    )
+    if not bound:
+        # 绑定前连接已被回收或排空，没有终止句柄的流将无法再被停止：立即结束，只下发 retry: 提示
+        response.cancel()
+    return response
+
+
+# 多路复用流的心跳不属于任何消息，全进程共用一份
+_MUX_HEARTBEAT_FRAME = encode_frame(MessageEvent(event="heartbeat", data={"event": "heartbeat"}))
+
+
+def _parse_mux_last_event_id(request: Request) -> Dict[str, int]:
+    """多路复用流的 Last-Event-ID 形如 "<message_id>:<序号>"，只对该消息续传。"""
+
+    raw = request.headers.get("last-event-id") or request.query_params.get("last_event_id") or ""
+    message_id, sep, sequence = raw.rpartition(":")
+    if not sep or not message_id:
+        return {}
+    try:
+        return {message_id: max(int(sequence), 0)}
+    except ValueError:
+        return {}
+
+
+@router.get("/events")
+async def stream_user_events(
+    request: Request,
+    current_user: AuthenticatedUser = Depends(get_current_user),
+) -> EventStreamResponse:
+    """
+    当前用户全部消息的多路复用 SSE 流：连接时未结束的消息与之后新建的消息都在同一连接上推送。
+
+    每帧的 data 中含 message_id，id 为 "<message_id>:<序号>"；重连时仅对 Last-Event-ID 指向的消息续传，
+    其余未结束的消息从回放窗口起点重新推送，客户端按 id 去重。
+    """
+    broker: MessageBrokerBackend = request.app.state.message_broker
+
+    # 每设备一条流，按一个连接占用并发名额
+    connection_id = f"{current_user.uid}:*:{uuid4().hex[:8]}"
+    concurrency_error = await check_sse_concurrency(connection_id, current_user, None, "*", request)
+    if concurrency_error:
+        return concurrency_error
+
+    feed = await broker.watch_owner(current_user.uid, _parse_mux_last_event_id(request))
+    heartbeats = get_heartbeat_scheduler()
+    heartbeat = heartbeats.register(feed.wake)
+
+    omit_reply = not _wants_reply(request)
+    event_generator = stream_subscription(
+        feed,
+        heartbeat,
+        _MUX_HEARTBEAT_FRAME,
+        render=lambda item: encode_mux_sse_frame(item[0], item[1], omit_reply),
+        coalesce_seconds=get_settings().sse_coalesce_window_ms / 1000,
+    )
+
+    async def release() -> None:
+        heartbeats.unregister(heartbeat)
+        feed.close()
+        await unregister_sse_connection(connection_id)
+
+    response = EventStreamResponse(
+        event_generator,
+        on_close=release,
+        retry_hint_ms=_retry_hint_ms(),
+        **_stream_compression(request),
     )
+    if not bind_sse_cancel(connection_id, response.cancel, lambda: response.last_write, _drain_handle(response)):
+        response.cancel()
+    return response
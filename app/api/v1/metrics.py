@@ -19,6 +19,27 @@ async def metrics():
     - jwks_cache_hits_total: JWKS缓存命中总数
     - active_connections: 活跃连接数
     - rate_limit_blocks_total: 限流阻止总数
+    - message_channels_active: 活跃消息通道数
+    - message_channels_reaped_total: 消息通道回收总数（unsubscribed/max_lifetime 即泄漏通道）
+    - sse_connections_reaped_total: SSE 连接回收总数（idle 多为半开连接，max_age 为到达最长存活时间）
+    - upstream_pool_connections: 上游 AI 连接池连接数（active/idle）
+    - upstream_pool_requests_waiting: 等待上游连接的请求数（持续大于 0 说明连接上限不足）
+    - upstream_connections_opened_total: 上游新建 TCP 连接总数
+    - ai_reply_cache_requests_total: AI 回复缓存查询总数（hit/miss/bypass，bypass 为用户选择不使用缓存）
+    - ai_reply_cache_bytes: AI 回复缓存占用字节数
+    - ai_generations_coalesced_total: 合并到相同在途生成的请求总数
+    - generations_running: 运行中的生成任务数
+    - generation_queue_depth: 排队中的生成任务数（按用户类型）
+    - generation_queue_wait_seconds: 生成任务排队等待时间（按用户类型）
+    - ai_backend_requests_total: 上游后端请求总数（success/error/cancelled，cancelled 多为对冲败者）
+    - ai_hedged_requests_total: 对冲请求总数（按首个增量来自 primary 还是 hedge）
+    - ai_backend_latency_ewma_seconds: 各上游后端首字延迟 EWMA
+    - ai_backend_circuit_state: 各上游后端熔断状态（0=closed，1=half_open，2=open）
+    - ai_backend_circuit_transitions_total: 熔断状态变更总数（按后端与目标状态）
+    - ai_upstream_retries_total: 瞬时故障后的上游重试总数
+    - ai_circuit_rejections_total: 因全部后端熔断而快速失败的生成总数
+    - ai_generations_cancelled_total: 被取消的生成总数（user 为用户停止，idle 为无人订阅超过宽限期）
+    - ai_upstream_tokens_saved_total: 中止上游生成省下的输出 token 估算总数
     """
     metrics_data = generate_latest()
     return Response(content=metrics_data, media_type=CONTENT_TYPE_LATEST)
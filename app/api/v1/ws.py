@@ -0,0 +1,280 @@
+"""WebSocket 传输：单个连接上订阅多条消息的事件流。
+
+协议（均为 JSON 文本帧）：
+
+客户端 -> 服务端
+    {"op": "auth", "token": "<jwt>"}                        握手未携带 token 时的首条消息
+    {"op": "subscribe", "message_id": "...", "last_event_id": 0, "include_reply": true}
+    {"op": "unsubscribe", "message_id": "..."}
+    {"op": "ping"}
+
+服务端 -> 客户端
+    {"type": "ready", "uid": "..."}
+    {"type": "subscribed" | "unsubscribed", "message_id": "..."}
+    {"type": "event", "message_id": "...", "id": 1, "event": "content_delta", "data": {...}}
+    {"type": "end", "message_id": "...", "reason": "completed" | "lagged" | "terminated"}
+    {"type": "error", "code": "...", "message": "...", "message_id": "..."}
+    {"type": "pong"}
+    {"type": "reconnect", "reconnect_in_ms": 1234}           服务端下线前发送，随后以 1012 关闭连接
+
+并发限制按活跃订阅计数，与 SSE 连接共用 SSEConcurrencyGuard 的名额。
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+from uuid import uuid4
+
+import anyio
+import orjson
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.security.utils import get_authorization_scheme_param
+
+from app.auth import AuthenticatedUser
+from app.auth.jwt_verifier import get_jwt_verifier
+from app.core.sse_guard import acquire_sse_slot, bind_sse_cancel, unregister_sse_connection
+from app.services.message_broker import EventSubscription, MessageBrokerBackend, MessageEvent, without_reply
+from app.settings.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["messages"])
+
+# 4000 + HTTP 状态码，便于客户端区分认证失败与普通断开
+CLOSE_UNAUTHORIZED = 4401
+# 服务重启，客户端应按 reconnect 消息中的等待时间重连
+CLOSE_SERVICE_RESTART = 1012
+
+
+def _encode_event(message_id: str, event: MessageEvent) -> str:
+    return orjson.dumps(
+        {"type": "event", "message_id": message_id, "id": event.id, "event": event.event, "data": event.data}
+    ).decode()
+
+
+def ws_frame_for(message_id: str, event: MessageEvent, omit_reply: bool = False) -> str:
+    """WebSocket 事件帧，与 SSE 帧一样每个事件只编码一次并由所有连接共享。"""
+
+    if omit_reply and event.event == "completed" and "reply" in event.data:
+        return event.variant("ws_slim", lambda item: _encode_event(message_id, without_reply(item)))
+    return event.variant("ws", lambda item: _encode_event(message_id, item))
+
+
+class MessageSocketSession:
+    """单个 WebSocket 连接上的订阅集合：每个订阅一个转发任务，写出经同一把锁串行化。"""
+
+    def __init__(self, websocket: WebSocket, user: AuthenticatedUser, broker: MessageBrokerBackend) -> None:
+        self.websocket = websocket
+        self.user = user
+        self.broker = broker
+        self._token = uuid4().hex[:8]
+        self._send_lock = asyncio.Lock()
+        self._subscriptions: Dict[str, EventSubscription] = {}
+        self._forwarders: Dict[str, asyncio.Task] = {}
+        self._drain_task: Optional[asyncio.Task] = None
+
+    @property
+    def subscription_count(self) -> int:
+        return len(self._subscriptions)
+
+    def _connection_id(self, message_id: str) -> str:
+        return f"{self.user.uid}:{message_id}:ws-{self._token}"
+
+    async def send(self, payload: Dict[str, Any]) -> None:
+        await self.send_text(orjson.dumps(payload).decode())
+
+    async def send_text(self, text: str) -> None:
+        async with self._send_lock:
+            await self.websocket.send_text(text)
+
+    async def error(self, code: str, message: str, message_id: Optional[str] = None, **extra: Any) -> None:
+        payload: Dict[str, Any] = {"type": "error", "code": code, "message": message}
+        if message_id is not None:
+            payload["message_id"] = message_id
+        payload.update(extra)
+        await self.send(payload)
+
+    async def run(self) -> None:
+        while True:
+            text = await _receive_text(self.websocket)
+            if text is None:
+                await self.error("invalid_json", "message must be a JSON object")
+                continue
+            try:
+                request = orjson.loads(text)
+            except orjson.JSONDecodeError:
+                await self.error("invalid_json", "message must be a JSON object")
+                continue
+            if not isinstance(request, dict):
+                await self.error("invalid_json", "message must be a JSON object")
+                continue
+
+            op = request.get("op")
+            if op == "subscribe":
+                await self.subscribe(request)
+            elif op == "unsubscribe":
+                message_id = request.get("message_id")
+                if await self.unsubscribe(message_id):
+                    await self.send({"type": "unsubscribed", "message_id": message_id})
+                else:
+                    await self.error("not_subscribed", "message is not subscribed", message_id)
+            elif op == "ping":
+                await self.send({"type": "pong"})
+            else:
+                await self.error("unknown_op", f"unsupported op: {op!r}")
+
+    async def subscribe(self, request: Dict[str, Any]) -> None:
+        message_id = request.get("message_id")
+        if not isinstance(message_id, str) or not message_id:
+            await self.error("invalid_request", "message_id is required")
+            return
+        if message_id in self._subscriptions:
+            await self.error("already_subscribed", "message is already subscribed", message_id)
+            return
+        if not await self.broker.is_visible_to(message_id, self.user.uid):
+            # 他人的消息与不存在的消息同样回复 not_found，不暴露消息是否存在
+            await self.error("not_found", "message not found", message_id)
+            return
+
+        connection_id = self._connection_id(message_id)
+        allowed, reason, retry_after = await acquire_sse_slot(
+            connection_id, self.user, request.get("conversation_id"), message_id, self.websocket
+        )
+        if not allowed:
+            await self.error("SSE_CONCURRENCY_LIMIT_EXCEEDED", reason, message_id, retry_after=retry_after)
+            return
+
+        last_event_id = request.get("last_event_id") or 0
+        subscription = await self.broker.subscribe(
+            message_id, max(last_event_id, 0) if isinstance(last_event_id, int) else 0
+        )
+        if subscription is None:
+            await unregister_sse_connection(connection_id)
+            await self.error("not_found", "message not found", message_id)
+            return
+
+        # 强制断开时关闭订阅游标，转发任务随即以 terminated 结束
+        if not bind_sse_cancel(connection_id, subscription.close, drain=self.drain):
+            # 绑定前名额已被回收或排空，这条订阅不再受守卫管理，直接放弃
+            subscription.close()
+            await self.error("terminated", "subscription was terminated by the server", message_id)
+            return
+        self._subscriptions[message_id] = subscription
+        await self.send({"type": "subscribed", "message_id": message_id})
+        omit_reply = request.get("include_reply", True) is False
+        self._forwarders[message_id] = asyncio.create_task(self._forward(message_id, subscription, omit_reply))
+
+    async def unsubscribe(self, message_id: Any) -> bool:
+        subscription = self._subscriptions.pop(message_id, None)
+        if subscription is None:
+            return False
+        subscription.close()
+        forwarder = self._forwarders.pop(message_id, None)
+        if forwarder is not None and forwarder is not asyncio.current_task():
+            forwarder.cancel()
+            await asyncio.gather(forwarder, return_exceptions=True)
+        await unregister_sse_connection(self._connection_id(message_id))
+        return True
+
+    async def _forward(self, message_id: str, subscription: EventSubscription, omit_reply: bool) -> None:
+        try:
+            while True:
+                item = subscription.next_event()
+                if item is None:
+                    if subscription.exhausted:
+                        break
+                    await subscription.wait()
+                    continue
+                await self.send_text(ws_frame_for(message_id, item, omit_reply))
+            if subscription.lagged:
+                reason = "lagged"
+            elif subscription.channel.closed:
+                reason = "completed"
+            else:
+                reason = "terminated"
+            if await self.unsubscribe(message_id):
+                await self.send({"type": "end", "message_id": message_id, "reason": reason})
+        except (WebSocketDisconnect, RuntimeError):
+            # 连接已断开，由 close() 统一清理
+            pass
+
+    def drain(self, reconnect_in_ms: int) -> None:
+        """下线排空：每个订阅都会回调一次，整条连接只通知并关闭一次。"""
+        if self._drain_task is None:
+            self._drain_task = asyncio.create_task(self._drain(reconnect_in_ms))
+
+    async def _drain(self, reconnect_in_ms: int) -> None:
+        try:
+            await self.send({"type": "reconnect", "reconnect_in_ms": reconnect_in_ms})
+            await self.websocket.close(code=CLOSE_SERVICE_RESTART)
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+
+    async def close(self) -> None:
+        for message_id in list(self._subscriptions):
+            await self.unsubscribe(message_id)
+
+
+async def _receive_text(websocket: WebSocket) -> Optional[str]:
+    """接收一帧；协议只使用 JSON 文本帧，二进制帧返回 None。"""
+
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    return message.get("text")
+
+
+def _handshake_token(websocket: WebSocket) -> Optional[str]:
+    scheme, param = get_authorization_scheme_param(websocket.headers.get("authorization"))
+    if scheme.lower() == "bearer" and param:
+        return param
+    return websocket.query_params.get("token")
+
+
+async def _authenticate(websocket: WebSocket) -> Optional[AuthenticatedUser]:
+    """握手携带的 token 优先，否则等待首条 auth 消息；整个连接只验证一次。"""
+
+    token = _handshake_token(websocket)
+    if token is None:
+        try:
+            text = await asyncio.wait_for(_receive_text(websocket), timeout=get_settings().ws_auth_timeout_seconds)
+            message = orjson.loads(text) if text is not None else None
+        except (asyncio.TimeoutError, orjson.JSONDecodeError):
+            return None
+        if isinstance(message, dict) and message.get("op") == "auth" and isinstance(message.get("token"), str):
+            token = message["token"]
+    if not token:
+        return None
+
+    try:
+        return get_jwt_verifier().verify_token(token)
+    except HTTPException:
+        return None
+
+
+@router.websocket("/ws")
+async def message_socket(websocket: WebSocket) -> None:
+    await websocket.accept()
+    try:
+        user = await _authenticate(websocket)
+    except WebSocketDisconnect:
+        return
+    if user is None:
+        await websocket.send_text(
+            orjson.dumps({"type": "error", "code": "unauthorized", "message": "authentication failed"}).decode()
+        )
+        await websocket.close(code=CLOSE_UNAUTHORIZED)
+        return
+
+    session = MessageSocketSession(websocket, user, websocket.app.state.message_broker)
+    await session.send({"type": "ready", "uid": user.uid})
+    try:
+        await session.run()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # 连接被取消时也要归还订阅名额
+        with anyio.CancelScope(shield=True):
+            await session.close()
+        logger.info("WebSocket连接已关闭 user_id=%s", user.uid)
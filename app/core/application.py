@@ -11,15 +11,31 @@ from app.core.exceptions import register_exception_handlers
 from app.core.middleware import TraceIDMiddleware
 from app.core.policy_gate import PolicyGateMiddleware
 from app.core.rate_limiter import RateLimitMiddleware
-from app.services.ai_service import AIService, MessageEventBroker
+from app.core.sse_guard import get_sse_guard, install_drain_signal_handler
+from app.services.ai_service import AIService
+from app.services.generation_scheduler import get_generation_scheduler
+from app.services.message_broker import create_message_broker
+from app.services.upstream_client import get_upstream_pool
 from app.settings.config import get_settings
 
 
 @asynccontextmanager
-async def lifespan(_: FastAPI):
-    """暂留钩子，后续可在此注册连接池等资源。"""
+async def lifespan(app: FastAPI):
+    """应用生命周期钩子：启动连接回收、租约续约与上游连接预热，下线时排空 SSE 连接并释放资源。"""
 
+    sse_guard = get_sse_guard()
+    sse_guard.start()
+    restore_sigterm = install_drain_signal_handler()
+    upstream_pool = get_upstream_pool()
+    upstream_pool.start()
     yield
+    if restore_sigterm is not None:
+        restore_sigterm()
+    sse_guard.drain()
+    await sse_guard.stop()
+    await get_generation_scheduler().shutdown()
+    await app.state.message_broker.shutdown()
+    await upstream_pool.aclose()
 
 
 def create_app() -> FastAPI:
@@ -52,7 +68,7 @@ def create_app() -> FastAPI:
         allow_credentials=settings.cors_allow_credentials,
     )
 
-    app.state.message_broker = MessageEventBroker()
+    app.state.message_broker = create_message_broker()
     app.state.ai_service = AIService()
 
     register_exception_handlers(app)
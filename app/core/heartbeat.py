@@ -0,0 +1,96 @@
+"""进程级 SSE 心跳调度：单一定时任务批量唤醒空闲流，避免每条事件创建计时器。"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Callable, Optional, Set
+
+from app.settings.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class HeartbeatHandle:
+    """单条流的心跳登记：记录最近一次写出时间，到期时由调度器唤醒。"""
+
+    __slots__ = ("last_write", "due", "_wake")
+
+    def __init__(self, wake: Callable[[], None]) -> None:
+        self.last_write = time.monotonic()
+        self.due = False
+        self._wake = wake
+
+    def touch(self) -> None:
+        """流成功写出任意帧后调用，推迟下一次心跳。"""
+
+        self.last_write = time.monotonic()
+        self.due = False
+
+    def consume_due(self) -> bool:
+        """心跳到期时返回 True 并重置计时。"""
+
+        if not self.due:
+            return False
+        self.touch()
+        return True
+
+
+class HeartbeatScheduler:
+    """全局心跳节拍器，每个节拍对所有空闲超过间隔的流批量置位并唤醒。"""
+
+    def __init__(self, interval: Optional[float] = None) -> None:
+        settings = get_settings()
+        self.interval = max(interval or settings.event_stream_heartbeat_seconds, 0.5)
+        # 节拍取半个间隔，心跳实际间隔落在 [interval, 1.5 * interval]
+        self.tick_seconds = self.interval / 2
+        self._handles: Set[HeartbeatHandle] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def stream_count(self) -> int:
+        return len(self._handles)
+
+    def register(self, wake: Callable[[], None]) -> HeartbeatHandle:
+        handle = HeartbeatHandle(wake)
+        self._handles.add(handle)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return handle
+
+    def unregister(self, handle: HeartbeatHandle) -> None:
+        self._handles.discard(handle)
+
+    def tick(self) -> int:
+        """执行一次批量扫描，返回本轮触发心跳的流数量。"""
+
+        deadline = time.monotonic() - self.interval
+        fired = 0
+        for handle in self._handles:
+            if handle.last_write <= deadline and not handle.due:
+                handle.due = True
+                handle._wake()
+                fired += 1
+        return fired
+
+    async def _run(self) -> None:
+        # 没有登记的流时自动退出，下次登记时再拉起
+        while self._handles:
+            await asyncio.sleep(self.tick_seconds)
+            try:
+                self.tick()
+            except Exception:  # pragma: no cover - 运行时防护
+                logger.exception("SSE心跳调度失败")
+        self._task = None
+
+
+# 全局心跳调度器实例
+_heartbeat_scheduler: Optional[HeartbeatScheduler] = None
+
+
+def get_heartbeat_scheduler() -> HeartbeatScheduler:
+    """获取全局心跳调度器实例。"""
+    global _heartbeat_scheduler
+    if _heartbeat_scheduler is None:
+        _heartbeat_scheduler = HeartbeatScheduler()
+    return _heartbeat_scheduler
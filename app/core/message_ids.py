@@ -0,0 +1,34 @@
+"""消息 ID 格式：可选地嵌入生成该消息的 worker 标识，供粘性路由使用。"""
+from __future__ import annotations
+
+import re
+from typing import Optional, Tuple
+from uuid import uuid4
+
+# worker 标识：1-8 位小写字母或数字
+WORKER_ID_PATTERN = re.compile(r"^[a-z0-9]{1,8}$")
+# <worker>_<32位hex>；未配置 WORKER_ID 时沿用纯 32 位 hex
+_TAGGED_ID_PATTERN = re.compile(r"^(?P<worker>[a-z0-9]{1,8})_(?P<uuid>[0-9a-f]{32})$")
+_SEPARATOR = "_"
+
+
+def new_message_id(worker_id: Optional[str] = None) -> str:
+    """生成消息 ID，提供 worker_id 时以其为前缀。"""
+
+    token = uuid4().hex
+    if not worker_id:
+        return token
+    return f"{worker_id}{_SEPARATOR}{token}"
+
+
+def parse_message_id(message_id: str) -> Tuple[Optional[str], str]:
+    """
+    解析消息 ID。
+
+    Returns:
+        (worker_id, uuid_hex)；旧格式或无法识别的 ID 返回 (None, message_id)
+    """
+    match = _TAGGED_ID_PATTERN.match(message_id)
+    if match is None:
+        return None, message_id
+    return match.group("worker"), match.group("uuid")
@@ -58,6 +58,146 @@ rate_limit_blocks_total = Counter(
     ['reason', 'user_type']
 )
 
+# 7. 活跃消息通道数
+message_channels_active = Gauge(
+    'message_channels_active',
+    'Number of message event channels held by the broker'
+)
+
+# 8. 消息通道回收总数（按原因分类）
+message_channels_reaped_total = Counter(
+    'message_channels_reaped_total',
+    'Total number of message channels reaped by the broker sweeper',
+    ['reason']  # expired, unsubscribed, max_lifetime
+)
+
+# 9. SSE 连接回收总数（按原因分类）
+sse_connections_reaped_total = Counter(
+    'sse_connections_reaped_total',
+    'Total number of SSE connections closed by the connection reaper',
+    ['reason']  # idle, max_age
+)
+
+# 10. 上游 HTTP 连接池连接数（按状态分类）
+upstream_pool_connections = Gauge(
+    'upstream_pool_connections',
+    'Number of connections held by the upstream AI HTTP pool',
+    ['state']  # active, idle
+)
+
+# 11. 等待上游连接的请求数
+upstream_pool_requests_waiting = Gauge(
+    'upstream_pool_requests_waiting',
+    'Number of upstream requests waiting for a pooled connection'
+)
+
+# 12. 上游新建 TCP 连接总数（与请求数对比可得连接复用率）
+upstream_connections_opened_total = Counter(
+    'upstream_connections_opened_total',
+    'Total number of TCP connections opened to upstream AI endpoints'
+)
+
+# 13. AI 回复缓存查询总数（按结果分类，命中率 = hit / (hit + miss)）
+ai_reply_cache_requests_total = Counter(
+    'ai_reply_cache_requests_total',
+    'Total number of AI reply cache lookups',
+    ['result']  # hit, miss, bypass
+)
+
+# 14. AI 回复缓存占用字节数
+ai_reply_cache_bytes = Gauge(
+    'ai_reply_cache_bytes',
+    'Estimated memory held by the AI reply cache in bytes'
+)
+
+# 15. 合并到在途生成的请求总数（每次合并省去一次上游调用）
+ai_generations_coalesced_total = Counter(
+    'ai_generations_coalesced_total',
+    'Total number of AI generations served by joining an identical in-flight upstream call'
+)
+
+# 16. 运行中的生成任务数
+generations_running = Gauge(
+    'generations_running',
+    'Number of AI generation jobs currently running'
+)
+
+# 17. 排队中的生成任务数（按用户类型分类）
+generation_queue_depth = Gauge(
+    'generation_queue_depth',
+    'Number of AI generation jobs waiting in the scheduler queue',
+    ['user_class']  # permanent, anonymous
+)
+
+# 18. 生成任务排队等待时间（按用户类型分类）
+generation_queue_wait_seconds = Histogram(
+    'generation_queue_wait_seconds',
+    'Time AI generation jobs spend queued before starting',
+    ['user_class'],
+    buckets=(0.005, 0.05, 0.25, 1, 2.5, 5, 10, 30, 60, 120)
+)
+
+# 19. 上游后端请求总数（按后端与结果分类）
+ai_backend_requests_total = Counter(
+    'ai_backend_requests_total',
+    'Total upstream model requests per backend',
+    ['backend', 'result']  # success, error, cancelled
+)
+
+# 20. 对冲请求总数（按胜出方分类）
+ai_hedged_requests_total = Counter(
+    'ai_hedged_requests_total',
+    'Total hedged generations by which attempt produced the first token',
+    ['outcome']  # primary, hedge
+)
+
+# 21. 上游后端首字延迟 EWMA
+ai_backend_latency_ewma_seconds = Gauge(
+    'ai_backend_latency_ewma_seconds',
+    'EWMA of time to first token per upstream backend',
+    ['backend']
+)
+
+# 22. 上游后端熔断状态（0=closed，1=half_open，2=open）
+ai_backend_circuit_state = Gauge(
+    'ai_backend_circuit_state',
+    'Circuit breaker state per upstream backend (0=closed, 1=half_open, 2=open)',
+    ['backend']
+)
+
+# 23. 熔断状态变更总数（按后端与目标状态分类）
+ai_backend_circuit_transitions_total = Counter(
+    'ai_backend_circuit_transitions_total',
+    'Total circuit breaker state transitions per upstream backend',
+    ['backend', 'state']  # closed, open, half_open
+)
+
+# 24. 上游请求重试总数（按重试目标后端分类）
+ai_upstream_retries_total = Counter(
+    'ai_upstream_retries_total',
+    'Total retries of upstream model requests after transient failures',
+    ['backend']
+)
+
+# 25. 因全部后端熔断而快速失败的生成总数
+ai_circuit_rejections_total = Counter(
+    'ai_circuit_rejections_total',
+    'Total generations fast-failed because every upstream backend circuit was open'
+)
+
+# 26. 被取消的生成总数（按取消来源分类）
+ai_generations_cancelled_total = Counter(
+    'ai_generations_cancelled_total',
+    'Total AI generations cancelled before completion',
+    ['reason']  # user, idle, shutdown
+)
+
+# 27. 因中止上游生成而省下的输出 token 估算总数
+ai_upstream_tokens_saved_total = Counter(
+    'ai_upstream_tokens_saved_total',
+    'Estimated upstream completion tokens not generated because the stream was aborted'
+)
+
 
 @dataclass
 class RateLimitMetrics:
@@ -54,6 +54,7 @@ class PolicyGateMiddleware(BaseHTTPMiddleware):
             # 基础对话功能
             re.compile(r'^/api/v1/messages$'),  # POST 创建消息
             re.compile(r'^/api/v1/messages/[^/]+/events$'),  # GET SSE事件流
+            re.compile(r'^/api/v1/messages/(?!batch$)[^/]+$'),  # DELETE 停止生成
 
             # 获取模型列表（只读）
             re.compile(r'^/api/v1/llm/models$'),  # GET 获取模型列表
@@ -189,6 +190,7 @@ def get_anonymous_allowed_endpoints() -> List[str]:
         # 基础对话功能
         "POST /api/v1/messages",
         "GET /api/v1/messages/{message_id}/events",
+        "DELETE /api/v1/messages/{message_id}",
 
         # 模型查询
         "GET /api/v1/llm/models",
@@ -3,22 +3,34 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import math
+import random
+import signal
+import threading
 import time
 from collections import defaultdict
 from dataclasses import dataclass, field
-from typing import Dict, Set, Optional
+from typing import Callable, Dict, List, Set, Optional, Tuple
 
-from starlette.requests import Request
+from starlette.requests import HTTPConnection, Request
 from starlette.responses import JSONResponse
 
 from app.auth import AuthenticatedUser
 from app.core.exceptions import create_error_response
 from app.core.middleware import get_current_trace_id
+from app.core.rate_limiter import TokenBucket
+from app.core.sse_leases import LeaseBackend, LeaseClaim, create_lease_backend
 from app.settings.config import get_settings
 
 logger = logging.getLogger(__name__)
 
 
+CancelHandle = Callable[[], None]
+ActivityProbe = Callable[[], float]
+# 下线排空时调用，参数为建议客户端重连前等待的毫秒数
+DrainHandle = Callable[[int], None]
+
+
 @dataclass
 class ConnectionInfo:
     """连接信息。"""
@@ -28,25 +40,73 @@ class ConnectionInfo:
     start_time: float
     client_ip: str
     user_agent: str
+    # 终止该连接的回调（取消 SSE 写出任务或关闭 WebSocket 订阅），由连接建立后绑定
+    cancel: Optional[CancelHandle] = field(default=None, repr=False)
+    # 返回最近一次成功写出的 monotonic 时间；未绑定的连接不参与空闲回收
+    last_write: Optional[ActivityProbe] = field(default=None, repr=False)
+    # 下线排空回调；未绑定时排空退化为直接终止
+    drain: Optional[DrainHandle] = field(default=None, repr=False)
+    started_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class _UserShard:
+    """单个用户的连接分片。"""
+    connections: Dict[str, ConnectionInfo] = field(default_factory=dict)
 
 
 class SSEConcurrencyGuard:
-    """SSE 并发控制守卫。"""
+    """
+    SSE 并发控制守卫。
+
+    连接按用户分片存放，对话维度只维护计数，检查与登记均为 O(1)。
+    所有状态只在事件循环线程内修改，且检查到登记之间没有 await，不需要全局锁；
+    强制断开与过期清理会调用连接绑定的 cancel 回调，真正结束客户端的流。
+    后台回收任务按最近一次成功写出与连接时长关闭空闲、半开或超龄的连接。
+
+    配置了租约后端时，本地检查通过后还需在集群范围内占用租约，多 worker 共享同一套上限；
+    本进程持有的租约由后台任务按批续约，worker 崩溃后名额随租约过期自动释放。
+
+    重启后的重连风暴由三处平滑：每条流下发带抖动的 retry:、下线时把客户端的重连时间
+    分散到排空窗口内，以及新连接的全局令牌桶准入。
+    """
 
-    def __init__(self):
+    def __init__(self, leases: Optional[LeaseBackend] = None):
         self.settings = get_settings()
-        # 活跃连接跟踪
-        self.active_connections: Dict[str, ConnectionInfo] = {}  # connection_id -> info
-        self.user_connections: Dict[str, Set[str]] = defaultdict(set)  # user_id -> connection_ids
-        self.conversation_connections: Dict[str, Set[str]] = defaultdict(set)  # conversation_id -> connection_ids
+        # 活跃连接跟踪：connection_id -> user_id 用于 O(1) 注销，连接详情存放在用户分片中
+        self._owners: Dict[str, str] = {}
+        self._shards: Dict[str, _UserShard] = {}
+        self._conversation_counts: Dict[str, int] = {}
 
         # 统计信息
         self.total_connections_created = 0
         self.total_connections_rejected = 0
         self.rejection_reasons: Dict[str, int] = defaultdict(int)
 
-        # 锁保护
-        self._lock = asyncio.Lock()
+        # 新连接准入令牌桶，速率为 0 时不限制
+        rate = self.settings.sse_admission_rate_per_second
+        burst = self.settings.sse_admission_burst
+        self._admission: Optional[TokenBucket] = (
+            TokenBucket(capacity=burst, tokens=burst, last_refill=time.time(), refill_rate=rate) if rate > 0 else None
+        )
+        self.draining = False
+
+        # 集群租约：connection_id -> 已占用的租约维度
+        self._leases = leases
+        self._leased: Dict[str, Tuple[LeaseClaim, ...]] = {}
+        self._releases: Set[asyncio.Task] = set()
+
+        # 后台任务：空闲与超龄连接回收、租约续约
+        self._reaper: Optional[asyncio.Task] = None
+        self._renewer: Optional[asyncio.Task] = None
+
+    @property
+    def active_count(self) -> int:
+        return len(self._owners)
+
+    def connection_count(self, user_id: str) -> int:
+        shard = self._shards.get(user_id)
+        return len(shard.connections) if shard else 0
 
     async def check_and_register_connection(
         self,
@@ -63,153 +123,396 @@ class SSEConcurrencyGuard:
         Returns:
             (allowed, reason, retry_after_seconds)
         """
-        async with self._lock:
-            user_id = user.uid
-
-            # 检查用户并发限制（根据用户类型设置不同限制）
-            user_connection_count = len(self.user_connections.get(user_id, set()))
-            is_anonymous = user.user_type == "anonymous"
-            max_concurrent = (
-                self.settings.sse_max_concurrent_per_anonymous_user if is_anonymous
-                else self.settings.sse_max_concurrent_per_user
+        user_id = user.uid
+
+        rejection = self._check_admission()
+        if rejection is not None:
+            return rejection
+
+        # 检查用户并发限制（根据用户类型设置不同限制）
+        user_connection_count = self.connection_count(user_id)
+        is_anonymous = user.user_type == "anonymous"
+        max_concurrent = (
+            self.settings.sse_max_concurrent_per_anonymous_user if is_anonymous
+            else self.settings.sse_max_concurrent_per_user
+        )
+
+        if user_connection_count >= max_concurrent:
+            self.total_connections_rejected += 1
+            self.rejection_reasons["user_limit_exceeded"] += 1
+
+            logger.warning(
+                "SSE用户并发限制 user_id=%s user_type=%s current=%d max=%d trace_id=%s",
+                user_id, user.user_type, user_connection_count, max_concurrent,
+                get_current_trace_id()
             )
+            return False, f"User concurrent SSE limit exceeded ({user_connection_count}/{max_concurrent})", 30
 
-            if user_connection_count >= max_concurrent:
+        # 检查对话并发限制（如果指定了conversation_id）
+        if conversation_id:
+            conv_connection_count = self._conversation_counts.get(conversation_id, 0)
+            if conv_connection_count >= self.settings.sse_max_concurrent_per_conversation:
                 self.total_connections_rejected += 1
-                self.rejection_reasons["user_limit_exceeded"] += 1
+                self.rejection_reasons["conversation_limit_exceeded"] += 1
 
                 logger.warning(
-                    "SSE用户并发限制 user_id=%s user_type=%s current=%d max=%d trace_id=%s",
-                    user_id, user.user_type, user_connection_count, max_concurrent,
+                    "SSE对话并发限制 conversation_id=%s current=%d max=%d trace_id=%s",
+                    conversation_id, conv_connection_count,
+                    self.settings.sse_max_concurrent_per_conversation,
                     get_current_trace_id()
                 )
-                return False, f"User concurrent SSE limit exceeded ({user_connection_count}/{max_concurrent})", 30
-
-            # 检查对话并发限制（如果指定了conversation_id）
-            if conversation_id:
-                conv_connection_count = len(self.conversation_connections.get(conversation_id, set()))
-                if conv_connection_count >= self.settings.sse_max_concurrent_per_conversation:
-                    self.total_connections_rejected += 1
-                    self.rejection_reasons["conversation_limit_exceeded"] += 1
-
-                    logger.warning(
-                        "SSE对话并发限制 conversation_id=%s current=%d max=%d trace_id=%s",
-                        conversation_id, conv_connection_count,
-                        self.settings.sse_max_concurrent_per_conversation,
-                        get_current_trace_id()
-                    )
-                    return False, f"Conversation concurrent SSE limit exceeded ({conv_connection_count}/{self.settings.sse_max_concurrent_per_conversation})", 10
-
-            # 注册连接
-            connection_info = ConnectionInfo(
-                user_id=user_id,
-                conversation_id=conversation_id,
-                message_id=message_id,
-                start_time=time.time(),
-                client_ip=client_ip,
-                user_agent=user_agent
-            )
+                return False, f"Conversation concurrent SSE limit exceeded ({conv_connection_count}/{self.settings.sse_max_concurrent_per_conversation})", 10
+
+        # 注册连接
+        connection_info = ConnectionInfo(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            message_id=message_id,
+            start_time=time.time(),
+            client_ip=client_ip,
+            user_agent=user_agent
+        )
 
-            self.active_connections[connection_id] = connection_info
-            self.user_connections[user_id].add(connection_id)
-            if conversation_id:
-                self.conversation_connections[conversation_id].add(connection_id)
+        self._owners[connection_id] = user_id
+        self._shards.setdefault(user_id, _UserShard()).connections[connection_id] = connection_info
+        if conversation_id:
+            self._conversation_counts[conversation_id] = self._conversation_counts.get(conversation_id, 0) + 1
 
-            self.total_connections_created += 1
+        if self._leases is not None:
+            rejection = await self._acquire_lease(connection_id, user_id, conversation_id, max_concurrent)
+            if rejection is not None:
+                return rejection
 
-            logger.info(
-                "SSE连接已注册 connection_id=%s user_id=%s conversation_id=%s message_id=%s trace_id=%s",
-                connection_id, user_id, conversation_id, message_id, get_current_trace_id()
+        self.total_connections_created += 1
+
+        logger.info(
+            "SSE连接已注册 connection_id=%s user_id=%s conversation_id=%s message_id=%s trace_id=%s",
+            connection_id, user_id, conversation_id, message_id, get_current_trace_id()
+        )
+
+        return True, "OK", None
+
+    def _check_admission(self) -> Optional[tuple[bool, str, Optional[int]]]:
+        """排空中拒绝新连接；令牌不足时拒绝，Retry-After 按补充速率估算并叠加抖动。"""
+        jitter_seconds = math.ceil(self.settings.sse_reconnect_jitter_ms / 1000)
+        if self.draining:
+            self.total_connections_rejected += 1
+            self.rejection_reasons["draining"] += 1
+            retry_after = math.ceil(self.settings.sse_drain_window_seconds) + random.randint(0, jitter_seconds)
+            return False, "Server is draining SSE connections", max(1, retry_after)
+
+        if self._admission is None or self._admission.consume():
+            return None
+
+        self.total_connections_rejected += 1
+        self.rejection_reasons["admission_rate_limited"] += 1
+        refill_seconds = (1 - self._admission.tokens) / self._admission.refill_rate
+        retry_after = max(1, math.ceil(refill_seconds)) + random.randint(0, jitter_seconds)
+        logger.warning(
+            "SSE新连接准入限流 retry_after=%d trace_id=%s", retry_after, get_current_trace_id()
+        )
+        return False, "SSE admission rate exceeded", retry_after
+
+    async def _acquire_lease(
+        self,
+        connection_id: str,
+        user_id: str,
+        conversation_id: Optional[str],
+        max_concurrent: int,
+    ) -> Optional[tuple[bool, str, Optional[int]]]:
+        """
+        在集群范围内占用租约，失败时撤销本地登记并返回拒绝结果。
+
+        本地登记先于租约申请完成，等待期间并发到达的同一用户请求仍受本地计数约束；
+        租约后端不可用时放行，退化为按进程计数。
+        """
+        claims: List[LeaseClaim] = [LeaseClaim("user", user_id, max_concurrent)]
+        if conversation_id:
+            claims.append(
+                LeaseClaim("conversation", conversation_id, self.settings.sse_max_concurrent_per_conversation)
+            )
+
+        try:
+            rejected = await self._leases.acquire(connection_id, claims)
+        except Exception:
+            logger.exception(
+                "SSE租约申请失败，退化为进程内计数 connection_id=%s trace_id=%s",
+                connection_id, get_current_trace_id()
             )
+            return None
+
+        if rejected is None:
+            if connection_id in self._owners:
+                self._leased[connection_id] = tuple(claims)
+                return None
+            # 等待租约期间连接已被强制断开
+            self._spawn_release(connection_id, tuple(claims))
+            return False, "Connection terminated", None
+
+        self._remove(connection_id)
+        self.total_connections_rejected += 1
+        if rejected.scope == "user":
+            self.rejection_reasons["user_limit_exceeded"] += 1
+            retry_after = 30
+            reason = f"User concurrent SSE limit exceeded across cluster (max {rejected.limit})"
+        else:
+            self.rejection_reasons["conversation_limit_exceeded"] += 1
+            retry_after = 10
+            reason = f"Conversation concurrent SSE limit exceeded across cluster (max {rejected.limit})"
+
+        logger.warning(
+            "SSE集群并发限制 scope=%s key=%s max=%d trace_id=%s",
+            rejected.scope, rejected.key, rejected.limit, get_current_trace_id()
+        )
+        return False, reason, retry_after
+
+    def _spawn_release(self, connection_id: str, claims: Tuple[LeaseClaim, ...]) -> None:
+        task = asyncio.create_task(self._release_lease(connection_id, claims))
+        self._releases.add(task)
+        task.add_done_callback(self._releases.discard)
 
-            return True, "OK", None
+    async def _release_lease(self, connection_id: str, claims: Tuple[LeaseClaim, ...]) -> None:
+        try:
+            await self._leases.release(connection_id, claims)
+        except Exception:
+            # 释放失败时租约会在 TTL 后自动过期
+            logger.warning("SSE租约释放失败 connection_id=%s", connection_id, exc_info=True)
+
+    def bind_cancel(
+        self,
+        connection_id: str,
+        cancel: CancelHandle,
+        last_write: Optional[ActivityProbe] = None,
+        drain: Optional[DrainHandle] = None,
+    ) -> bool:
+        """为已登记的连接绑定终止回调、写出探针与排空回调；连接已被注销时返回 False，调用方应直接结束。"""
+        info = self._lookup(connection_id)
+        if info is None:
+            return False
+        info.cancel = cancel
+        info.last_write = last_write
+        info.drain = drain
+        return True
+
+    def drain(self, window_seconds: Optional[float] = None) -> int:
+        """
+        下线前排空全部连接，并拒绝之后的新连接。
+
+        每条流收到 reconnect 控制事件后关闭，建议的重连等待按连接分层抖动、均匀分布在窗口内，
+        新实例不会在同一秒收到所有重连。返回排空的连接数。
+        """
+        window_ms = 1000 * (self.settings.sse_drain_window_seconds if window_seconds is None else window_seconds)
+        self.draining = True
+        connection_ids = list(self._owners)
+        random.shuffle(connection_ids)
+        drained = 0
+        for index, connection_id in enumerate(connection_ids):
+            connection_info = self._remove(connection_id)
+            if connection_info is None:
+                continue
+            reconnect_in_ms = int((index + random.random()) * window_ms / len(connection_ids))
+            try:
+                if connection_info.drain is not None:
+                    connection_info.drain(reconnect_in_ms)
+                elif connection_info.cancel is not None:
+                    connection_info.cancel()
+            except Exception:  # pragma: no cover - 运行时防护
+                logger.exception("排空SSE连接失败 connection_id=%s", connection_id)
+            drained += 1
+
+        if drained:
+            logger.warning("排空SSE连接 count=%d window_ms=%d", drained, window_ms)
+        return drained
+
+    def reap(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        关闭空闲或超龄的连接，返回按原因统计的回收数量。
+
+        空闲以最近一次成功写出为准：心跳会定期写出，因此长时间写不出去通常意味着
+        对端已消失而 TCP 连接处于半开状态，发送缓冲写满后 send 一直阻塞。
+        """
+        from app.core.metrics import sse_connections_reaped_total
+
+        now = time.monotonic() if now is None else now
+        idle_timeout = self.settings.sse_idle_timeout_seconds
+        max_age = self.settings.sse_max_connection_age_seconds
+        expired: Dict[str, str] = {}
+        for shard in self._shards.values():
+            for connection_id, info in shard.connections.items():
+                if max_age and now - info.started_at > max_age:
+                    expired[connection_id] = "max_age"
+                elif idle_timeout and info.last_write is not None and now - info.last_write() > idle_timeout:
+                    expired[connection_id] = "idle"
+
+        reaped: Dict[str, int] = defaultdict(int)
+        for connection_id, reason in expired.items():
+            if self._terminate(connection_id):
+                reaped[reason] += 1
+                sse_connections_reaped_total.labels(reason=reason).inc()
+        if reaped:
+            logger.info("回收SSE连接 %s trace_id=%s", dict(reaped), get_current_trace_id())
+        return dict(reaped)
+
+    def start(self) -> None:
+        """启动连接回收与租约续约后台任务。"""
+        self.draining = False
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._run_reaper())
+        if self._leases is not None and (self._renewer is None or self._renewer.done()):
+            self._renewer = asyncio.create_task(self._run_lease_renewer())
+
+    async def stop(self) -> None:
+        """停止后台任务，等待在途的租约释放完成后关闭租约后端。"""
+        for task in (self._reaper, self._renewer):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._reaper = None
+        self._renewer = None
+        if self._releases:
+            await asyncio.gather(*self._releases, return_exceptions=True)
+        if self._leases is not None:
+            await self._leases.shutdown()
+
+    async def renew_leases(self) -> int:
+        """一次往返续约本进程持有的全部租约，返回续约数量。"""
+        if self._leases is None or not self._leased:
+            return 0
+        leases = dict(self._leased)
+        await self._leases.renew(leases)
+        return len(leases)
+
+    async def _run_lease_renewer(self) -> None:
+        while True:
+            await asyncio.sleep(self.settings.sse_lease_renew_interval_seconds)
+            try:
+                await self.renew_leases()
+            except Exception:
+                logger.warning("SSE租约续约失败", exc_info=True)
+
+    async def _run_reaper(self) -> None:
+        while True:
+            await asyncio.sleep(self.settings.sse_reaper_interval_seconds)
+            try:
+                self.reap()
+            except Exception:  # pragma: no cover - 运行时防护
+                logger.exception("SSE连接回收失败")
 
     async def unregister_connection(self, connection_id: str) -> None:
         """注销SSE连接。"""
-        async with self._lock:
-            connection_info = self.active_connections.pop(connection_id, None)
-            if not connection_info:
-                return
-
-            # 从用户连接集合中移除
-            user_connections = self.user_connections.get(connection_info.user_id)
-            if user_connections:
-                user_connections.discard(connection_id)
-                if not user_connections:
-                    del self.user_connections[connection_info.user_id]
-
-            # 从对话连接集合中移除
-            if connection_info.conversation_id:
-                conv_connections = self.conversation_connections.get(connection_info.conversation_id)
-                if conv_connections:
-                    conv_connections.discard(connection_id)
-                    if not conv_connections:
-                        del self.conversation_connections[connection_info.conversation_id]
-
-            duration = time.time() - connection_info.start_time
-            logger.info(
-                "SSE连接已注销 connection_id=%s user_id=%s duration=%.2fs trace_id=%s",
-                connection_id, connection_info.user_id, duration, get_current_trace_id()
-            )
+        self._remove(connection_id)
+
+    def _lookup(self, connection_id: str) -> Optional[ConnectionInfo]:
+        user_id = self._owners.get(connection_id)
+        if user_id is None:
+            return None
+        return self._shards[user_id].connections.get(connection_id)
+
+    def _remove(self, connection_id: str) -> Optional[ConnectionInfo]:
+        """同步移除连接，重复调用是安全的。"""
+        user_id = self._owners.pop(connection_id, None)
+        if user_id is None:
+            return None
+
+        claims = self._leased.pop(connection_id, None)
+        if claims is not None:
+            self._spawn_release(connection_id, claims)
+
+        shard = self._shards[user_id]
+        connection_info = shard.connections.pop(connection_id)
+        if not shard.connections:
+            del self._shards[user_id]
+
+        conversation_id = connection_info.conversation_id
+        if conversation_id:
+            remaining = self._conversation_counts.get(conversation_id, 0) - 1
+            if remaining > 0:
+                self._conversation_counts[conversation_id] = remaining
+            else:
+                self._conversation_counts.pop(conversation_id, None)
+
+        duration = time.time() - connection_info.start_time
+        logger.info(
+            "SSE连接已注销 connection_id=%s user_id=%s duration=%.2fs trace_id=%s",
+            connection_id, connection_info.user_id, duration, get_current_trace_id()
+        )
+        return connection_info
+
+    def _terminate(self, connection_id: str) -> bool:
+        """注销连接并触发其终止回调。"""
+        connection_info = self._remove(connection_id)
+        if connection_info is None:
+            return False
+        if connection_info.cancel is not None:
+            try:
+                connection_info.cancel()
+            except Exception:  # pragma: no cover - 运行时防护
+                logger.exception("终止SSE连接失败 connection_id=%s", connection_id)
+        return True
 
     async def get_user_connections(self, user_id: str) -> Set[str]:
         """获取用户的活跃连接。"""
-        async with self._lock:
-            return self.user_connections.get(user_id, set()).copy()
+        shard = self._shards.get(user_id)
+        return set(shard.connections) if shard else set()
 
     async def get_conversation_connections(self, conversation_id: str) -> Set[str]:
         """获取对话的活跃连接。"""
-        async with self._lock:
-            return self.conversation_connections.get(conversation_id, set()).copy()
+        shard_items = (shard.connections.items() for shard in self._shards.values())
+        return {
+            connection_id
+            for items in shard_items
+            for connection_id, info in items
+            if info.conversation_id == conversation_id
+        }
 
     async def force_disconnect_user(self, user_id: str) -> int:
         """强制断开用户的所有连接。"""
-        async with self._lock:
-            connection_ids = self.user_connections.get(user_id, set()).copy()
-            for connection_id in connection_ids:
-                await self.unregister_connection(connection_id)
+        shard = self._shards.get(user_id)
+        connection_ids = list(shard.connections) if shard else []
+        disconnected = sum(self._terminate(connection_id) for connection_id in connection_ids)
 
-            logger.warning(
-                "强制断开用户连接 user_id=%s count=%d trace_id=%s",
-                user_id, len(connection_ids), get_current_trace_id()
-            )
-            return len(connection_ids)
+        logger.warning(
+            "强制断开用户连接 user_id=%s count=%d trace_id=%s",
+            user_id, disconnected, get_current_trace_id()
+        )
+        return disconnected
 
     async def get_stats(self) -> Dict:
         """获取统计信息。"""
-        async with self._lock:
-            return {
-                "active_connections": len(self.active_connections),
-                "active_users": len(self.user_connections),
-                "active_conversations": len(self.conversation_connections),
-                "total_created": self.total_connections_created,
-                "total_rejected": self.total_connections_rejected,
-                "rejection_reasons": dict(self.rejection_reasons),
-                "rejection_rate": (
-                    self.total_connections_rejected / max(1, self.total_connections_created + self.total_connections_rejected)
-                ) * 100
-            }
+        return {
+            "active_connections": len(self._owners),
+            "active_users": len(self._shards),
+            "active_conversations": len(self._conversation_counts),
+            "total_created": self.total_connections_created,
+            "total_rejected": self.total_connections_rejected,
+            "rejection_reasons": dict(self.rejection_reasons),
+            "rejection_rate": (
+                self.total_connections_rejected / max(1, self.total_connections_created + self.total_connections_rejected)
+            ) * 100
+        }
 
     async def cleanup_stale_connections(self, max_age_seconds: int = 3600) -> int:
         """清理过期连接。"""
-        async with self._lock:
-            now = time.time()
-            stale_connections = []
-
-            for connection_id, info in self.active_connections.items():
-                if now - info.start_time > max_age_seconds:
-                    stale_connections.append(connection_id)
-
-            for connection_id in stale_connections:
-                await self.unregister_connection(connection_id)
-
-            if stale_connections:
-                logger.info(
-                    "清理过期SSE连接 count=%d max_age=%ds trace_id=%s",
-                    len(stale_connections), max_age_seconds, get_current_trace_id()
-                )
+        now = time.time()
+        stale_connections = [
+            connection_id
+            for shard in self._shards.values()
+            for connection_id, info in shard.connections.items()
+            if now - info.start_time > max_age_seconds
+        ]
+
+        cleaned = sum(self._terminate(connection_id) for connection_id in stale_connections)
+        if cleaned:
+            logger.info(
+                "清理过期SSE连接 count=%d max_age=%ds trace_id=%s",
+                cleaned, max_age_seconds, get_current_trace_id()
+            )
 
-            return len(stale_connections)
+        return cleaned
 
 
 # 全局SSE守卫实例
@@ -220,7 +523,7 @@ def get_sse_guard() -> SSEConcurrencyGuard:
     """获取全局SSE守卫实例。"""
     global _sse_guard
     if _sse_guard is None:
-        _sse_guard = SSEConcurrencyGuard()
+        _sse_guard = SSEConcurrencyGuard(create_lease_backend())
     return _sse_guard
 
 
@@ -237,12 +540,8 @@ async def check_sse_concurrency(
     Returns:
         如果被拒绝则返回错误响应，否则返回None
     """
-    guard = get_sse_guard()
-    client_ip = _get_client_ip(request)
-    user_agent = request.headers.get("user-agent", "")
-
-    allowed, reason, retry_after = await guard.check_and_register_connection(
-        connection_id, user, conversation_id, message_id, client_ip, user_agent
+    allowed, reason, retry_after = await acquire_sse_slot(
+        connection_id, user, conversation_id, message_id, request
     )
 
     if not allowed:
@@ -260,13 +559,65 @@ async def check_sse_concurrency(
     return None
 
 
+async def acquire_sse_slot(
+    connection_id: str,
+    user: AuthenticatedUser,
+    conversation_id: Optional[str],
+    message_id: str,
+    connection: HTTPConnection
+) -> tuple[bool, str, Optional[int]]:
+    """按单条事件订阅占用并发名额，SSE 连接与 WebSocket 上的订阅共用同一套限制。"""
+    guard = get_sse_guard()
+    return await guard.check_and_register_connection(
+        connection_id,
+        user,
+        conversation_id,
+        message_id,
+        _get_client_ip(connection),
+        connection.headers.get("user-agent", ""),
+    )
+
+
+def bind_sse_cancel(
+    connection_id: str,
+    cancel: CancelHandle,
+    last_write: Optional[ActivityProbe] = None,
+    drain: Optional[DrainHandle] = None,
+) -> bool:
+    """为连接绑定终止回调、写出探针与排空回调的便捷函数。"""
+    return get_sse_guard().bind_cancel(connection_id, cancel, last_write, drain)
+
+
+def install_drain_signal_handler() -> Optional[Callable[[], None]]:
+    """
+    在服务器的 SIGTERM 处理器之前插入 SSE 排空，返回恢复原处理器的函数。
+
+    uvicorn 收到 SIGTERM 后会等待所有响应结束才执行 lifespan 关闭，长连接流因此需要在信号到达时
+    立即排空。只在主线程且已有服务器安装了处理器时生效。
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return None
+    previous = signal.getsignal(signal.SIGTERM)
+    if not callable(previous):
+        return None
+
+    loop = asyncio.get_running_loop()
+
+    def handle_sigterm(signum, frame) -> None:
+        loop.call_soon_threadsafe(get_sse_guard().drain)
+        previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    return lambda: signal.signal(signal.SIGTERM, previous)
+
+
 async def unregister_sse_connection(connection_id: str) -> None:
     """注销SSE连接的便捷函数。"""
     guard = get_sse_guard()
     await guard.unregister_connection(connection_id)
 
 
-def _get_client_ip(request: Request) -> str:
+def _get_client_ip(request: HTTPConnection) -> str:
     """获取客户端真实IP。"""
     # 检查代理头
     forwarded_for = request.headers.get("x-forwarded-for")
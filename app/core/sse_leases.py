@@ -0,0 +1,144 @@
+"""SSE 并发名额的集群级租约。"""
+from __future__ import annotations
+
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Dict, Mapping, NamedTuple, Optional, Sequence
+
+from app.settings.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseClaim(NamedTuple):
+    """连接需要占用的一个并发维度，例如 ("user", uid, 2)。"""
+
+    scope: str
+    key: str
+    limit: int
+
+
+class LeaseBackend(ABC):
+    """
+    并发租约后端：每条流在建立时按维度申请租约，之后由守卫批量续约。
+
+    租约带 TTL，持有租约的 worker 崩溃后名额在一个 TTL 内自动释放。
+    """
+
+    @abstractmethod
+    async def acquire(self, lease_id: str, claims: Sequence[LeaseClaim]) -> Optional[LeaseClaim]:
+        """原子地在所有维度上占用名额；成功返回 None，否则返回已满的维度且不占用任何名额。"""
+
+    @abstractmethod
+    async def renew(self, leases: Mapping[str, Sequence[LeaseClaim]]) -> None:
+        """续约本进程持有的全部租约。"""
+
+    @abstractmethod
+    async def release(self, lease_id: str, claims: Sequence[LeaseClaim]) -> None:
+        """释放租约，重复调用是安全的。"""
+
+    async def shutdown(self) -> None:
+        """释放后端持有的连接等资源。"""
+
+
+class RedisLeaseBackend(LeaseBackend):
+    """
+    基于 Redis 有序集合的租约：每个维度一个 ZSET，成员为连接 ID，分数为到期时间（毫秒）。
+
+    - 申请时 WATCH 相关键，只统计未到期成员，名额充足才在 MULTI 中清理过期成员并写入，
+      并发申请冲突时重试，保证跨 worker 不超卖
+    - 续约把本进程所有租约按键分组，在一个 pipeline 中一次往返完成；只更新仍存在的成员，
+      与释放并发时不会把已释放的租约重新写回
+    - 到期时间使用各 worker 的本地时钟，TTL 需远大于时钟偏差
+    """
+
+    # WATCH 冲突时的最大重试次数
+    MAX_ACQUIRE_ATTEMPTS = 5
+
+    def __init__(self, redis: Any, *, key_prefix: str, ttl_seconds: float) -> None:
+        self._redis = redis
+        self._key_prefix = key_prefix
+        self._ttl_ms = int(ttl_seconds * 1000)
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "RedisLeaseBackend":
+        try:
+            from redis import asyncio as redis_asyncio
+        except ImportError as exc:  # pragma: no cover - 依赖缺失
+            raise RuntimeError("SSE_LEASE_BACKEND=redis requires the 'redis' package") from exc
+
+        url = settings.sse_lease_redis_url or settings.message_broker_redis_url
+        if not url:
+            raise ValueError("SSE_LEASE_REDIS_URL or MESSAGE_BROKER_REDIS_URL must be set when SSE_LEASE_BACKEND=redis")
+
+        client = redis_asyncio.from_url(url, decode_responses=True)
+        return cls(client, key_prefix=settings.sse_lease_key_prefix, ttl_seconds=settings.sse_lease_ttl_seconds)
+
+    def _key(self, claim: LeaseClaim) -> str:
+        return f"{self._key_prefix}:{claim.scope}:{claim.key}"
+
+    async def acquire(self, lease_id: str, claims: Sequence[LeaseClaim]) -> Optional[LeaseClaim]:
+        from redis.exceptions import WatchError
+
+        keys = [self._key(claim) for claim in claims]
+        for _ in range(self.MAX_ACQUIRE_ATTEMPTS):
+            now_ms = int(time.time() * 1000)
+            async with self._redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(*keys)
+                for key, claim in zip(keys, claims):
+                    # 分数大于当前时间的成员才是有效租约
+                    if await pipe.zcount(key, f"({now_ms}", "+inf") >= claim.limit:
+                        await pipe.unwatch()
+                        return claim
+
+                pipe.multi()
+                for key in keys:
+                    pipe.zremrangebyscore(key, "-inf", now_ms)
+                    pipe.zadd(key, {lease_id: now_ms + self._ttl_ms})
+                    pipe.pexpire(key, self._ttl_ms)
+                try:
+                    await pipe.execute()
+                except WatchError:
+                    continue
+                return None
+
+        raise RuntimeError(f"SSE lease contention for {lease_id}")
+
+    async def renew(self, leases: Mapping[str, Sequence[LeaseClaim]]) -> None:
+        if not leases:
+            return
+        expires_at = int(time.time() * 1000) + self._ttl_ms
+        members: Dict[str, Dict[str, int]] = defaultdict(dict)
+        for lease_id, claims in leases.items():
+            for claim in claims:
+                members[self._key(claim)][lease_id] = expires_at
+
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key, mapping in members.items():
+                # XX：只延长仍存在的成员，续约与释放交错时不会让已释放的租约复活并占用名额到 TTL
+                pipe.zadd(key, mapping, xx=True)
+                pipe.pexpire(key, self._ttl_ms)
+            await pipe.execute()
+
+    async def release(self, lease_id: str, claims: Sequence[LeaseClaim]) -> None:
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for claim in claims:
+                pipe.zrem(self._key(claim), lease_id)
+            await pipe.execute()
+
+    async def shutdown(self) -> None:
+        await self._redis.aclose()
+
+
+def create_lease_backend(settings: Optional[Settings] = None) -> Optional[LeaseBackend]:
+    """按配置创建租约后端；memory 表示只按进程内计数，返回 None。"""
+
+    settings = settings or get_settings()
+    backend = (settings.sse_lease_backend or "memory").lower()
+    if backend == "redis":
+        return RedisLeaseBackend.from_settings(settings)
+    if backend != "memory":
+        raise ValueError(f"Unsupported SSE lease backend: {settings.sse_lease_backend}")
+    return None
@@ -0,0 +1,266 @@
+"""SSE 响应封装：事件驱动的断线检测与即时资源释放。"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+import zlib
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Mapping, Optional
+
+import anyio
+from starlette.responses import StreamingResponse
+from starlette.types import Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+CloseCallback = Callable[[], Awaitable[None]]
+FrameRenderer = Callable[[Any], bytes]
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+}
+
+# 服务端终止流时补发结尾的最长等待
+_FINISH_TIMEOUT_SECONDS = 1.0
+
+# 支持的流式压缩编码及对应的 zlib wbits；同等权重时优先 gzip
+_COMPRESSION_WBITS = {"gzip": 31, "deflate": 15}
+
+
+def negotiate_stream_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """按 Accept-Encoding 选择流压缩编码，客户端不支持或 q=0 时返回 None。"""
+
+    best: Optional[str] = None
+    best_q = 0.0
+    for item in (accept_encoding or "").lower().split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip()
+        if name not in _COMPRESSION_WBITS:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                continue
+        if q <= 0:
+            continue
+        if q > best_q or (q == best_q and name == "gzip"):
+            best, best_q = name, q
+    return best
+
+
+def jittered_retry_ms(base_ms: int, jitter_ms: int) -> int:
+    """每条连接独立抽取的重连间隔，避免部署或重启后所有客户端在同一时刻重连。"""
+
+    return base_ms + (random.randint(0, jitter_ms) if jitter_ms > 0 else 0)
+
+
+class StreamCompressor:
+    """
+    单条流的压缩上下文。
+
+    压缩字典跨帧复用，重复出现的字段名与 message_id 越往后压缩率越高；
+    每批写出后做 sync flush，客户端无需等到流结束即可解出已收到的帧。
+    """
+
+    def __init__(self, encoding: str, level: int = 6) -> None:
+        self.encoding = encoding
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, _COMPRESSION_WBITS[encoding])
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+async def compress_stream(frames: AsyncIterator[str | bytes], compressor: StreamCompressor) -> AsyncIterator[bytes]:
+    try:
+        async for chunk in frames:
+            yield compressor.compress(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        yield compressor.finish()
+    finally:
+        aclose = getattr(frames, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+async def prepend_stream(preamble: bytes, frames: AsyncIterator[str | bytes]) -> AsyncIterator[str | bytes]:
+    try:
+        yield preamble
+        async for chunk in frames:
+            yield chunk
+    finally:
+        aclose = getattr(frames, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+class EventStreamResponse(StreamingResponse):
+    """
+    text/event-stream 响应（也用于协商后的二进制事件流）。
+
+    每个连接只有一个 watcher 阻塞在 receive() 上等待 http.disconnect，
+    写路径上不做任何断线轮询；断开时取消写出任务、立即关闭生成器并执行 on_close。
+    服务端可调用 cancel() 主动终止（强制断开、过期回收），此时正常结束响应体后同样执行清理。
+
+    指定 retry_hint_ms 时流开头即下发 retry: 字段，客户端在连接意外中断后也按该间隔重连；
+    drain() 在终止前额外推送 reconnect 控制事件，告知客户端多久之后再重连。
+    """
+
+    def __init__(
+        self,
+        content: AsyncIterator[str | bytes],
+        *,
+        on_close: Optional[CloseCallback] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: str = "text/event-stream",
+        content_encoding: Optional[str] = None,
+        compression_level: int = 6,
+        retry_hint_ms: Optional[int] = None,
+    ) -> None:
+        merged = {**SSE_HEADERS, **(headers or {})}
+        if retry_hint_ms is not None:
+            content = prepend_stream(b"retry: %d\n\n" % retry_hint_ms, content)
+        self._compressor: Optional[StreamCompressor] = None
+        if content_encoding is not None:
+            self._compressor = StreamCompressor(content_encoding, compression_level)
+            content = compress_stream(content, self._compressor)
+            merged["Content-Encoding"] = content_encoding
+            merged["Vary"] = ", ".join(filter(None, [merged.get("Vary"), "Accept-Encoding"]))
+        super().__init__(content, media_type=media_type, headers=merged)
+        self._on_close = on_close
+        self._cancel_scope: Optional[anyio.CancelScope] = None
+        self._started = False
+        self._completed = False
+        self._retry_hint_ms = retry_hint_ms
+        self._farewell = b""
+        self.disconnected = False
+        self.cancelled = False
+        # 最近一次成功写出的时间，供连接回收判断空闲与半开连接
+        self.last_write = time.monotonic()
+
+    def cancel(self) -> None:
+        """从服务端终止该流，可在响应开始前或写出过程中调用。"""
+
+        self.cancelled = True
+        if self._cancel_scope is not None:
+            self._cancel_scope.cancel()
+
+    def drain(self, reconnect_in_ms: int, frame: bytes = b"") -> None:
+        """下线前终止该流：先写出 reconnect 控制事件 frame，并把 retry: 提示改为 reconnect_in_ms。"""
+
+        self._farewell = frame
+        if self._retry_hint_ms is not None:
+            self._retry_hint_ms = reconnect_in_ms
+        self.cancel()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        async def tracked_send(message: Message) -> None:
+            await send(message)
+            # 写出成功后才记录：开始前就被终止时首个 send 会被取消，结尾仍需补发响应头
+            if message["type"] == "http.response.start":
+                self._started = True
+            elif not message.get("more_body", False):
+                self._completed = True
+            self.last_write = time.monotonic()
+
+        try:
+            async with anyio.create_task_group() as task_group:
+                self._cancel_scope = task_group.cancel_scope
+                if self.cancelled:
+                    task_group.cancel_scope.cancel()
+                task_group.start_soon(self._watch_disconnect, receive, task_group.cancel_scope)
+                await self.stream_response(tracked_send)
+                task_group.cancel_scope.cancel()
+        finally:
+            # 外层取消时仍需完成清理，否则连接名额要等生成器被 GC 才释放
+            with anyio.CancelScope(shield=True):
+                if self.cancelled and not self.disconnected and not self._completed:
+                    await self._finish(send)
+                await self._release()
+
+    async def _finish(self, send: Send) -> None:
+        """
+        服务端终止时补发 retry: 提示与响应结尾，让客户端按提示退避后重连，而不是看到连接被重置。
+
+        半开连接的写出会一直阻塞，因此整体限时，超时后直接放弃。
+        """
+
+        body = self._farewell
+        if self._retry_hint_ms is not None:
+            body += b"retry: %d\n\n" % self._retry_hint_ms
+        if self._compressor is not None:
+            body = self._compressor.compress(body) + self._compressor.finish()
+        with anyio.move_on_after(_FINISH_TIMEOUT_SECONDS):
+            try:
+                if not self._started:
+                    await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+                await send({"type": "http.response.body", "body": body, "more_body": False})
+            except Exception:  # pragma: no cover - 连接已不可写
+                logger.debug("SSE流终止时补发结尾失败", exc_info=True)
+
+    async def _watch_disconnect(self, receive: Receive, cancel_scope: anyio.CancelScope) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                self.disconnected = True
+                break
+        cancel_scope.cancel()
+
+    async def _release(self) -> None:
+        aclose = getattr(self.body_iterator, "aclose", None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception:  # pragma: no cover - 运行时防护
+                logger.exception("关闭SSE生成器失败")
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            try:
+                await on_close()
+            except Exception:  # pragma: no cover - 运行时防护
+                logger.exception("SSE连接清理失败")
+
+
+async def stream_subscription(
+    subscription: Any,
+    heartbeat: Any,
+    heartbeat_frame: bytes,
+    *,
+    render: FrameRenderer,
+    coalesce_seconds: float = 0.0,
+) -> AsyncIterator[bytes]:
+    """
+    把订阅游标转换为 SSE 写出序列。
+
+    收到一批中的首个事件后最多再等待 coalesce_seconds，把窗口内到达的帧合并为一次写出，
+    用有界延迟换取更少的 send 调用；流已结束时不再等待。coalesce_seconds 为 0 时逐帧写出。
+    """
+
+    while True:
+        item = subscription.next_event()
+        if item is None:
+            if subscription.exhausted:
+                return
+            if heartbeat.consume_due():
+                yield heartbeat_frame
+                continue
+            await subscription.wait()
+            continue
+
+        heartbeat.touch()
+        if coalesce_seconds <= 0:
+            yield render(item)
+            continue
+
+        batch: List[bytes] = [render(item)]
+        if not subscription.exhausted:
+            await asyncio.sleep(coalesce_seconds)
+        while (item := subscription.next_event()) is not None:
+            batch.append(render(item))
+        yield batch[0] if len(batch) == 1 else b"".join(batch)
@@ -0,0 +1,243 @@
+"""
+粘性路由分发器（参考实现）。
+
+多个 worker 各自监听独立的 Unix socket 并以不同的 WORKER_ID 启动，例如：
+
+    WORKER_ID=a uvicorn app:app --uds /run/gymbro/worker-a.sock
+    WORKER_ID=b uvicorn app:app --uds /run/gymbro/worker-b.sock
+    STICKY_WORKER_SOCKETS="a=/run/gymbro/worker-a.sock,b=/run/gymbro/worker-b.sock" \\
+        python -m app.core.sticky_dispatch --port 9999
+
+/api/v1/messages/{message_id}/events 与 /api/v1/messages/{message_id}（停止生成）按消息 ID 中的
+worker 标识转发到生成该消息的进程，其余请求轮询分发。无法识别 worker 的旧格式 ID 同样走轮询。
+
+WebSocket（/api/v1/ws）在一条连接上订阅多条消息，无法按单个消息 ID 选择 worker，分发器也不转发
+WebSocket 协议，握手后立即以 1011 关闭；按用户聚合的多路复用流 /api/v1/events 同理返回 501。
+需要这两种订阅方式时改用 Redis Broker。
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import logging
+import re
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+import anyio
+import httpx
+from starlette.types import Message, Receive, Scope, Send
+
+from app.core.message_ids import parse_message_id
+
+logger = logging.getLogger(__name__)
+
+# 事件流与停止生成都必须落在持有该消息通道与生成任务的 worker 上
+_EVENTS_PATH = re.compile(r"^/api/v1/messages/(?P<message_id>[^/]+)(?:/events)?$")
+
+# 按用户聚合全部消息的流，任何单个 worker 都只持有其中一部分
+_OWNER_FEED_PATH = "/api/v1/events"
+
+# 不支持的协议以 1011 关闭 WebSocket
+_CLOSE_INTERNAL_ERROR = 1011
+
+# 逐跳头不转发
+_HOP_BY_HOP_HEADERS = {
+    b"connection",
+    b"keep-alive",
+    b"proxy-authenticate",
+    b"proxy-authorization",
+    b"te",
+    b"trailers",
+    b"transfer-encoding",
+    b"upgrade",
+}
+
+
+def parse_worker_sockets(value: Optional[str]) -> Dict[str, str]:
+    """解析 "a=/path/a.sock,b=/path/b.sock" 形式的 worker socket 配置。"""
+
+    sockets: Dict[str, str] = {}
+    for item in (value or "").split(","):
+        worker_id, sep, path = item.strip().partition("=")
+        if sep and worker_id.strip() and path.strip():
+            sockets[worker_id.strip().lower()] = path.strip()
+    return sockets
+
+
+class StickyDispatcher:
+    """按消息 ID 把事件流与停止生成请求转发给所属 worker 的 ASGI 分发器。"""
+
+    def __init__(self, clients: Mapping[str, httpx.AsyncClient]) -> None:
+        if not clients:
+            raise ValueError("StickyDispatcher requires at least one worker")
+        self._clients = dict(clients)
+        self._round_robin: Iterator[str] = itertools.cycle(list(self._clients))
+
+    @classmethod
+    def from_sockets(cls, worker_sockets: Mapping[str, str]) -> "StickyDispatcher":
+        # SSE 长连接不设读超时
+        timeout = httpx.Timeout(10.0, read=None)
+        clients = {
+            worker_id: httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(uds=path),
+                base_url="http://worker",
+                timeout=timeout,
+            )
+            for worker_id, path in worker_sockets.items()
+        }
+        return cls(clients)
+
+    def route(self, path: str) -> str:
+        """返回处理该路径的 worker 标识。"""
+
+        match = _EVENTS_PATH.match(path)
+        if match:
+            worker_id, _ = parse_message_id(match.group("message_id"))
+            if worker_id in self._clients:
+                return worker_id
+        return next(self._round_robin)
+
+    async def aclose(self) -> None:
+        for client in self._clients.values():
+            await client.aclose()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] == "websocket":
+            # 明确关闭，而不是让客户端的握手一直挂起
+            await receive()
+            await send({"type": "websocket.close", "code": _CLOSE_INTERNAL_ERROR})
+            return
+        if scope["type"] != "http":
+            return
+
+        if scope["path"] == _OWNER_FEED_PATH:
+            await _send_error(send, 501, "STICKY_UNSUPPORTED", "Owner event feed requires the redis message broker")
+            return
+
+        worker_id = self.route(scope["path"])
+        await self._forward(self._clients[worker_id], scope, receive, send)
+
+    async def _lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _forward(self, client: httpx.AsyncClient, scope: Scope, receive: Receive, send: Send) -> None:
+        body = await _read_body(receive)
+        request = client.build_request(
+            scope["method"],
+            httpx.URL(path=scope["path"], query=scope.get("query_string", b"")),
+            headers=_forward_headers(scope),
+            content=body,
+        )
+        try:
+            response = await client.send(request, stream=True)
+        except httpx.TransportError as exc:
+            logger.error("转发到worker失败 path=%s error=%s", scope["path"], exc)
+            await _send_error(send, 502, "BAD_GATEWAY", "Worker unavailable")
+            return
+
+        try:
+            async with anyio.create_task_group() as task_group:
+                task_group.start_soon(_watch_disconnect, receive, task_group.cancel_scope)
+                await send(
+                    {
+                        "type": "http.response.start",
+                        "status": response.status_code,
+                        "headers": [
+                            (key, value)
+                            for key, value in response.headers.raw
+                            if key.lower() not in _HOP_BY_HOP_HEADERS
+                        ],
+                    }
+                )
+                async for chunk in response.aiter_raw():
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                task_group.cancel_scope.cancel()
+        finally:
+            with anyio.CancelScope(shield=True):
+                await response.aclose()
+
+
+async def _read_body(receive: Receive) -> bytes:
+    chunks: List[bytes] = []
+    while True:
+        message: Message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+async def _watch_disconnect(receive: Receive, cancel_scope: anyio.CancelScope) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+    cancel_scope.cancel()
+
+
+def _forward_headers(scope: Scope) -> List[Tuple[bytes, bytes]]:
+    headers = [
+        (key, value)
+        for key, value in scope.get("headers", [])
+        if key.lower() not in _HOP_BY_HOP_HEADERS and key.lower() != b"host"
+    ]
+    client = scope.get("client")
+    if client:
+        forwarded = dict(headers).get(b"x-forwarded-for")
+        client_ip = client[0].encode("latin-1")
+        headers = [(key, value) for key, value in headers if key != b"x-forwarded-for"]
+        headers.append((b"x-forwarded-for", forwarded + b", " + client_ip if forwarded else client_ip))
+    return headers
+
+
+async def _send_error(send: Send, status: int, code: str, message: str) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send(
+        {
+            "type": "http.response.body",
+            "body": json.dumps({"status": status, "code": code, "message": message}, separators=(",", ":")).encode(),
+        }
+    )
+
+
+def create_dispatcher() -> StickyDispatcher:
+    """根据 STICKY_WORKER_SOCKETS 配置创建分发器。"""
+
+    from app.settings.config import get_settings
+
+    sockets = parse_worker_sockets(get_settings().sticky_worker_sockets)
+    return StickyDispatcher.from_sockets(sockets)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="GymBro sticky SSE dispatcher")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9999)
+    args = parser.parse_args(argv)
+    uvicorn.run(create_dispatcher(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,23 @@
 """服务层公共导出。"""
-from .ai_service import AIMessageInput, AIService, MessageEvent, MessageEventBroker
+from .ai_service import AIMessageInput, AIService
+from .message_broker import (
+    EventSubscription,
+    MessageBrokerBackend,
+    MessageChannel,
+    MessageEvent,
+    MessageEventBroker,
+    OwnerFeed,
+    create_message_broker,
+)
 
 __all__ = [
     "AIMessageInput",
     "AIService",
+    "EventSubscription",
+    "MessageBrokerBackend",
+    "MessageChannel",
     "MessageEvent",
     "MessageEventBroker",
+    "OwnerFeed",
+    "create_message_broker",
 ]
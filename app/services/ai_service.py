@@ -2,10 +2,12 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
+import json
 import logging
+import math
 from dataclasses import dataclass, field
-from typing import Any, AsyncIterator, Dict, Optional
-from uuid import uuid4
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 import anyio
 import httpx
@@ -17,6 +19,14 @@ from app.auth import (
     get_auth_provider,
 )
 from app.auth.provider import AuthProvider
+from app.core.message_ids import new_message_id
+from app.core.metrics import ai_generations_cancelled_total, ai_reply_cache_requests_total
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.message_broker import MessageBrokerBackend, MessageEvent
+from app.services.model_router import ModelRouter, UpstreamBackend
+from app.services.reply_cache import ReplyCache, get_reply_cache
+from app.services.single_flight import SingleFlight
+from app.services.upstream_client import get_upstream_pool
 from app.settings.config import get_settings
 
 logger = logging.getLogger(__name__)
@@ -30,37 +40,11 @@ class AIMessageInput:
 
 
 @dataclass(slots=True)
-class MessageEvent:
-    event: str
-    data: Dict[str, Any]
+class _Generation:
+    """一次生成的进度：已推送的增量，以及回复完整后的保存任务。"""
 
-
-class MessageEventBroker:
-    """管理消息事件队列，支持 SSE 订阅。"""
-
-    def __init__(self) -> None:
-        self._channels: Dict[str, asyncio.Queue[Optional[MessageEvent]]] = {}
-        self._lock = asyncio.Lock()
-
-    async def create_channel(self, message_id: str) -> asyncio.Queue[Optional[MessageEvent]]:
-        queue: asyncio.Queue[Optional[MessageEvent]] = asyncio.Queue()
-        async with self._lock:
-            self._channels[message_id] = queue
-        return queue
-
-    def get_channel(self, message_id: str) -> Optional[asyncio.Queue[Optional[MessageEvent]]]:
-        return self._channels.get(message_id)
-
-    async def publish(self, message_id: str, event: MessageEvent) -> None:
-        queue = self._channels.get(message_id)
-        if queue:
-            await queue.put(event)
-
-    async def close(self, message_id: str) -> None:
-        async with self._lock:
-            queue = self._channels.pop(message_id, None)
-        if queue:
-            await queue.put(None)
+    parts: List[str] = field(default_factory=list)
+    completing: Optional[asyncio.Future] = None
 
 
 class AIService:
@@ -69,23 +53,60 @@ class AIService:
     def __init__(self, provider: Optional[AuthProvider] = None) -> None:
         self._settings = get_settings()
         self._provider = provider or get_auth_provider()
+        self._flights = SingleFlight()
+        self._router: Optional[ModelRouter] = None
 
     @staticmethod
     def new_message_id() -> str:
-        return uuid4().hex
+        """生成消息 ID；配置了 WORKER_ID 时嵌入 worker 标识以支持粘性路由。"""
+
+        return new_message_id(get_settings().worker_id)
 
     async def run_conversation(
         self,
         message_id: str,
         user: AuthenticatedUser,
         message: AIMessageInput,
-        broker: MessageEventBroker,
+        broker: MessageBrokerBackend,
     ) -> None:
+        """
+        生成一条回复并把事件推送到消息通道。
+
+        任务被取消时（用户停止、无人订阅超过宽限期或服务下线）中止上游生成，
+        已生成的部分回复照常持久化并推送 cancelled 事件，随后继续抛出 CancelledError。
+        回复已完整生成、正在保存时到达的取消不再生效，照常推送 completed。
+        """
+        generation = _Generation()
+        watchdog = self._watch_listeners(message_id, broker)
+        try:
+            await self._run_conversation(message_id, user, message, broker, generation)
+        except asyncio.CancelledError as exc:
+            if generation.completing is not None:
+                await asyncio.wait({generation.completing})
+                raise
+            reason = str(exc.args[0]) if exc.args else "shutdown"
+            partial = "".join(generation.parts).rstrip()
+            await self._finish_cancelled(message_id, user, message, broker, partial, reason)
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            await broker.close(message_id)
+
+    async def _run_conversation(
+        self,
+        message_id: str,
+        user: AuthenticatedUser,
+        message: AIMessageInput,
+        broker: MessageBrokerBackend,
+        generation: _Generation,
+    ) -> None:
+        # 排队阶段的 queued 状态由调度器推送；走到这里说明任务已经开始执行
         await broker.publish(
             message_id,
             MessageEvent(
                 event="status",
-                data={"state": "queued", "message_id": message_id},
+                data={"state": "running", "message_id": message_id},
             ),
         )
 
@@ -103,7 +124,6 @@ class AIService:
                     data={"message_id": message_id, "error": str(exc)},
                 ),
             )
-            await broker.close(message_id)
             return
 
         await broker.publish(
@@ -115,31 +135,40 @@ class AIService:
         )
 
         try:
-            reply_text = await self._generate_reply(message, user, user_details)
-            async for chunk in self._stream_chunks(reply_text):
-                await broker.publish(
-                    message_id,
-                    MessageEvent(
-                        event="content_delta",
-                        data={"message_id": message_id, "delta": chunk},
-                    ),
-                )
-
-            record = {
-                "message_id": message_id,
-                "conversation_id": message.conversation_id,
-                "user_id": user.uid,
-                "user_message": message.text,
-                "ai_reply": reply_text,
-                "metadata": message.metadata,
-            }
-            await anyio.to_thread.run_sync(self._provider.sync_chat_record, record)
-
+            # 上游每产出一段增量就立即推送，首字延迟不再等于整段生成时间；完整回复在结束时拼出用于持久化
+            # 取消时立即关闭增量流，上游连接随之释放，而不是等生成器被垃圾回收
+            async with contextlib.aclosing(self._generate_reply(message, user, user_details)) as chunks:
+                async for chunk in chunks:
+                    generation.parts.append(chunk)
+                    await broker.publish(
+                        message_id,
+                        MessageEvent(
+                            event="content_delta",
+                            data={"message_id": message_id, "delta": chunk},
+                        ),
+                    )
+            # 开头空白已在首个增量去除，结尾空白要等完整回复拼出后才能确定
+            reply_text = "".join(generation.parts).rstrip()
+
+            # 保存与 completed 事件不受取消打断，否则取消路径会再保存一次部分回复
+            generation.completing = asyncio.ensure_future(
+                self._complete(message_id, user, message, broker, reply_text)
+            )
+            await asyncio.shield(generation.completing)
+        except CircuitOpenError as exc:
+            # 上游全部熔断时不再等待超时，立即告知客户端何时重试
+            logger.warning("上游熔断，快速失败 message_id=%s retry_after=%.1f", message_id, exc.retry_after)
             await broker.publish(
                 message_id,
                 MessageEvent(
-                    event="completed",
-                    data={"message_id": message_id, "reply": reply_text},
+                    event="error",
+                    data={
+                        "message_id": message_id,
+                        "error": str(exc),
+                        "code": "AI_UPSTREAM_UNAVAILABLE",
+                        "retryable": True,
+                        "retry_after": max(1, math.ceil(exc.retry_after)),
+                    },
                 ),
             )
         except Exception as exc:  # pragma: no cover - 运行时防护
@@ -151,22 +180,101 @@ class AIService:
                     data={"message_id": message_id, "error": str(exc)},
                 ),
             )
-        finally:
-            await broker.close(message_id)
+
+    async def _persist(
+        self,
+        message_id: str,
+        user: AuthenticatedUser,
+        message: AIMessageInput,
+        reply_text: str,
+        metadata: Dict[str, Any],
+    ) -> None:
+        record = {
+            "message_id": message_id,
+            "conversation_id": message.conversation_id,
+            "user_id": user.uid,
+            "user_message": message.text,
+            "ai_reply": reply_text,
+            "metadata": metadata,
+        }
+        await anyio.to_thread.run_sync(self._provider.sync_chat_record, record)
+
+    async def _complete(
+        self,
+        message_id: str,
+        user: AuthenticatedUser,
+        message: AIMessageInput,
+        broker: MessageBrokerBackend,
+        reply_text: str,
+    ) -> None:
+        await self._persist(message_id, user, message, reply_text, message.metadata)
+        await broker.publish(
+            message_id,
+            MessageEvent(
+                event="completed",
+                data={"message_id": message_id, "reply": reply_text},
+            ),
+        )
+
+    async def _finish_cancelled(
+        self,
+        message_id: str,
+        user: AuthenticatedUser,
+        message: AIMessageInput,
+        broker: MessageBrokerBackend,
+        partial: str,
+        reason: str,
+    ) -> None:
+        logger.info("生成已取消 message_id=%s reason=%s chars=%d", message_id, reason, len(partial))
+        ai_generations_cancelled_total.labels(reason=reason).inc()
+        try:
+            await self._persist(message_id, user, message, partial, {**message.metadata, "cancelled": reason})
+        except Exception:  # pragma: no cover - 运行时防护
+            logger.exception("保存部分回复失败 message_id=%s", message_id)
+        await broker.publish(
+            message_id,
+            MessageEvent(
+                event="cancelled",
+                data={"message_id": message_id, "reason": reason, "reply": partial},
+            ),
+        )
+
+    def _watch_listeners(self, message_id: str, broker: MessageBrokerBackend) -> Optional[asyncio.Task]:
+        """最后一个订阅者离开超过宽限期后取消当前生成；宽限期为 0 时不监视。"""
+
+        grace = self._settings.ai_idle_cancel_grace_seconds
+        if grace <= 0:
+            return None
+        generation = asyncio.current_task()
+
+        async def watch() -> None:
+            while True:
+                idle = await broker.idle_seconds(message_id)
+                if idle is not None and idle >= grace:
+                    logger.info("消息无人订阅超过宽限期，取消生成 message_id=%s idle=%.1fs", message_id, idle)
+                    generation.cancel("idle")
+                    return
+                await asyncio.sleep(grace if idle is None else grace - idle)
+
+        return asyncio.create_task(watch())
 
     async def _generate_reply(
         self,
         message: AIMessageInput,
         user: AuthenticatedUser,
         user_details: UserDetails,
-    ) -> str:
+    ) -> AsyncIterator[str]:
         if not message.text.strip():
             raise ValueError("Message text can not be empty")
 
         provider = (self._settings.ai_provider or "").lower()
-        if provider == "openai" and self._settings.ai_api_key:
-            return await self._call_openai_completion(message, user_details)
-        return self._default_reply(message, user_details)
+        if provider == "openai" and (self._settings.ai_api_key or self._settings.ai_backends):
+            chunks = self._cached_completion(message, user_details)
+        else:
+            chunks = self._stream_chunks(self._default_reply(message, user_details))
+        async with contextlib.aclosing(chunks):
+            async for chunk in chunks:
+                yield chunk
 
     async def _stream_chunks(self, text: str, chunk_size: int = 120) -> AsyncIterator[str]:
         if not text:
@@ -176,15 +284,73 @@ class AIService:
             yield text[index : index + chunk_size]
             await asyncio.sleep(0)
 
-    async def _call_openai_completion(
+    def _cache_model(self) -> str:
+        """缓存键中的模型部分：路由可能选中任一后端，因此取所有后端模型的集合。"""
+        return ",".join(sorted({backend.model for backend in self.router.backends}))
+
+    @property
+    def router(self) -> ModelRouter:
+        if self._router is None:
+            self._router = ModelRouter.from_settings(self._settings)
+        return self._router
+
+    def _cached_completion(self, message: AIMessageInput, user_details: UserDetails) -> AsyncIterator[str]:
+        """
+        命中缓存时按普通回复的分段方式重放；未命中时相同输入的并发请求共享一次上游生成，
+        每条消息通道各自收到同样的增量，完整结束后写入缓存。
+
+        上游请求只包含提示词本身，与用户身份无关，因此可以跨用户共享。
+        """
+
+        cache_enabled = self._settings.ai_reply_cache_enabled
+        if not (cache_enabled or self._settings.ai_single_flight_enabled):
+            return self._stream_openai_completion(message, user_details)
+        if message.metadata.get("cache", True) is False:
+            if cache_enabled:
+                ai_reply_cache_requests_total.labels(result="bypass").inc()
+            return self._stream_openai_completion(message, user_details)
+
+        cache = get_reply_cache()
+        key = cache.key(message.text, self._cache_model(), self._settings.ai_prompt_version)
+        if cache_enabled:
+            cached = cache.get(key)
+            if cached is not None:
+                return self._stream_chunks(cached)
+        if self._settings.ai_single_flight_enabled:
+            return self._flights.stream(
+                key,
+                lambda: self._stream_openai_completion(message, user_details),
+                on_complete=(lambda reply: cache.set(key, reply)) if cache_enabled else None,
+            )
+        return self._store_completion(cache, key, self._stream_openai_completion(message, user_details))
+
+    async def _store_completion(self, cache: ReplyCache, key: str, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        parts: List[str] = []
+        async with contextlib.aclosing(chunks):
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+        cache.set(key, "".join(parts))
+
+    def _stream_openai_completion(
         self,
         message: AIMessageInput,
         user_details: UserDetails,
-    ) -> str:
-        base_url = (self._settings.ai_api_base_url or "https://api.openai.com/v1").rstrip("/")
-        endpoint = f"{base_url}/chat/completions"
+    ) -> AsyncIterator[str]:
+        """经路由选择上游后端；短提示词可对冲到次优后端。"""
+
+        router = self.router
+        return router.stream(
+            lambda backend: self._stream_backend(backend, message),
+            hedge=router.should_hedge(message.text),
+        )
+
+    async def _stream_backend(self, backend: UpstreamBackend, message: AIMessageInput) -> AsyncIterator[str]:
+        """以 stream=true 调用 OpenAI 兼容接口，逐行解析 SSE 响应并产出内容增量。"""
+
+        endpoint = f"{backend.base_url}/chat/completions"
         payload = {
-            "model": self._settings.ai_model or "gpt-4o-mini",
+            "model": backend.model,
             "messages": [
                 {
                     "role": "system",
@@ -195,25 +361,48 @@ class AIService:
                     "content": message.text,
                 },
             ],
+            "stream": True,
         }
         headers = {
-            "Authorization": f"Bearer {self._settings.ai_api_key}",
+            "Authorization": f"Bearer {backend.api_key}",
             "Content-Type": "application/json",
         }
 
-        async with httpx.AsyncClient(timeout=self._settings.http_timeout_seconds) as client:
-            response = await client.post(endpoint, json=payload, headers=headers)
+        produced = False
+        timeout = httpx.Timeout(
+            self._settings.http_timeout_seconds, connect=self._settings.ai_upstream_connect_timeout_seconds
+        )
+        # 共享连接池复用到上游的长连接，不再为每条回复重新握手
+        async with get_upstream_pool().client.stream(
+            "POST", endpoint, json=payload, headers=headers, timeout=timeout
+        ) as response:
             response.raise_for_status()
-
-        data = response.json()
-        choices = data.get("choices") or []
-        if not choices:
-            raise ProviderError("AI provider returned empty response")
-
-        content = choices[0].get("message", {}).get("content", "")
-        if not content:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    logger.warning("忽略无法解析的上游流数据 data=%s", data[:200])
+                    continue
+
+                choices = chunk.get("choices") or []
+                delta = choices[0].get("delta", {}).get("content") if choices else None
+                if not delta:
+                    continue
+                if not produced:
+                    # 与非流式实现一致，去掉回复开头的空白
+                    delta = delta.lstrip()
+                    if not delta:
+                        continue
+                produced = True
+                yield delta
+
+        if not produced:
             raise ProviderError("AI provider did not return content")
-        return content.strip()
 
     def _default_reply(self, message: AIMessageInput, user_details: UserDetails) -> str:
         name = user_details.display_name or user_details.email or user_details.uid
@@ -0,0 +1,127 @@
+"""上游后端熔断器与重试退避。"""
+from __future__ import annotations
+
+import logging
+import random
+import time
+from typing import Callable
+
+import httpx
+
+from app.core.metrics import ai_backend_circuit_state, ai_backend_circuit_transitions_total
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 指标中的状态取值，便于在面板上按阈值着色
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# 首个增量之前出现这些状态码时请求没有副作用，可以安全重试
+RETRYABLE_STATUS_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(Exception):
+    """所有后端均处于熔断状态，请求被快速拒绝。"""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"AI upstream is unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """连接失败、超时与上游过载类状态码视为瞬时故障。"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, httpx.TransportError)
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """指数退避叠加全抖动：在 [0, min(cap, base * 2^attempt)] 内均匀取值。"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    单个后端的熔断器。
+
+    - closed：正常放行，连续失败达到阈值后进入 open
+    - open：直接拒绝，经过 reset_timeout 后进入 half_open
+    - half_open：只放行有限个探测请求，探测成功回到 closed，失败重新 open
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        half_open_max_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        ai_backend_circuit_state.labels(backend=name).set(_STATE_VALUES[CLOSED])
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def available(self) -> bool:
+        """是否可以放行请求（不占用探测名额）。"""
+        state = self.state
+        return state == CLOSED or (state == HALF_OPEN and self._probes < self.half_open_max_calls)
+
+    def acquire(self) -> bool:
+        """放行一个请求；half_open 状态下占用一个探测名额。"""
+        if not self.available():
+            return False
+        if self._state == HALF_OPEN:
+            self._probes += 1
+        return True
+
+    def retry_after(self) -> float:
+        """距离可以再次尝试的秒数。"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+
+    def record_success(self) -> None:
+        self._failures = 0
+        if self._state != CLOSED:
+            self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+            self._transition(OPEN)
+
+    def release(self) -> None:
+        """探测请求被取消而未得出结论时归还名额。"""
+        if self._state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def _transition(self, state: str) -> None:
+        logger.warning("上游熔断状态变更 backend=%s %s -> %s", self.name, self._state, state)
+        self._state = state
+        self._probes = 0
+        if state == OPEN:
+            self._opened_at = self._clock()
+        elif state == CLOSED:
+            self._failures = 0
+        ai_backend_circuit_state.labels(backend=self.name).set(_STATE_VALUES[state])
+        ai_backend_circuit_transitions_total.labels(backend=self.name, state=state).inc()
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "failures": self._failures, "retry_after": round(self.retry_after(), 1)}
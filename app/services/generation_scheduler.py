@@ -0,0 +1,238 @@
+"""对话生成任务调度：全局并发上限、单用户在途上限与按用户类型加权的公平排队。"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from app.core.metrics import generation_queue_depth, generation_queue_wait_seconds, generations_running
+from app.settings.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+JobRunner = Callable[[], Awaitable[None]]
+PositionCallback = Callable[[int, int], Awaitable[None]]
+
+USER_CLASSES = ("permanent", "anonymous")
+
+
+class SchedulerQueueFull(Exception):
+    """排队任务数已达上限。"""
+
+
+@dataclass(eq=False)
+class GenerationJob:
+    message_id: str
+    user_id: str
+    user_class: str
+    run: JobRunner
+    # 排队位置变化时回调 (position, queue_depth)，position 从 1 开始
+    on_position: Optional[PositionCallback] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    position: int = 0
+    # 开始运行后的任务，排队中为 None
+    task: Optional[asyncio.Task] = None
+
+
+class GenerationScheduler:
+    """
+    持有全部生成任务的调度器。
+
+    - 同时运行的生成数不超过全局上限，单个用户在途（运行中）的生成数不超过单用户上限
+    - 排队按用户类型分队列，队列间做加权公平排队：每派发一个任务，该类虚拟时间前进 1/权重，
+      派发时选虚拟时间最小的非空队列；空闲后重新排队的类从当前全局虚拟时间起算，不会积攒额度
+    - 队列内按先来先到，跳过已达单用户上限的任务
+    - 排队任务的预计位置变化时回调通知，运行中的任务保存引用，不会被垃圾回收
+    """
+
+    def __init__(
+        self,
+        *,
+        max_concurrent: int,
+        max_per_user: int,
+        max_queued: int,
+        weights: Dict[str, float],
+    ) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queued = max_queued
+        self._weights = weights
+        self._queues: Dict[str, Deque[GenerationJob]] = {user_class: deque() for user_class in USER_CLASSES}
+        self._virtual_time: Dict[str, float] = {user_class: 0.0 for user_class in USER_CLASSES}
+        self._global_virtual_time = 0.0
+        self._running: Dict[str, GenerationJob] = {}
+        self._per_user: Dict[str, int] = {}
+        self._notifications: Set[asyncio.Task] = set()
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "GenerationScheduler":
+        return cls(
+            max_concurrent=settings.ai_max_concurrent_generations,
+            max_per_user=settings.ai_max_inflight_per_user,
+            max_queued=settings.ai_max_queued_generations,
+            weights={
+                "permanent": settings.ai_scheduler_weight_permanent,
+                "anonymous": settings.ai_scheduler_weight_anonymous,
+            },
+        )
+
+    @property
+    def running_count(self) -> int:
+        return len(self._running)
+
+    @property
+    def queued_count(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, job: GenerationJob) -> int:
+        """登记任务并尝试立即派发；返回排队位置，0 表示已开始运行。"""
+        if job.user_class not in self._queues:
+            job.user_class = "permanent"
+        if self.queued_count >= self.max_queued:
+            raise SchedulerQueueFull(f"generation queue is full ({self.max_queued})")
+
+        queue = self._queues[job.user_class]
+        if not queue:
+            # 空闲后重新排队的类不继承历史额度
+            self._virtual_time[job.user_class] = max(self._virtual_time[job.user_class], self._global_virtual_time)
+        queue.append(job)
+        self._dispatch()
+        return job.position
+
+    def find(self, message_id: str) -> Optional[GenerationJob]:
+        """查找排队或运行中的任务。"""
+        job = self._running.get(message_id)
+        if job is not None:
+            return job
+        for queue in self._queues.values():
+            for job in queue:
+                if job.message_id == message_id:
+                    return job
+        return None
+
+    def cancel(self, message_id: str, reason: str = "user") -> bool:
+        """
+        取消排队或运行中的任务；排队中取消的任务不会再运行，由调用方关闭其消息通道。
+
+        运行中的任务以 reason 作为 CancelledError 的消息取消，生成方据此区分取消来源。
+        """
+        for queue in self._queues.values():
+            for job in queue:
+                if job.message_id == message_id:
+                    queue.remove(job)
+                    self._update_gauges()
+                    self._announce_positions()
+                    return True
+        job = self._running.get(message_id)
+        if job is None:
+            return False
+        job.task.cancel(reason)
+        return True
+
+    def _eligible(self, queue: Deque[GenerationJob]) -> Optional[GenerationJob]:
+        for job in queue:
+            if self._per_user.get(job.user_id, 0) < self.max_per_user:
+                return job
+        return None
+
+    def _dispatch(self) -> None:
+        while len(self._running) < self.max_concurrent:
+            best: Optional[GenerationJob] = None
+            for user_class in sorted(self._queues, key=lambda name: self._virtual_time[name]):
+                best = self._eligible(self._queues[user_class])
+                if best is not None:
+                    break
+            if best is None:
+                break
+            self._queues[best.user_class].remove(best)
+            self._global_virtual_time = self._virtual_time[best.user_class]
+            self._virtual_time[best.user_class] += 1.0 / self._weights[best.user_class]
+            self._start(best)
+
+        self._update_gauges()
+        self._announce_positions()
+
+    def _start(self, job: GenerationJob) -> None:
+        generation_queue_wait_seconds.labels(user_class=job.user_class).observe(time.monotonic() - job.enqueued_at)
+        job.position = 0
+        self._per_user[job.user_id] = self._per_user.get(job.user_id, 0) + 1
+        job.task = asyncio.create_task(self._run(job))
+        self._running[job.message_id] = job
+
+    async def _run(self, job: GenerationJob) -> None:
+        try:
+            await job.run()
+        except asyncio.CancelledError:
+            logger.info("生成任务已取消 message_id=%s", job.message_id)
+        except Exception:  # pragma: no cover - 运行时防护
+            logger.exception("生成任务异常退出 message_id=%s", job.message_id)
+        finally:
+            self._running.pop(job.message_id, None)
+            remaining = self._per_user.get(job.user_id, 1) - 1
+            if remaining > 0:
+                self._per_user[job.user_id] = remaining
+            else:
+                self._per_user.pop(job.user_id, None)
+            self._dispatch()
+
+    def _predicted_order(self) -> List[GenerationJob]:
+        """按各队列的虚拟完成时间合并排队任务，得到预计的派发顺序。"""
+        tagged = []
+        for user_class, queue in self._queues.items():
+            step = 1.0 / self._weights[user_class]
+            start = self._virtual_time[user_class]
+            tagged.extend((start + index * step, index, job) for index, job in enumerate(queue))
+        tagged.sort(key=lambda item: (item[0], item[1]))
+        return [job for _, _, job in tagged]
+
+    def _announce_positions(self) -> None:
+        order = self._predicted_order()
+        depth = len(order)
+        pending = []
+        for position, job in enumerate(order, start=1):
+            if job.position == position:
+                continue
+            job.position = position
+            if job.on_position is not None:
+                pending.append(job.on_position(position, depth))
+        if pending:
+            task = asyncio.create_task(self._notify(pending))
+            self._notifications.add(task)
+            task.add_done_callback(self._notifications.discard)
+
+    @staticmethod
+    async def _notify(pending: List[Awaitable[None]]) -> None:
+        results = await asyncio.gather(*pending, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("排队位置通知失败 error=%s", result)
+
+    def _update_gauges(self) -> None:
+        generations_running.set(len(self._running))
+        for user_class, queue in self._queues.items():
+            generation_queue_depth.labels(user_class=user_class).set(len(queue))
+
+    async def shutdown(self) -> None:
+        """取消排队与运行中的任务并等待其结束。"""
+        for queue in self._queues.values():
+            queue.clear()
+        tasks = [job.task for job in self._running.values()]
+        for task in tasks:
+            task.cancel("shutdown")
+        await asyncio.gather(*tasks, *self._notifications, return_exceptions=True)
+        self._update_gauges()
+
+
+# 全局生成调度器实例
+_generation_scheduler: Optional[GenerationScheduler] = None
+
+
+def get_generation_scheduler() -> GenerationScheduler:
+    """获取全局生成调度器实例。"""
+    global _generation_scheduler
+    if _generation_scheduler is None:
+        _generation_scheduler = GenerationScheduler.from_settings(get_settings())
+    return _generation_scheduler
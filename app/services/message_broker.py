@@ -0,0 +1,697 @@
+"""消息事件发布/订阅：单生产者、多订阅游标共享同一份事件日志。"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import math
+import struct
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Literal, Mapping, Optional, Set, Tuple
+
+import orjson
+
+try:  # 可选依赖：未安装时只提供 SSE 文本编码
+    import msgpack
+except ImportError:  # pragma: no cover - 依赖缺失
+    msgpack = None
+
+from app.core.metrics import message_channels_active, message_channels_reaped_total
+from app.settings.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+LagPolicy = Literal["skip", "disconnect"]
+
+_LENGTH_PREFIX = struct.Struct(">I")
+
+
+@dataclass(slots=True)
+class MessageEvent:
+    event: str
+    data: Dict[str, Any]
+    id: Optional[int] = None
+    # 发布时编码一次的 SSE 帧，回放缓冲与所有订阅者共享同一份 bytes，直接写入传输层
+    frame: bytes = b""
+    # 其他编码形式的帧（如省略 reply 的 completed 帧），按需编码一次后由所有订阅者共享
+    variants: Dict[str, Any] = field(default_factory=dict)
+
+    def variant(self, name: str, encoder: Callable[["MessageEvent"], Any]) -> Any:
+        frame = self.variants.get(name)
+        if frame is None:
+            frame = self.variants[name] = encoder(self)
+        return frame
+
+
+def encode_sse_frame(event: MessageEvent) -> bytes:
+    """将事件编码为 SSE 帧，带序号时附加 id 字段供断线续传。"""
+
+    prefix = b"id: %d\n" % event.id if event.id is not None else b""
+    return b"%sevent: %s\ndata: %s\n\n" % (prefix, event.event.encode(), orjson.dumps(event.data))
+
+
+def encode_msgpack_frame(event: MessageEvent) -> bytes:
+    """
+    将事件编码为长度前缀的 MessagePack 帧：4 字节大端长度 + {"id", "event", "data"}。
+
+    供原生客户端免去逐帧 JSON 文本解析；帧可直接拼接写出，客户端按长度切分。
+    """
+
+    if msgpack is None:  # pragma: no cover - 依赖缺失
+        raise RuntimeError("msgpack encoding requires the 'msgpack' package")
+    body = msgpack.packb({"id": event.id, "event": event.event, "data": event.data})
+    return _LENGTH_PREFIX.pack(len(body)) + body
+
+
+FrameEncoding = Literal["sse", "msgpack"]
+
+FRAME_ENCODERS: Dict[str, Callable[[MessageEvent], bytes]] = {
+    "sse": encode_sse_frame,
+    "msgpack": encode_msgpack_frame,
+}
+
+
+def available_encodings() -> Tuple[str, ...]:
+    return ("sse", "msgpack") if msgpack is not None else ("sse",)
+
+
+def without_reply(event: MessageEvent) -> MessageEvent:
+    """completed 事件的瘦身副本：省略完整 reply，客户端已由 content_delta 拼出全文。"""
+
+    data = {key: value for key, value in event.data.items() if key != "reply"}
+    data["reply_omitted"] = True
+    return MessageEvent(event=event.event, data=data, id=event.id)
+
+
+def encode_frame(event: MessageEvent, encoding: FrameEncoding = "sse", omit_reply: bool = False) -> bytes:
+    """按协商的编码返回事件帧，每种形式每个事件只编码一次，由所有订阅者共享。"""
+
+    slim = omit_reply and event.event == "completed" and "reply" in event.data
+    if encoding == "sse" and not slim:
+        if not event.frame:
+            event.frame = encode_sse_frame(event)
+        return event.frame
+    encoder = FRAME_ENCODERS[encoding]
+    if slim:
+        return event.variant(f"{encoding}_slim", lambda item: encoder(without_reply(item)))
+    return event.variant(encoding, encoder)
+
+
+def encode_mux_sse_frame(message_id: str, event: MessageEvent, omit_reply: bool = False) -> bytes:
+    """多路复用流的 SSE 帧：id 为 "<message_id>:<序号>"，其余字段复用单消息帧。"""
+
+    base = encode_frame(event, "sse", omit_reply)
+    name = "sse_mux" if base is event.frame else "sse_mux_slim"
+    return event.variant(
+        name, lambda item: b"id: %s:%d\n%s" % (message_id.encode(), item.id, base.partition(b"\n")[2])
+    )
+
+
+class EventRing:
+    """定长环形缓冲，按事件序号 O(1) 追加与定位，超出容量时淘汰最旧事件。"""
+
+    def __init__(self, capacity: int) -> None:
+        self._capacity = max(capacity, 1)
+        self._slots: List[Optional[MessageEvent]] = [None] * self._capacity
+        self.first_id = 1
+        self.next_id = 1
+
+    def append(self, event: MessageEvent) -> MessageEvent:
+        # 镜像远端日志时沿用生产者序号，序号跳跃说明更早的事件已被远端裁剪
+        if event.id is not None and event.id > self.next_id:
+            self.first_id = self.next_id = event.id
+        event.id = self.next_id
+        self._slots[self.next_id % self._capacity] = event
+        self.next_id += 1
+        if self.next_id - self.first_id > self._capacity:
+            self.first_id = self.next_id - self._capacity
+        return event
+
+    def get(self, event_id: int) -> Optional[MessageEvent]:
+        if self.first_id <= event_id < self.next_id:
+            return self._slots[event_id % self._capacity]
+        return None
+
+    @property
+    def last_id(self) -> int:
+        return self.next_id - 1
+
+
+class EventSubscription:
+    """订阅游标：在共享日志上独立前进，落后过多时按自身策略跳过或断开。"""
+
+    def __init__(
+        self,
+        channel: "MessageChannel",
+        last_event_id: int = 0,
+        max_lag: Optional[int] = None,
+        on_lag: LagPolicy = "skip",
+    ) -> None:
+        self.channel = channel
+        self.cursor = max(last_event_id, 0)
+        self.max_lag = max_lag
+        self.on_lag = on_lag
+        self.skipped = 0
+        self.lagged = False
+        self.closed = False
+        self._waiter: Optional[asyncio.Future[None]] = None
+
+    @property
+    def exhausted(self) -> bool:
+        """订阅已关闭，或通道已结束且全部事件均已读取。"""
+
+        return self.closed or (self.channel.closed and self.cursor >= self.channel.ring.last_id)
+
+    def next_event(self) -> Optional[MessageEvent]:
+        """非阻塞读取下一条事件，没有新事件时返回 None。"""
+
+        if self.closed:
+            return None
+
+        ring = self.channel.ring
+        floor = ring.first_id - 1
+        if self.max_lag is not None:
+            floor = max(floor, ring.last_id - self.max_lag)
+        if self.cursor < floor:
+            if self.on_lag == "disconnect":
+                logger.info(
+                    "订阅者落后过多已断开 message_id=%s cursor=%d head=%d",
+                    self.channel.message_id, self.cursor, ring.last_id,
+                )
+                self.lagged = True
+                self.close()
+                return None
+            self.skipped += floor - self.cursor
+            self.cursor = floor
+
+        event = ring.get(self.cursor + 1)
+        if event is not None:
+            self.cursor = event.id
+        return event
+
+    @property
+    def ready(self) -> bool:
+        """有未读事件或已结束，此时 wait() 会立即返回。"""
+
+        return self.exhausted or self.cursor < self.channel.ring.last_id
+
+    async def wait(self) -> None:
+        """等待通道追加新事件、关闭或本订阅被关闭。"""
+
+        if self.ready:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.arm(waiter)
+        try:
+            await waiter
+        finally:
+            self.disarm()
+
+    def arm(self, waiter: "asyncio.Future[None]") -> None:
+        """登记唤醒用的 future；多个订阅可共享同一个 future 实现聚合等待。"""
+
+        self._waiter = waiter
+        self.channel._waiting.add(self)
+
+    def disarm(self) -> None:
+        self._waiter = None
+        self.channel._waiting.discard(self)
+
+    def wake(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.channel.detach(self)
+        self.wake()
+
+
+class OwnerFeed:
+    """
+    单个用户的聚合订阅：持有该用户所有进行中消息的游标，供每设备一条的多路复用流读取。
+
+    Broker 在用户新建消息时直接把订阅游标加入 feed；读取按消息轮转，避免单条长回复饿死其他消息。
+    """
+
+    def __init__(self, owner: str, on_close: Optional[Callable[["OwnerFeed"], None]] = None) -> None:
+        self.owner = owner
+        self.closed = False
+        self._members: Dict[str, EventSubscription] = {}
+        self._order: Deque[str] = deque()
+        self._waiter: Optional[asyncio.Future[None]] = None
+        self._on_close = on_close
+
+    @property
+    def exhausted(self) -> bool:
+        return self.closed
+
+    @property
+    def message_ids(self) -> List[str]:
+        return list(self._order)
+
+    def add(self, subscription: EventSubscription) -> None:
+        message_id = subscription.channel.message_id
+        if self.closed or message_id in self._members:
+            subscription.close()
+            return
+        self._members[message_id] = subscription
+        self._order.append(message_id)
+        if self._waiter is not None:
+            subscription.arm(self._waiter)
+        self.wake()
+
+    def next_event(self) -> Optional[Tuple[str, MessageEvent]]:
+        """非阻塞读取任一消息的下一条事件，返回 (message_id, event)。"""
+
+        for _ in range(len(self._order)):
+            message_id = self._order[0]
+            subscription = self._members[message_id]
+            event = subscription.next_event()
+            if event is not None:
+                self._order.rotate(-1)
+                return message_id, event
+            if subscription.exhausted:
+                self._order.popleft()
+                del self._members[message_id]
+                subscription.close()
+            else:
+                self._order.rotate(-1)
+        return None
+
+    async def wait(self) -> None:
+        if self.closed or any(subscription.ready for subscription in self._members.values()):
+            return
+        waiter = self._waiter = asyncio.get_running_loop().create_future()
+        for subscription in self._members.values():
+            subscription.arm(waiter)
+        try:
+            await waiter
+        finally:
+            self._waiter = None
+            for subscription in self._members.values():
+                subscription.disarm()
+
+    def wake(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        for subscription in self._members.values():
+            subscription.close()
+        self._members.clear()
+        self._order.clear()
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close(self)
+        self.wake()
+
+
+@dataclass(slots=True)
+class ChannelLease:
+    """通道租约：创建时间、首个订阅者的截止时间与最长存活截止时间。"""
+
+    created_at: float
+    subscribe_deadline: float
+    expires_at: float
+    subscribed_at: Optional[float] = None
+    next_check: float = 0.0
+
+
+class MessageChannel:
+    """单条消息的事件通道：一个生产者追加，多个订阅游标共享同一批已编码事件。"""
+
+    def __init__(
+        self,
+        message_id: str,
+        capacity: int,
+        lease: Optional[ChannelLease] = None,
+        owner: Optional[str] = None,
+    ) -> None:
+        self.message_id = message_id
+        self.owner = owner
+        self.ring = EventRing(capacity)
+        now = time.monotonic()
+        self.lease = lease or ChannelLease(created_at=now, subscribe_deadline=now, expires_at=now)
+        self.closed = False
+        self.closed_at: Optional[float] = None
+        self._subscribers: Set[EventSubscription] = set()
+        self._waiting: Set[EventSubscription] = set()
+        # 最后一个订阅者离开的时间，有订阅者或从未被订阅时为 None
+        self.idle_since: Optional[float] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(
+        self,
+        last_event_id: int = 0,
+        *,
+        max_lag: Optional[int] = None,
+        on_lag: LagPolicy = "skip",
+    ) -> EventSubscription:
+        subscription = EventSubscription(self, last_event_id, max_lag=max_lag, on_lag=on_lag)
+        self._subscribers.add(subscription)
+        self.idle_since = None
+        if self.lease.subscribed_at is None:
+            self.lease.subscribed_at = time.monotonic()
+        return subscription
+
+    def detach(self, subscription: EventSubscription) -> None:
+        self._subscribers.discard(subscription)
+        if not self._subscribers and self.idle_since is None:
+            self.idle_since = time.monotonic()
+
+    def append(self, event: MessageEvent) -> MessageEvent:
+        self.ring.append(event)
+        if not event.frame:
+            event.frame = encode_sse_frame(event)
+        self._wake_waiting()
+        return event
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.closed_at = time.monotonic()
+        self._wake_waiting()
+
+    def _wake_waiting(self) -> None:
+        # 只唤醒正在等待的订阅者，已在读取中的游标下一轮自然会看到新事件
+        waiting, self._waiting = self._waiting, set()
+        for subscription in waiting:
+            subscription.wake()
+
+
+class MessageBrokerBackend(ABC):
+    """
+    消息事件 Broker 后端抽象。
+
+    生产者（AIService）只调用 create_channel/publish/close，
+    订阅端（SSE 路由）只调用 has_channel/is_visible_to/subscribe/watch_owner，返回的订阅游标在本进程内读取。
+    """
+
+    @abstractmethod
+    async def create_channel(self, message_id: str, owner: Optional[str] = None) -> None:
+        """为新消息创建事件通道，owner 为消息所属用户，用于按用户多路复用。"""
+
+    @abstractmethod
+    async def has_channel(self, message_id: str) -> bool:
+        """通道是否存在（含已关闭但仍在回放保留期内的通道）。"""
+
+    @abstractmethod
+    async def owner_of(self, message_id: str) -> Optional[str]:
+        """消息所属用户；通道不存在或创建时未指定 owner 时返回 None。"""
+
+    async def is_visible_to(self, message_id: str, uid: str) -> bool:
+        """通道存在且属于该用户；创建时未指定 owner 的通道对所有已认证用户可见。"""
+        if not await self.has_channel(message_id):
+            return False
+        owner = await self.owner_of(message_id)
+        return owner is None or owner == uid
+
+    @abstractmethod
+    async def subscribe(
+        self,
+        message_id: str,
+        last_event_id: int = 0,
+        *,
+        max_lag: Optional[int] = None,
+        on_lag: LagPolicy = "skip",
+    ) -> Optional[EventSubscription]:
+        """订阅通道，从 last_event_id 之后开始读取；通道不存在时返回 None。"""
+
+    @abstractmethod
+    async def watch_owner(self, owner: str, last_event_ids: Optional[Mapping[str, int]] = None) -> OwnerFeed:
+        """
+        订阅某用户的全部消息：包含当前未结束的消息以及之后新建的消息。
+
+        last_event_ids 中列出的消息即使已结束也会从对应序号之后续传。
+        """
+
+    @abstractmethod
+    async def publish(self, message_id: str, event: MessageEvent) -> None:
+        """追加事件。"""
+
+    @abstractmethod
+    async def close(self, message_id: str) -> None:
+        """标记通道结束。"""
+
+    async def idle_seconds(self, message_id: str) -> Optional[float]:
+        """
+        最后一个订阅者离开后经过的秒数，有订阅者时为 0；通道已被回收时为 inf。
+
+        从未被订阅或后端无法得知全部订阅者（订阅可能落在其他 worker）时返回 None，生产者据此不做空闲取消。
+        """
+        return None
+
+    async def shutdown(self) -> None:
+        """停止后台任务并释放连接。"""
+
+
+class MessageEventBroker(MessageBrokerBackend):
+    """
+    管理消息事件通道，支持多订阅者扇出与 Last-Event-ID 断线续传。
+
+    每个通道持有租约，后台清扫任务按截止时间小顶堆增量检查：
+    - 超过订阅截止时间仍无人订阅的通道视为泄漏并回收
+    - 超过最长存活时间仍未关闭的通道（生产者异常退出）强制关闭回收
+    - 已关闭的通道在回放保留期结束后回收
+    """
+
+    def __init__(
+        self,
+        buffer_size: Optional[int] = None,
+        retention_seconds: Optional[float] = None,
+        subscribe_timeout_seconds: Optional[float] = None,
+        max_lifetime_seconds: Optional[float] = None,
+        sweep_interval_seconds: Optional[float] = None,
+        sweep_batch_size: int = 256,
+    ) -> None:
+        settings = get_settings()
+        self._buffer_size = buffer_size or settings.sse_replay_buffer_size
+        self._retention_seconds = _pick(retention_seconds, settings.sse_replay_ttl_seconds)
+        self._subscribe_timeout = _pick(subscribe_timeout_seconds, settings.message_channel_subscribe_timeout_seconds)
+        self._max_lifetime = _pick(max_lifetime_seconds, settings.message_channel_max_lifetime_seconds)
+        self._sweep_interval = _pick(sweep_interval_seconds, settings.message_channel_sweep_interval_seconds)
+        self._sweep_batch_size = sweep_batch_size
+        self._channels: Dict[str, MessageChannel] = {}
+        # 用户 -> 名下的消息通道，以及正在监听该用户的多路复用 feed
+        self._owned: Dict[str, Set[str]] = {}
+        self._feeds: Dict[str, Set[OwnerFeed]] = {}
+        # (检查时间, 序号, message_id)，与租约 next_check 不一致的条目视为过期直接跳过
+        self._deadlines: List[Tuple[float, int, str]] = []
+        self._deadline_seq = 0
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @property
+    def channel_count(self) -> int:
+        return len(self._channels)
+
+    async def create_channel(self, message_id: str, owner: Optional[str] = None) -> MessageChannel:
+        now = time.monotonic()
+        lease = ChannelLease(
+            created_at=now,
+            subscribe_deadline=now + self._subscribe_timeout,
+            expires_at=now + self._max_lifetime,
+        )
+        channel = MessageChannel(message_id, self._buffer_size, lease, owner=owner)
+        self._channels[message_id] = channel
+        message_channels_active.set(len(self._channels))
+        self._schedule(lease.subscribe_deadline, message_id)
+        self._ensure_sweeper()
+        if owner is not None:
+            self._owned.setdefault(owner, set()).add(message_id)
+            for feed in self._feeds.get(owner, ()):
+                feed.add(channel.subscribe())
+        return channel
+
+    def get_channel(self, message_id: str) -> Optional[MessageChannel]:
+        return self._channels.get(message_id)
+
+    async def has_channel(self, message_id: str) -> bool:
+        return message_id in self._channels
+
+    async def owner_of(self, message_id: str) -> Optional[str]:
+        channel = self._channels.get(message_id)
+        return channel.owner if channel is not None else None
+
+    async def subscribe(
+        self,
+        message_id: str,
+        last_event_id: int = 0,
+        *,
+        max_lag: Optional[int] = None,
+        on_lag: LagPolicy = "skip",
+    ) -> Optional[EventSubscription]:
+        channel = self._channels.get(message_id)
+        if channel is None:
+            return None
+        return channel.subscribe(last_event_id, max_lag=max_lag, on_lag=on_lag)
+
+    async def watch_owner(self, owner: str, last_event_ids: Optional[Mapping[str, int]] = None) -> OwnerFeed:
+        last_event_ids = last_event_ids or {}
+        feed = OwnerFeed(owner, on_close=self._unwatch)
+        for message_id in self._owned.get(owner, ()):
+            channel = self._channels[message_id]
+            if not channel.closed or message_id in last_event_ids:
+                feed.add(channel.subscribe(last_event_ids.get(message_id, 0)))
+        self._feeds.setdefault(owner, set()).add(feed)
+        return feed
+
+    def _unwatch(self, feed: OwnerFeed) -> None:
+        feeds = self._feeds.get(feed.owner)
+        if feeds is not None:
+            feeds.discard(feed)
+            if not feeds:
+                del self._feeds[feed.owner]
+
+    async def publish(self, message_id: str, event: MessageEvent) -> None:
+        channel = self._channels.get(message_id)
+        if channel and not channel.closed:
+            channel.append(event)
+
+    async def close(self, message_id: str) -> None:
+        channel = self._channels.get(message_id)
+        if channel is None or channel.closed:
+            return
+        channel.close()
+        # 关闭后保留一段时间，供断线的客户端携带 Last-Event-ID 回放剩余事件
+        self._schedule(channel.closed_at + self._retention_seconds, message_id)
+
+    async def idle_seconds(self, message_id: str) -> Optional[float]:
+        channel = self._channels.get(message_id)
+        if channel is None:
+            return math.inf
+        if channel.subscriber_count:
+            return 0.0
+        if channel.idle_since is None:
+            return None
+        return time.monotonic() - channel.idle_since
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """处理最多一批到期条目，返回本轮回收的通道数量。"""
+
+        now = time.monotonic() if now is None else now
+        reaped = 0
+        for _ in range(self._sweep_batch_size):
+            if not self._deadlines or self._deadlines[0][0] > now:
+                break
+            when, _, message_id = heapq.heappop(self._deadlines)
+            channel = self._channels.get(message_id)
+            if channel is None or when != channel.lease.next_check:
+                continue
+
+            reason, next_check = self._evaluate(channel, now)
+            if reason is None:
+                self._schedule(next_check, message_id)
+                continue
+
+            if not channel.closed:
+                logger.warning(
+                    "回收泄漏的消息通道 message_id=%s reason=%s age=%.1fs",
+                    message_id, reason, now - channel.lease.created_at,
+                )
+                channel.close()
+            del self._channels[message_id]
+            self._disown(channel)
+            message_channels_reaped_total.labels(reason=reason).inc()
+            reaped += 1
+
+        message_channels_active.set(len(self._channels))
+        return reaped
+
+    async def shutdown(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    def _evaluate(self, channel: MessageChannel, now: float) -> Tuple[Optional[str], float]:
+        """判断通道是否应回收；不回收时给出下一次检查时间。"""
+
+        lease = channel.lease
+        if channel.closed:
+            expire_at = channel.closed_at + self._retention_seconds
+            return ("expired", now) if now >= expire_at else (None, expire_at)
+        if lease.subscribed_at is None and now >= lease.subscribe_deadline:
+            return "unsubscribed", now
+        if now >= lease.expires_at:
+            return "max_lifetime", now
+        if lease.subscribed_at is None:
+            return None, lease.subscribe_deadline
+        return None, lease.expires_at
+
+    def _disown(self, channel: MessageChannel) -> None:
+        owned = self._owned.get(channel.owner) if channel.owner is not None else None
+        if owned is not None:
+            owned.discard(channel.message_id)
+            if not owned:
+                del self._owned[channel.owner]
+
+    def _schedule(self, when: float, message_id: str) -> None:
+        channel = self._channels.get(message_id)
+        if channel is None:
+            return
+        channel.lease.next_check = when
+        self._deadline_seq += 1
+        heapq.heappush(self._deadlines, (when, self._deadline_seq, message_id))
+
+    def _ensure_sweeper(self) -> None:
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._run_sweeper())
+
+    async def _run_sweeper(self) -> None:
+        while True:
+            await asyncio.sleep(self._sweep_interval)
+            try:
+                await self._drain()
+            except Exception:  # pragma: no cover - 运行时防护
+                logger.exception("消息通道清扫失败")
+
+    async def _drain(self, now: Optional[float] = None) -> None:
+        """
+        分批处理全部到期条目。
+
+        是否继续按堆中是否还有到期条目判断，而不是按回收数量：失效或重新登记的条目
+        同样占用批次，一批里回收得少不代表没有积压。
+        """
+
+        self.sweep(now)
+        while self._deadlines and self._deadlines[0][0] <= (time.monotonic() if now is None else now):
+            # 积压时让出事件循环后继续，避免一次性长时间占用
+            await asyncio.sleep(0)
+            self.sweep(now)
+
+
+def _pick(value: Optional[float], default: float) -> float:
+    return value if value is not None else default
+
+
+def create_message_broker() -> MessageBrokerBackend:
+    """按配置创建 Broker：默认进程内实现，多 worker 部署时切换到 Redis Streams。"""
+
+    settings = get_settings()
+    backend = (settings.message_broker_backend or "memory").lower()
+    if backend == "redis":
+        from app.services.redis_broker import RedisStreamBroker
+
+        return RedisStreamBroker.from_settings(settings)
+    if backend != "memory":
+        raise ValueError(f"Unsupported message broker backend: {settings.message_broker_backend}")
+    if settings.worker_id:
+        # 粘性路由只能按消息 ID 选 worker，按用户聚合的流只能看到本进程的消息
+        logger.warning("WORKER_ID 已设置但 Broker 为 memory：用户多路复用流 /api/v1/events 需要 redis Broker")
+    return MessageEventBroker()
@@ -0,0 +1,309 @@
+"""多上游模型路由：按 EWMA 延迟与错误率选择后端，可选对冲请求。"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.core.metrics import (
+    ai_backend_latency_ewma_seconds,
+    ai_backend_requests_total,
+    ai_circuit_rejections_total,
+    ai_hedged_requests_total,
+    ai_upstream_retries_total,
+    ai_upstream_tokens_saved_total,
+)
+from app.services.circuit_breaker import CircuitBreaker, CircuitOpenError, backoff_delay, is_retryable
+from app.services.upstream_client import ai_api_base_url
+from app.settings.config import Settings
+
+logger = logging.getLogger(__name__)
+
+# 计算 p95 对冲延迟所需的最少样本数，不足时使用配置的默认延迟
+_MIN_P95_SAMPLES = 20
+_LATENCY_WINDOW = 200
+
+
+@dataclass(eq=False)
+class UpstreamBackend:
+    """一个 OpenAI 兼容后端及其运行时统计。延迟指首个增量到达的时间。"""
+
+    name: str
+    base_url: str
+    api_key: Optional[str]
+    model: str
+    ewma_latency: Optional[float] = None
+    ewma_error: float = 0.0
+    samples: Deque[float] = field(default_factory=lambda: deque(maxlen=_LATENCY_WINDOW))
+    breaker: Optional[CircuitBreaker] = None
+
+    def __post_init__(self) -> None:
+        if self.breaker is None:
+            self.breaker = CircuitBreaker(self.name)
+
+    def p95(self) -> Optional[float]:
+        if len(self.samples) < _MIN_P95_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+
+StreamOpener = Callable[[UpstreamBackend], AsyncIterator[str]]
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：ASCII 约 4 个字符一个 token，其余（中文等）约一字一个。"""
+    ascii_chars = sum(1 for char in text if char.isascii())
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+class ModelRouter:
+    """
+    在多个后端之间路由一次流式生成。
+
+    - 错误率 EWMA 低于阈值的后端视为健康，按延迟 EWMA 升序尝试；尚无延迟样本的后端优先，以便获得样本
+    - 首个增量之前出现瞬时故障时切换到下一个后端；开始输出后不再切换，避免客户端收到重复内容
+    - 429 以外的 4xx 等不可重试错误说明请求本身有问题，换后端也无济于事，直接抛出而不切换
+    - 对冲：短提示词在主请求超过 p95 延迟仍无首个增量时向次优后端再发一次，先产出增量者胜出，另一个被取消
+    - 每个后端有独立熔断器，熔断中的后端不参与路由；全部熔断时立即抛出 CircuitOpenError
+    - 首个增量前的瞬时故障（连接失败、超时、429/5xx）可重试，总尝试次数有上限，
+      所有后端都试过一轮后按带抖动的指数退避再来
+    """
+
+    def __init__(
+        self,
+        backends: List[UpstreamBackend],
+        *,
+        alpha: float = 0.3,
+        error_threshold: float = 0.5,
+        hedge_enabled: bool = False,
+        hedge_max_prompt_chars: int = 200,
+        hedge_default_delay: float = 0.8,
+        max_attempts: int = 3,
+        backoff_base: float = 0.2,
+        backoff_max: float = 2.0,
+    ) -> None:
+        if not backends:
+            raise ValueError("ModelRouter requires at least one backend")
+        self.backends = backends
+        self.alpha = alpha
+        self.error_threshold = error_threshold
+        self.hedge_enabled = hedge_enabled
+        self.hedge_max_prompt_chars = hedge_max_prompt_chars
+        self.hedge_default_delay = hedge_default_delay
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # 完整回复的输出 token 数 EWMA，用于估算中止生成省下的 token
+        self.ewma_completion_tokens: Optional[float] = None
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "ModelRouter":
+        default_model = settings.ai_model or "gpt-4o-mini"
+        # 未配置 AI_BACKENDS 时退化为单个 AI_API_BASE_URL 后端
+        configured = settings.ai_backends or [{"name": "default", "base_url": ai_api_base_url(settings)}]
+        backends = [
+            UpstreamBackend(
+                name=item.get("name") or f"backend-{index}",
+                base_url=str(item["base_url"]).rstrip("/"),
+                api_key=item.get("api_key") or settings.ai_api_key,
+                model=item.get("model") or default_model,
+                breaker=CircuitBreaker(
+                    item.get("name") or f"backend-{index}",
+                    failure_threshold=settings.ai_circuit_failure_threshold,
+                    reset_timeout=settings.ai_circuit_reset_timeout_seconds,
+                    half_open_max_calls=settings.ai_circuit_half_open_max_calls,
+                ),
+            )
+            for index, item in enumerate(configured)
+        ]
+        return cls(
+            backends,
+            alpha=settings.ai_router_ewma_alpha,
+            error_threshold=settings.ai_router_error_threshold,
+            hedge_enabled=settings.ai_hedge_enabled,
+            hedge_max_prompt_chars=settings.ai_hedge_max_prompt_chars,
+            hedge_default_delay=settings.ai_hedge_delay_ms / 1000,
+            max_attempts=settings.ai_retry_max_attempts,
+            backoff_base=settings.ai_retry_backoff_base_ms / 1000,
+            backoff_max=settings.ai_retry_backoff_max_ms / 1000,
+        )
+
+    def ranked(self) -> List[UpstreamBackend]:
+        healthy = [backend for backend in self.backends if backend.ewma_error < self.error_threshold]
+        if not healthy:
+            # 全部不健康时按错误率尝试，仍然给恢复的后端机会
+            return sorted(self.backends, key=lambda backend: backend.ewma_error)
+        return sorted(healthy, key=lambda backend: -1.0 if backend.ewma_latency is None else backend.ewma_latency)
+
+    def available(self) -> List[UpstreamBackend]:
+        """按路由顺序排列、熔断器允许放行的后端。"""
+        return [backend for backend in self.ranked() if backend.breaker.available()]
+
+    def retry_after(self) -> float:
+        """全部熔断时距离最早可重试的秒数；仅剩探测请求在途时建议稍后即重试。"""
+        waits = [wait for wait in (backend.breaker.retry_after() for backend in self.backends) if wait > 0]
+        return min(waits, default=1.0)
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {
+            backend.name: {
+                **backend.breaker.snapshot(),
+                "latency_ewma": backend.ewma_latency,
+                "error_ewma": round(backend.ewma_error, 3),
+            }
+            for backend in self.backends
+        }
+
+    def record_success(self, backend: UpstreamBackend, latency: float) -> None:
+        backend.samples.append(latency)
+        if backend.ewma_latency is None:
+            backend.ewma_latency = latency
+        else:
+            backend.ewma_latency += self.alpha * (latency - backend.ewma_latency)
+        backend.ewma_error *= 1 - self.alpha
+        backend.breaker.record_success()
+        ai_backend_requests_total.labels(backend=backend.name, result="success").inc()
+        ai_backend_latency_ewma_seconds.labels(backend=backend.name).set(backend.ewma_latency)
+
+    def record_failure(self, backend: UpstreamBackend, exc: BaseException) -> None:
+        backend.ewma_error += self.alpha * (1 - backend.ewma_error)
+        # 只有瞬时故障计入熔断；4xx 等请求本身的问题不说明后端不可用
+        if is_retryable(exc):
+            backend.breaker.record_failure()
+        else:
+            backend.breaker.release()
+        ai_backend_requests_total.labels(backend=backend.name, result="error").inc()
+
+    def _record_completion(self, tokens: int) -> None:
+        if self.ewma_completion_tokens is None:
+            self.ewma_completion_tokens = float(tokens)
+        else:
+            self.ewma_completion_tokens += self.alpha * (tokens - self.ewma_completion_tokens)
+
+    def _record_abort(self, produced: int) -> None:
+        if self.ewma_completion_tokens is None:
+            return
+        saved = self.ewma_completion_tokens - produced
+        if saved > 0:
+            ai_upstream_tokens_saved_total.inc(saved)
+
+    def hedge_delay(self, backend: UpstreamBackend) -> float:
+        p95 = backend.p95()
+        return self.hedge_default_delay if p95 is None else p95
+
+    def should_hedge(self, prompt: str) -> bool:
+        return self.hedge_enabled and len(self.backends) > 1 and len(prompt) <= self.hedge_max_prompt_chars
+
+    async def stream(self, open_stream: StreamOpener, *, hedge: bool = False) -> AsyncIterator[str]:
+        try:
+            winner, stream, first = await self._first_chunk(open_stream, hedge)
+        except asyncio.CancelledError:
+            # 等待首个增量（含对冲竞速）期间被取消，整段回复都省下了
+            self._record_abort(0)
+            raise
+        produced = estimate_tokens(first)
+        try:
+            yield first
+            async for chunk in stream:
+                produced += estimate_tokens(chunk)
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            # 消费方提前离开：关闭上游流即中止生成，按历史回复长度估算省下的 token
+            self._record_abort(produced)
+            raise
+        except Exception as exc:
+            self.record_failure(winner, exc)
+            raise
+        else:
+            self._record_completion(produced)
+        finally:
+            await stream.aclose()
+
+    async def _first_chunk(
+        self, open_stream: StreamOpener, hedge: bool
+    ) -> Tuple[UpstreamBackend, AsyncIterator[str], str]:
+        candidates = self.available()
+        attempts: Dict[asyncio.Task, Tuple[UpstreamBackend, AsyncIterator[str], float]] = {}
+        launched = 0
+
+        def launch() -> Optional[UpstreamBackend]:
+            nonlocal launched
+            while candidates and launched < self.max_attempts:
+                backend = candidates.pop(0)
+                if not backend.breaker.acquire():
+                    continue
+                launched += 1
+                stream = open_stream(backend)
+                attempts[asyncio.ensure_future(stream.__anext__())] = (backend, stream, time.monotonic())
+                return backend
+            return None
+
+        primary = launch()
+        if primary is None:
+            ai_circuit_rejections_total.inc()
+            raise CircuitOpenError(self.retry_after())
+        hedge_deadline = (
+            time.monotonic() + self.hedge_delay(primary) if hedge and candidates else None
+        )
+        last_error: Optional[BaseException] = None
+        rounds = 0
+        try:
+            while attempts:
+                timeout = None if hedge_deadline is None else max(0.0, hedge_deadline - time.monotonic())
+                done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_deadline = None
+                    hedged = launch()
+                    logger.info("对冲请求 primary=%s hedge=%s", primary.name, hedged.name if hedged else None)
+                    continue
+
+                for task in done:
+                    backend, stream, started = attempts.pop(task)
+                    try:
+                        first = task.result()
+                    except StopAsyncIteration:
+                        last_error = RuntimeError(f"backend {backend.name} returned an empty stream")
+                    except Exception as exc:
+                        last_error = exc
+                    else:
+                        self.record_success(backend, time.monotonic() - started)
+                        if len(attempts) or backend is not primary:
+                            ai_hedged_requests_total.labels(
+                                outcome="primary" if backend is primary else "hedge"
+                            ).inc()
+                        return backend, stream, first
+
+                    logger.warning("上游后端请求失败 backend=%s error=%s", backend.name, last_error)
+                    self.record_failure(backend, last_error)
+                    await stream.aclose()
+
+                if attempts or not is_retryable(last_error) or launched >= self.max_attempts:
+                    continue
+                if not candidates:
+                    # 所有后端都已试过一轮，退避后按最新排序重来
+                    await asyncio.sleep(backoff_delay(rounds, self.backoff_base, self.backoff_max))
+                    rounds += 1
+                    candidates.extend(self.available())
+                retried = launch()
+                if retried is None:
+                    ai_circuit_rejections_total.inc()
+                    raise CircuitOpenError(self.retry_after()) from last_error
+                ai_upstream_retries_total.labels(backend=retried.name).inc()
+            raise last_error or RuntimeError("no upstream backend available")
+        finally:
+            await self._cancel(attempts)
+
+    @staticmethod
+    async def _cancel(attempts: Dict[asyncio.Task, Tuple[UpstreamBackend, AsyncIterator[str], float]]) -> None:
+        for task, (backend, stream, _) in list(attempts.items()):
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await stream.aclose()
+            backend.breaker.release()
+            ai_backend_requests_total.labels(backend=backend.name, result="cancelled").inc()
+        attempts.clear()
@@ -0,0 +1,266 @@
+"""基于 Redis Streams 的跨进程消息 Broker。"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Dict, Mapping, Optional
+
+import orjson
+
+from app.services.message_broker import (
+    EventSubscription,
+    LagPolicy,
+    MessageBrokerBackend,
+    MessageChannel,
+    MessageEvent,
+    OwnerFeed,
+    encode_sse_frame,
+)
+from app.settings.config import Settings
+
+logger = logging.getLogger(__name__)
+
+
+class RedisStreamBroker(MessageBrokerBackend):
+    """
+    多 worker 共享的 Broker：每条消息对应一个 Redis Stream。
+
+    - 生产者所在进程负责分配事件序号，XADD 时写入预编码的 SSE 帧，订阅端不再重复编码
+    - 每个进程对同一消息只维护一个镜像通道和一个 XREAD 拉取任务，本地订阅者共享镜像扇出
+    - Stream 长度按回放窗口近似裁剪；键 TTL 在创建时设为最长存活时间，关闭后缩短为回放保留期，
+      生产者异常退出时键会自动过期
+    - 每个用户另有一条索引 Stream 记录名下消息的创建与结束，多路复用流据此发现新消息
+    """
+
+    # 用户索引 Stream 保留的最近条目数
+    OWNER_INDEX_SIZE = 256
+
+    def __init__(
+        self,
+        redis: Any,
+        *,
+        key_prefix: str,
+        buffer_size: int,
+        retention_seconds: float,
+        max_lifetime_seconds: float,
+        block_ms: int = 5000,
+    ) -> None:
+        self._redis = redis
+        self._key_prefix = key_prefix
+        self._buffer_size = buffer_size
+        self._retention_seconds = retention_seconds
+        self._max_lifetime_seconds = max_lifetime_seconds
+        self._block_ms = block_ms
+        # 本进程作为生产者的消息 -> 下一个事件序号
+        self._sequences: Dict[str, int] = {}
+        self._owners: Dict[str, str] = {}
+        # 本进程的镜像通道与拉取任务
+        self._mirrors: Dict[str, MessageChannel] = {}
+        self._pumps: Dict[str, asyncio.Task] = {}
+        # 本进程的用户 feed 与对应的索引监听任务
+        self._watchers: Dict[OwnerFeed, asyncio.Task] = {}
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "RedisStreamBroker":
+        try:
+            from redis import asyncio as redis_asyncio
+        except ImportError as exc:  # pragma: no cover - 依赖缺失
+            raise RuntimeError("MESSAGE_BROKER_BACKEND=redis requires the 'redis' package") from exc
+
+        if not settings.message_broker_redis_url:
+            raise ValueError("MESSAGE_BROKER_REDIS_URL must be set when MESSAGE_BROKER_BACKEND=redis")
+
+        client = redis_asyncio.from_url(settings.message_broker_redis_url, decode_responses=True)
+        return cls(
+            client,
+            key_prefix=settings.message_broker_key_prefix,
+            buffer_size=settings.sse_replay_buffer_size,
+            retention_seconds=settings.sse_replay_ttl_seconds,
+            max_lifetime_seconds=settings.message_channel_max_lifetime_seconds,
+        )
+
+    def _key(self, message_id: str) -> str:
+        return f"{self._key_prefix}:{message_id}"
+
+    def _owner_key(self, owner: str) -> str:
+        return f"{self._key_prefix}:owner:{owner}"
+
+    def _owned_by_key(self, message_id: str) -> str:
+        return f"{self._key_prefix}:{message_id}:owner"
+
+    async def create_channel(self, message_id: str, owner: Optional[str] = None) -> None:
+        key = self._key(message_id)
+        self._sequences[message_id] = 1
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.xadd(key, {"kind": "open"}, maxlen=self._buffer_size, approximate=True)
+            pipe.expire(key, int(self._max_lifetime_seconds))
+            if owner is not None:
+                self._owners[message_id] = owner
+                owner_key = self._owner_key(owner)
+                pipe.xadd(
+                    owner_key,
+                    {"kind": "open", "message_id": message_id},
+                    maxlen=self.OWNER_INDEX_SIZE,
+                    approximate=True,
+                )
+                pipe.expire(owner_key, int(self._max_lifetime_seconds))
+                # 归属单独存放：通道流按长度裁剪，不能依赖首条记录
+                pipe.set(self._owned_by_key(message_id), owner, ex=int(self._max_lifetime_seconds))
+            await pipe.execute()
+
+    async def has_channel(self, message_id: str) -> bool:
+        return bool(await self._redis.exists(self._key(message_id)))
+
+    async def owner_of(self, message_id: str) -> Optional[str]:
+        return await self._redis.get(self._owned_by_key(message_id))
+
+    async def subscribe(
+        self,
+        message_id: str,
+        last_event_id: int = 0,
+        *,
+        max_lag: Optional[int] = None,
+        on_lag: LagPolicy = "skip",
+    ) -> Optional[EventSubscription]:
+        mirror = self._mirrors.get(message_id)
+        if mirror is None:
+            if not await self.has_channel(message_id):
+                return None
+            # has_channel 期间可能已有其他订阅者建立了镜像
+            mirror = self._mirrors.get(message_id)
+        if mirror is None:
+            mirror = MessageChannel(message_id, self._buffer_size)
+            self._mirrors[message_id] = mirror
+            self._pumps[message_id] = asyncio.create_task(self._pump(message_id, mirror))
+        return mirror.subscribe(last_event_id, max_lag=max_lag, on_lag=on_lag)
+
+    async def publish(self, message_id: str, event: MessageEvent) -> None:
+        sequence = self._sequences.get(message_id)
+        if sequence is None:
+            return
+        self._sequences[message_id] = sequence + 1
+        event.id = sequence
+        event.frame = encode_sse_frame(event)
+        await self._redis.xadd(
+            self._key(message_id),
+            {
+                "kind": "event",
+                "seq": sequence,
+                "event": event.event,
+                "data": orjson.dumps(event.data),
+                "frame": event.frame,
+            },
+            maxlen=self._buffer_size,
+            approximate=True,
+        )
+
+    async def close(self, message_id: str) -> None:
+        if self._sequences.pop(message_id, None) is None:
+            return
+        key = self._key(message_id)
+        owner = self._owners.pop(message_id, None)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.xadd(key, {"kind": "close"}, maxlen=self._buffer_size, approximate=True)
+            pipe.expire(key, max(int(self._retention_seconds), 1))
+            if owner is not None:
+                pipe.xadd(
+                    self._owner_key(owner),
+                    {"kind": "close", "message_id": message_id},
+                    maxlen=self.OWNER_INDEX_SIZE,
+                    approximate=True,
+                )
+                pipe.expire(self._owned_by_key(message_id), max(int(self._retention_seconds), 1))
+            await pipe.execute()
+
+    async def watch_owner(self, owner: str, last_event_ids: Optional[Mapping[str, int]] = None) -> OwnerFeed:
+        last_event_ids = last_event_ids or {}
+        feed = OwnerFeed(owner, on_close=self._unwatch)
+        # 先按索引还原当前未结束的消息，再从索引末尾开始监听新建消息
+        open_ids: Dict[str, None] = {}
+        last_entry_id = "0-0"
+        for entry_id, fields in await self._redis.xrange(self._owner_key(owner)):
+            last_entry_id = entry_id
+            if fields.get("kind") == "open":
+                open_ids[fields["message_id"]] = None
+            else:
+                open_ids.pop(fields.get("message_id"), None)
+        for message_id in [*open_ids, *(mid for mid in last_event_ids if mid not in open_ids)]:
+            subscription = await self.subscribe(message_id, last_event_ids.get(message_id, 0))
+            if subscription is not None:
+                feed.add(subscription)
+        self._watchers[feed] = asyncio.create_task(self._watch(feed, last_entry_id))
+        return feed
+
+    def _unwatch(self, feed: OwnerFeed) -> None:
+        task = self._watchers.pop(feed, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    async def _watch(self, feed: OwnerFeed, last_entry_id: str) -> None:
+        """监听用户索引，把新建的消息加入 feed。"""
+
+        key = self._owner_key(feed.owner)
+        try:
+            while not feed.closed:
+                response = await self._redis.xread({key: last_entry_id}, block=self._block_ms, count=64)
+                for _, entries in response or ():
+                    for entry_id, fields in entries:
+                        last_entry_id = entry_id
+                        if fields.get("kind") != "open":
+                            continue
+                        subscription = await self.subscribe(fields["message_id"])
+                        if subscription is not None:
+                            feed.add(subscription)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Redis 用户索引监听失败 owner=%s", feed.owner)
+            feed.close()
+
+    async def shutdown(self) -> None:
+        pumps = [*self._pumps.values(), *self._watchers.values()]
+        for task in pumps:
+            task.cancel()
+        await asyncio.gather(*pumps, return_exceptions=True)
+        await self._redis.aclose()
+
+    async def _pump(self, message_id: str, mirror: MessageChannel) -> None:
+        """把远端 Stream 拉取到本地镜像，直到消息结束或本进程不再有订阅者。"""
+
+        key = self._key(message_id)
+        last_entry_id = "0-0"
+        try:
+            while not mirror.closed and mirror.subscriber_count > 0:
+                response = await self._redis.xread({key: last_entry_id}, block=self._block_ms, count=256)
+                if not response:
+                    if not await self._redis.exists(key):
+                        mirror.close()
+                    continue
+                for _, entries in response:
+                    for entry_id, fields in entries:
+                        last_entry_id = entry_id
+                        self._apply(mirror, fields)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Redis Stream 拉取失败 message_id=%s", message_id)
+            mirror.close()
+        finally:
+            if self._mirrors.get(message_id) is mirror:
+                del self._mirrors[message_id]
+                self._pumps.pop(message_id, None)
+
+    @staticmethod
+    def _apply(mirror: MessageChannel, fields: Dict[str, str]) -> None:
+        kind = fields.get("kind")
+        if kind == "event":
+            mirror.append(
+                MessageEvent(
+                    event=fields["event"],
+                    data=orjson.loads(fields["data"]),
+                    id=int(fields["seq"]),
+                    frame=fields["frame"].encode("utf-8"),
+                )
+            )
+        elif kind == "close":
+            mirror.close()
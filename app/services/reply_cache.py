@@ -0,0 +1,102 @@
+"""重复提示词的精确匹配回复缓存。"""
+from __future__ import annotations
+
+import hashlib
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from app.core.metrics import ai_reply_cache_bytes, ai_reply_cache_requests_total
+from app.settings.config import get_settings
+
+_WHITESPACE = re.compile(r"\s+")
+
+# 每个条目除回复正文外的估算开销（键、时间戳、OrderedDict 节点）
+_ENTRY_OVERHEAD_BYTES = 200
+
+
+def normalize_prompt(text: str) -> str:
+    """NFKC 归一化（全角/半角统一）、折叠空白并忽略大小写，建议词条的细微差异命中同一条目。"""
+
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip().casefold()
+
+
+@dataclass(slots=True)
+class _Entry:
+    reply: str
+    expires_at: float
+    size: int
+
+
+class ReplyCache:
+    """
+    按内存上限淘汰的 LRU 回复缓存，条目带 TTL。
+
+    键由归一化后的提示词、模型与提示词版本组成；修改系统提示词时提升版本即可让旧条目失效。
+    只缓存完整生成成功的回复，且只用于与用户身份无关的上游调用。
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float) -> None:
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def key(text: str, model: str, prompt_version: str) -> str:
+        raw = "\0".join((model, prompt_version, normalize_prompt(text)))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, now: Optional[float] = None) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            ai_reply_cache_requests_total.labels(result="miss").inc()
+            return None
+        if entry.expires_at <= (time.monotonic() if now is None else now):
+            self._discard(key)
+            ai_reply_cache_requests_total.labels(result="miss").inc()
+            return None
+        self._entries.move_to_end(key)
+        ai_reply_cache_requests_total.labels(result="hit").inc()
+        return entry.reply
+
+    def set(self, key: str, reply: str, now: Optional[float] = None) -> None:
+        size = len(reply.encode("utf-8")) + _ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        self._discard(key)
+        expires_at = (time.monotonic() if now is None else now) + self.ttl_seconds
+        self._entries[key] = _Entry(reply, expires_at, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._discard(next(iter(self._entries)))
+        ai_reply_cache_bytes.set(self._bytes)
+
+    def _discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+            ai_reply_cache_bytes.set(self._bytes)
+
+
+# 全局回复缓存实例
+_reply_cache: Optional[ReplyCache] = None
+
+
+def get_reply_cache() -> ReplyCache:
+    """获取全局回复缓存实例。"""
+    global _reply_cache
+    if _reply_cache is None:
+        settings = get_settings()
+        _reply_cache = ReplyCache(settings.ai_reply_cache_max_bytes, settings.ai_reply_cache_ttl_seconds)
+    return _reply_cache
@@ -0,0 +1,118 @@
+"""相同输入的在途生成合并：多条消息共享一次上游调用。"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from app.core.metrics import ai_generations_coalesced_total
+
+logger = logging.getLogger(__name__)
+
+CompletionCallback = Callable[[str], None]
+
+
+class FlightAborted(RuntimeError):
+    """共享生成因所有参与者离开而被取消；与调用方自身的取消区分开。"""
+
+
+class SharedCompletion:
+    """
+    一次上游生成及其全部参与者。
+
+    生成在独立任务中运行，不属于任何一条消息；增量按顺序记录，
+    参与者从头读取，后加入者先拿到已生成的前缀再跟随后续增量。
+    所有参与者都离开且生成尚未结束时先注销再取消上游调用，之后的同键请求发起新的生成。
+    """
+
+    def __init__(
+        self,
+        source: AsyncIterator[str],
+        *,
+        on_complete: Optional[CompletionCallback] = None,
+        on_finish: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.parts: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.participants = 0
+        self._on_complete = on_complete
+        self._on_finish = on_finish
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run(source))
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def _run(self, source: AsyncIterator[str]) -> None:
+        try:
+            async for chunk in source:
+                self.parts.append(chunk)
+                self._notify()
+            if self._on_complete is not None:
+                self._on_complete("".join(self.parts))
+        except asyncio.CancelledError:
+            # 每个参与者都会收到这个异常，不能共享 CancelledError，否则会被误认为自身被取消
+            self.error = FlightAborted("shared completion was aborted")
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self.done = True
+            if self._on_finish is not None:
+                self._on_finish()
+            self._notify()
+
+    async def stream(self) -> AsyncIterator[str]:
+        self.participants += 1
+        index = 0
+        try:
+            while True:
+                while index < len(self.parts):
+                    yield self.parts[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.participants -= 1
+            if self.participants == 0 and not self.done:
+                self._abort()
+
+    def _abort(self) -> None:
+        # 先从登记表移除，取消生效前到达的同键请求不会加入这次即将结束的生成
+        if self._on_finish is not None:
+            self._on_finish()
+        self._task.cancel()
+
+
+class SingleFlight:
+    """按键登记在途生成；同键的并发请求加入已有生成，而不是各自请求上游。"""
+
+    def __init__(self) -> None:
+        self._flights: Dict[str, SharedCompletion] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def stream(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[str]],
+        on_complete: Optional[CompletionCallback] = None,
+    ) -> AsyncIterator[str]:
+        flight = self._flights.get(key)
+        if flight is not None and not flight.done:
+            ai_generations_coalesced_total.inc()
+            logger.info("合并相同的在途生成 key=%s participants=%d", key[:12], flight.participants + 1)
+            return flight.stream()
+
+        def finish() -> None:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+        flight = SharedCompletion(factory(), on_complete=on_complete, on_finish=finish)
+        self._flights[key] = flight
+        return flight.stream()
@@ -0,0 +1,239 @@
+"""上游 AI 接口的共享 HTTP 连接池。"""
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import anyio
+import httpcore
+import httpx
+
+from app.core.metrics import (
+    upstream_connections_opened_total,
+    upstream_pool_connections,
+    upstream_pool_requests_waiting,
+)
+from app.settings.config import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AI_API_BASE_URL = "https://api.openai.com/v1"
+
+
+def ai_api_base_url(settings: Settings) -> str:
+    return str(settings.ai_api_base_url or DEFAULT_AI_API_BASE_URL).rstrip("/")
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class CachingDNSBackend(httpcore.AsyncNetworkBackend):
+    """
+    带 TTL 的 DNS 缓存网络后端。
+
+    只替换建连时的地址解析，TLS 握手的 SNI 与证书校验仍使用原始主机名；
+    缓存的所有地址都连不上时丢弃缓存，下次建连重新解析。
+    """
+
+    def __init__(self, ttl_seconds: float, backend: Optional[httpcore.AsyncNetworkBackend] = None) -> None:
+        self._ttl_seconds = ttl_seconds
+        self._backend = backend or httpcore.AnyIOBackend()
+        self._cache: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+
+    async def resolve(self, host: str, port: int) -> List[str]:
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+
+        now = time.monotonic()
+        cached = self._cache.get((host, port))
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        infos = await anyio.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(str(info[4][0]) for info in infos))
+        if self._ttl_seconds > 0 and addresses:
+            self._cache[(host, port)] = (now + self._ttl_seconds, addresses)
+        return addresses
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        local_address: Optional[str] = None,
+        socket_options: Optional[Iterable[Any]] = None,
+    ) -> httpcore.AsyncNetworkStream:
+        try:
+            addresses = await self.resolve(host, port)
+        except OSError as exc:
+            raise httpcore.ConnectError(str(exc)) from exc
+
+        last_error: Optional[Exception] = None
+        for address in addresses:
+            try:
+                stream = await self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as exc:
+                last_error = exc
+                continue
+            upstream_connections_opened_total.inc()
+            return stream
+
+        self._cache.pop((host, port), None)
+        raise last_error or httpcore.ConnectError(f"no addresses resolved for {host}")
+
+    async def connect_unix_socket(
+        self,
+        path: str,
+        timeout: Optional[float] = None,
+        socket_options: Optional[Iterable[Any]] = None,
+    ) -> httpcore.AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+class PooledUpstreamTransport(httpx.AsyncHTTPTransport):
+    """在 httpx 默认传输上换用带 DNS 缓存的连接池，其余行为（异常映射、HTTP/2 协商）保持不变。"""
+
+    def __init__(self, *, limits: httpx.Limits, http2: bool, dns_cache_ttl_seconds: float) -> None:
+        # 父类构造只负责创建连接池，而它不支持自定义网络后端；这里直接创建一次，不先建一个再丢弃
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            http1=True,
+            http2=http2,
+            network_backend=CachingDNSBackend(dns_cache_ttl_seconds),
+        )
+
+    @property
+    def pool(self) -> httpcore.AsyncConnectionPool:
+        return self._pool
+
+
+class UpstreamClientPool:
+    """
+    进程内共享的上游 HTTP 客户端。
+
+    连接保持长连接复用，避免每条回复重新做 TCP 与 TLS 握手；lifespan 启动时预热连接，
+    关闭时释放。客户端按需创建，lifespan 之外（脚本、测试）同样可用。
+    """
+
+    def __init__(self, settings: Optional[Settings] = None) -> None:
+        self._settings = settings or get_settings()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._transport: Optional[PooledUpstreamTransport] = None
+        self._prewarm_task: Optional[asyncio.Task] = None
+
+        upstream_pool_connections.labels(state="active").set_function(lambda: self.stats()["active"])
+        upstream_pool_connections.labels(state="idle").set_function(lambda: self.stats()["idle"])
+        upstream_pool_requests_waiting.set_function(lambda: self.stats()["waiting"])
+
+    @property
+    def http2(self) -> bool:
+        return self._settings.upstream_http2_enabled and _http2_available()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            settings = self._settings
+            if settings.upstream_http2_enabled and not self.http2:
+                logger.warning("UPSTREAM_HTTP2_ENABLED 需要安装 h2，已回退到 HTTP/1.1")
+            limits = httpx.Limits(
+                max_connections=settings.upstream_max_connections,
+                max_keepalive_connections=settings.upstream_max_keepalive_connections,
+                keepalive_expiry=settings.upstream_keepalive_expiry_seconds,
+            )
+            self._transport = PooledUpstreamTransport(
+                limits=limits,
+                http2=self.http2,
+                dns_cache_ttl_seconds=settings.upstream_dns_cache_ttl_seconds,
+            )
+            self._client = httpx.AsyncClient(transport=self._transport, timeout=settings.http_timeout_seconds)
+        return self._client
+
+    def stats(self) -> Dict[str, int]:
+        """连接池使用情况：active 为正在承载请求的连接，waiting 为排队等待连接的请求。"""
+        if self._transport is None:
+            return {"active": 0, "idle": 0, "waiting": 0}
+        pool = self._transport.pool
+        connections = pool.connections
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {"active": len(connections) - idle, "idle": idle, "waiting": self._waiting(pool)}
+
+    @staticmethod
+    def _waiting(pool: httpcore.AsyncConnectionPool) -> int:
+        # httpcore 没有公开排队中的请求，只能读私有状态；升级后结构变化时按 0 处理，不影响指标采集
+        try:
+            return sum(1 for request in pool._requests if request.connection is None)
+        except (AttributeError, TypeError):
+            return 0
+
+    def start(self) -> None:
+        """配置了上游模型时在后台预热连接，不阻塞应用启动。"""
+        settings = self._settings
+        count = settings.upstream_prewarm_connections
+        if count <= 0 or (settings.ai_provider or "").lower() != "openai":
+            return
+        if settings.ai_backends:
+            urls = [str(backend["base_url"]).rstrip("/") for backend in settings.ai_backends]
+        elif settings.ai_api_key:
+            urls = [ai_api_base_url(settings)]
+        else:
+            return
+        if self._prewarm_task is None or self._prewarm_task.done():
+            self._prewarm_task = asyncio.create_task(self._prewarm_all(urls, count))
+
+    async def _prewarm_all(self, urls: List[str], count: int) -> None:
+        await asyncio.gather(*(self.prewarm(url, count) for url in urls))
+
+    async def prewarm(self, url: str, count: int) -> int:
+        """
+        并发发起 count 个轻量请求以建立连接并放回池中，返回成功建连的请求数。
+
+        只关心连接是否建立，响应状态码不影响结果；HTTP/2 下请求会复用同一连接。
+        """
+        client = self.client
+        results = await asyncio.gather(*(client.head(url) for _ in range(count)), return_exceptions=True)
+        warmed = sum(1 for result in results if isinstance(result, httpx.Response))
+        if warmed < count:
+            logger.warning("上游连接预热未完全成功 url=%s warmed=%d/%d", url, warmed, count)
+        else:
+            logger.info("上游连接预热完成 url=%s connections=%d", url, warmed)
+        return warmed
+
+    async def aclose(self) -> None:
+        if self._prewarm_task is not None:
+            self._prewarm_task.cancel()
+            await asyncio.gather(self._prewarm_task, return_exceptions=True)
+            self._prewarm_task = None
+        if self._client is not None:
+            client, self._client = self._client, None
+            self._transport = None
+            await client.aclose()
+
+
+# 全局上游连接池实例
+_upstream_pool: Optional[UpstreamClientPool] = None
+
+
+def get_upstream_pool() -> UpstreamClientPool:
+    """获取全局上游连接池实例。"""
+    global _upstream_pool
+    if _upstream_pool is None:
+        _upstream_pool = UpstreamClientPool()
+    return _upstream_pool
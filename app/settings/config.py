@@ -1,10 +1,13 @@
 """应用配置与环境变量加载逻辑。"""
+import json
 from functools import lru_cache
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from pydantic import AnyHttpUrl, Field, field_validator, ConfigDict
 from pydantic_settings import BaseSettings
 
+from app.core.message_ids import WORKER_ID_PATTERN
+
 
 class Settings(BaseSettings):
     """集中式配置定义，便于后续依赖注入与测试覆盖。"""
@@ -45,11 +48,67 @@ class Settings(BaseSettings):
 
     http_timeout_seconds: float = Field(10.0, env="HTTP_TIMEOUT_SECONDS")
     event_stream_heartbeat_seconds: float = Field(15.0, env="SSE_HEARTBEAT_SECONDS")
+    sse_replay_buffer_size: int = Field(512, env="SSE_REPLAY_BUFFER_SIZE")
+    sse_replay_ttl_seconds: float = Field(120.0, env="SSE_REPLAY_TTL_SECONDS")
+    sse_coalesce_window_ms: float = Field(15.0, ge=0, env="SSE_COALESCE_WINDOW_MS")
+    sse_compression_enabled: bool = Field(False, env="SSE_COMPRESSION_ENABLED")
+    sse_compression_level: int = Field(6, ge=1, le=9, env="SSE_COMPRESSION_LEVEL")
+    ws_auth_timeout_seconds: float = Field(10.0, gt=0, env="WS_AUTH_TIMEOUT_SECONDS")
+    message_channel_subscribe_timeout_seconds: float = Field(60.0, env="MESSAGE_CHANNEL_SUBSCRIBE_TIMEOUT_SECONDS")
+    message_channel_max_lifetime_seconds: float = Field(900.0, env="MESSAGE_CHANNEL_MAX_LIFETIME_SECONDS")
+    message_channel_sweep_interval_seconds: float = Field(5.0, env="MESSAGE_CHANNEL_SWEEP_INTERVAL_SECONDS")
+    message_broker_backend: str = Field("memory", env="MESSAGE_BROKER_BACKEND")
+    message_broker_redis_url: Optional[str] = Field(None, env="MESSAGE_BROKER_REDIS_URL")
+    message_broker_key_prefix: str = Field("gymbro:msg", env="MESSAGE_BROKER_KEY_PREFIX")
+
+    # 粘性路由：worker 标识写入消息 ID，分发器据此把事件流请求转发到对应 worker 的 Unix socket
+    worker_id: Optional[str] = Field(None, env="WORKER_ID")
+    sticky_worker_sockets: Optional[str] = Field(None, env="STICKY_WORKER_SOCKETS")
     trace_header_name: str = Field("x-trace-id", env="TRACE_HEADER_NAME")
     ai_provider: Optional[str] = Field(None, env="AI_PROVIDER")
     ai_model: Optional[str] = Field(None, env="AI_MODEL")
     ai_api_base_url: Optional[AnyHttpUrl] = Field(None, env="AI_API_BASE_URL")
     ai_api_key: Optional[str] = Field(None, env="AI_API_KEY")
+    # 上游 AI 接口的共享连接池：长连接复用、可选 HTTP/2、DNS 缓存与启动预热
+    upstream_max_connections: int = Field(100, ge=1, env="UPSTREAM_MAX_CONNECTIONS")
+    upstream_max_keepalive_connections: int = Field(20, ge=0, env="UPSTREAM_MAX_KEEPALIVE_CONNECTIONS")
+    upstream_keepalive_expiry_seconds: float = Field(60.0, ge=0, env="UPSTREAM_KEEPALIVE_EXPIRY_SECONDS")
+    upstream_http2_enabled: bool = Field(False, env="UPSTREAM_HTTP2_ENABLED")
+    upstream_dns_cache_ttl_seconds: float = Field(300.0, ge=0, env="UPSTREAM_DNS_CACHE_TTL_SECONDS")
+    upstream_prewarm_connections: int = Field(2, ge=0, env="UPSTREAM_PREWARM_CONNECTIONS")
+    # 重复提示词的回复缓存：键为归一化文本 + 模型 + 提示词版本，修改系统提示词时需提升版本
+    ai_reply_cache_enabled: bool = Field(False, env="AI_REPLY_CACHE_ENABLED")
+    ai_reply_cache_max_bytes: int = Field(8 * 1024 * 1024, ge=0, env="AI_REPLY_CACHE_MAX_BYTES")
+    ai_reply_cache_ttl_seconds: float = Field(600.0, gt=0, env="AI_REPLY_CACHE_TTL_SECONDS")
+    ai_prompt_version: str = Field("v1", env="AI_PROMPT_VERSION")
+    # 相同输入的并发请求共享一次上游生成（metadata 中 cache=false 的请求不参与）
+    ai_single_flight_enabled: bool = Field(True, env="AI_SINGLE_FLIGHT_ENABLED")
+    # 生成任务调度：全局并发上限、单用户在途上限、排队上限与按用户类型的公平排队权重
+    ai_max_concurrent_generations: int = Field(32, ge=1, env="AI_MAX_CONCURRENT_GENERATIONS")
+    ai_max_inflight_per_user: int = Field(2, ge=1, env="AI_MAX_INFLIGHT_PER_USER")
+    ai_max_queued_generations: int = Field(500, ge=0, env="AI_MAX_QUEUED_GENERATIONS")
+    ai_scheduler_weight_permanent: float = Field(4.0, gt=0, env="AI_SCHEDULER_WEIGHT_PERMANENT")
+    ai_scheduler_weight_anonymous: float = Field(1.0, gt=0, env="AI_SCHEDULER_WEIGHT_ANONYMOUS")
+    # 多上游路由：JSON 数组，每项含 name/base_url，可选 api_key/model（缺省取 AI_API_KEY/AI_MODEL）
+    ai_backends: List[Dict[str, str]] = Field(default_factory=list, env="AI_BACKENDS")
+    ai_router_ewma_alpha: float = Field(0.3, gt=0, le=1, env="AI_ROUTER_EWMA_ALPHA")
+    ai_router_error_threshold: float = Field(0.5, gt=0, le=1, env="AI_ROUTER_ERROR_THRESHOLD")
+    # 对冲请求：短提示词的主请求超过 p95 首字延迟（样本不足时用 AI_HEDGE_DELAY_MS）仍无输出时向次优后端再发一次
+    ai_hedge_enabled: bool = Field(False, env="AI_HEDGE_ENABLED")
+    ai_hedge_max_prompt_chars: int = Field(200, ge=0, env="AI_HEDGE_MAX_PROMPT_CHARS")
+    ai_hedge_delay_ms: float = Field(800.0, ge=0, env="AI_HEDGE_DELAY_MS")
+    # 每个后端的熔断器：连续瞬时故障达到阈值后熔断，冷却后放行探测请求
+    ai_circuit_failure_threshold: int = Field(5, ge=1, env="AI_CIRCUIT_FAILURE_THRESHOLD")
+    ai_circuit_reset_timeout_seconds: float = Field(30.0, gt=0, env="AI_CIRCUIT_RESET_TIMEOUT_SECONDS")
+    ai_circuit_half_open_max_calls: int = Field(1, ge=1, env="AI_CIRCUIT_HALF_OPEN_MAX_CALLS")
+    # 首个增量前的瞬时故障重试：总尝试次数（含首次）与带抖动的指数退避
+    ai_retry_max_attempts: int = Field(3, ge=1, env="AI_RETRY_MAX_ATTEMPTS")
+    ai_retry_backoff_base_ms: float = Field(200.0, ge=0, env="AI_RETRY_BACKOFF_BASE_MS")
+    ai_retry_backoff_max_ms: float = Field(2000.0, ge=0, env="AI_RETRY_BACKOFF_MAX_MS")
+    # 上游建连超时，独立于整体的 HTTP_TIMEOUT_SECONDS，让不可达的后端尽快失败
+    ai_upstream_connect_timeout_seconds: float = Field(3.0, gt=0, env="AI_UPSTREAM_CONNECT_TIMEOUT_SECONDS")
+    # 最后一个订阅者离开超过该时长后取消生成并中止上游请求，0 表示不自动取消
+    ai_idle_cancel_grace_seconds: float = Field(30.0, ge=0, env="AI_IDLE_CANCEL_GRACE_SECONDS")
 
     # 匿名用户支持配置
     anon_enabled: bool = Field(True, env="ANON_ENABLED")
@@ -68,6 +127,24 @@ class Settings(BaseSettings):
     sse_max_concurrent_per_user: int = Field(2, env="SSE_MAX_CONCURRENT_PER_USER")
     sse_max_concurrent_per_conversation: int = Field(1, env="SSE_MAX_CONCURRENT_PER_CONVERSATION")
     sse_max_concurrent_per_anonymous_user: int = Field(2, env="SSE_MAX_CONCURRENT_PER_ANONYMOUS_USER")
+    # 连接回收：超过空闲阈值未成功写出（应大于心跳间隔）或超过最长存活时间的流会被关闭，0 表示不限制
+    sse_idle_timeout_seconds: float = Field(60.0, ge=0, env="SSE_IDLE_TIMEOUT_SECONDS")
+    sse_max_connection_age_seconds: float = Field(3600.0, ge=0, env="SSE_MAX_CONNECTION_AGE_SECONDS")
+    sse_reaper_interval_seconds: float = Field(10.0, gt=0, env="SSE_REAPER_INTERVAL_SECONDS")
+    # 流开头与服务端关闭流前下发的 retry: 提示（毫秒），每条连接在基础值上叠加随机抖动
+    sse_reconnect_retry_ms: int = Field(3000, ge=0, env="SSE_RECONNECT_RETRY_MS")
+    sse_reconnect_jitter_ms: int = Field(2000, ge=0, env="SSE_RECONNECT_JITTER_MS")
+    # 下线排空：推送 reconnect 控制事件，客户端的重连时间均匀分布在该窗口内
+    sse_drain_window_seconds: float = Field(10.0, ge=0, env="SSE_DRAIN_WINDOW_SECONDS")
+    # 新连接准入令牌桶（每秒速率，0 表示不限制），平滑重连风暴
+    sse_admission_rate_per_second: float = Field(0.0, ge=0, env="SSE_ADMISSION_RATE_PER_SECOND")
+    sse_admission_burst: int = Field(50, ge=1, env="SSE_ADMISSION_BURST")
+    # 集群级并发租约：多 worker/副本共享并发上限，租约按 TTL 过期，续约按批次合并为一次往返
+    sse_lease_backend: str = Field("memory", env="SSE_LEASE_BACKEND")
+    sse_lease_redis_url: Optional[str] = Field(None, env="SSE_LEASE_REDIS_URL")
+    sse_lease_key_prefix: str = Field("gymbro:sse", env="SSE_LEASE_KEY_PREFIX")
+    sse_lease_ttl_seconds: float = Field(30.0, gt=0, env="SSE_LEASE_TTL_SECONDS")
+    sse_lease_renew_interval_seconds: float = Field(10.0, gt=0, env="SSE_LEASE_RENEW_INTERVAL_SECONDS")
 
     # 回滚预案配置
     auth_fallback_enabled: bool = Field(False, env="AUTH_FALLBACK_ENABLED")
@@ -101,6 +178,29 @@ class Settings(BaseSettings):
             return [item.strip() for item in value.split(",") if item.strip()]
         return list(value)
 
+    @field_validator("worker_id", mode="before")
+    @classmethod
+    def _check_worker_id(cls, value: object) -> Optional[str]:
+        if value in (None, ""):
+            return None
+        worker_id = str(value).strip().lower()
+        if not WORKER_ID_PATTERN.match(worker_id):
+            raise ValueError("WORKER_ID must be 1-8 lowercase letters or digits")
+        return worker_id
+
+    @field_validator("ai_backends", mode="before")
+    @classmethod
+    def _parse_backends(cls, value: object) -> List[Dict[str, str]]:
+        if value in (None, "", []):
+            return []
+        if isinstance(value, str):
+            value = json.loads(value)
+        backends = list(value)
+        for backend in backends:
+            if not backend.get("base_url"):
+                raise ValueError("every AI_BACKENDS entry requires base_url")
+        return backends
+
     @field_validator("allowed_hosts", mode="before")
     @classmethod
     def _split_hosts(cls, value: object) -> List[str]:
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+SSE 写合并基准：对比不同合并窗口与 completed 省略 reply 时的写出次数与字节数。
+
+在进程内模拟生产者按固定间隔发布 content_delta，消费者走与 /messages/{id}/events
+相同的 stream_subscription 写出路径；每次 yield 视为一次 socket send。
+
+    python scripts/bench_sse_coalescing.py --chars 4000 --chunk 120 --interval-ms 2
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.core.heartbeat import HeartbeatHandle
+from app.core.sse_stream import stream_subscription
+from app.services.message_broker import MessageEvent, MessageEventBroker, encode_sse_frame, encode_frame
+
+
+async def run_case(text: str, chunk: int, interval: float, window_ms: float, omit_reply: bool) -> Dict[str, float]:
+    broker = MessageEventBroker(buffer_size=4096, retention_seconds=60)
+    message_id = "bench"
+    channel = await broker.create_channel(message_id)
+    subscription = channel.subscribe()
+    heartbeat = HeartbeatHandle(subscription.wake)
+    heartbeat_frame = encode_sse_frame(MessageEvent(event="heartbeat", data={"message_id": message_id}))
+
+    async def produce() -> None:
+        await broker.publish(message_id, MessageEvent(event="status", data={"message_id": message_id, "state": "working"}))
+        for index in range(0, len(text), chunk):
+            await broker.publish(
+                message_id,
+                MessageEvent(event="content_delta", data={"message_id": message_id, "delta": text[index : index + chunk]}),
+            )
+            await asyncio.sleep(interval)
+        await broker.publish(message_id, MessageEvent(event="completed", data={"message_id": message_id, "reply": text}))
+        await broker.close(message_id)
+
+    writes = 0
+    total_bytes = 0
+    started = time.perf_counter()
+    producer = asyncio.create_task(produce())
+    async for frame in stream_subscription(
+        subscription,
+        heartbeat,
+        heartbeat_frame,
+        render=lambda item: encode_frame(item, "sse", omit_reply),
+        coalesce_seconds=window_ms / 1000,
+    ):
+        writes += 1
+        total_bytes += len(frame)
+    await producer
+    elapsed = time.perf_counter() - started
+    await broker.shutdown()
+    return {"writes": writes, "bytes": total_bytes, "elapsed_ms": elapsed * 1000}
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="SSE write coalescing benchmark")
+    parser.add_argument("--chars", type=int, default=4000, help="回复总字符数")
+    parser.add_argument("--chunk", type=int, default=120, help="每个 content_delta 的字符数")
+    parser.add_argument("--interval-ms", type=float, default=2.0, help="生产者发布间隔（毫秒）")
+    parser.add_argument("--windows", default="0,10,20", help="逗号分隔的合并窗口（毫秒）")
+    args = parser.parse_args()
+
+    text = ("健身计划示例：深蹲 5x5，卧推 5x5，硬拉 1x5。" * (args.chars // 20 + 1))[: args.chars]
+    windows: List[float] = [float(value) for value in args.windows.split(",") if value.strip()]
+
+    baseline = await run_case(text, args.chunk, args.interval_ms / 1000, 0, False)
+    print(f"{'window_ms':>9} {'omit_reply':>10} {'writes':>7} {'bytes':>8} {'writes_saved':>12} {'bytes_saved':>11} {'elapsed_ms':>10}")
+    for window in windows:
+        for omit_reply in (False, True):
+            result = await run_case(text, args.chunk, args.interval_ms / 1000, window, omit_reply)
+            writes_saved = 1 - result["writes"] / baseline["writes"]
+            bytes_saved = 1 - result["bytes"] / baseline["bytes"]
+            print(
+                f"{window:>9.0f} {str(omit_reply):>10} {result['writes']:>7} {result['bytes']:>8} "
+                f"{writes_saved:>11.1%} {bytes_saved:>10.1%} {result['elapsed_ms']:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
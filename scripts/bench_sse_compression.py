@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+SSE 流式压缩基准：对比不同编码与压缩级别下的带宽与 CPU 开销。
+
+按真实写出路径把每条回复切成 content_delta 帧并加上 status/completed 帧，
+每批写出后 sync flush，统计压缩后字节数与压缩耗时。
+
+语料文件（--corpus）支持两种格式：
+- JSONL：每行一个对象，取 reply / ai_reply / text 字段
+- 纯文本：以空行分隔的多段回复
+未提供语料时使用内置的合成中文健身回复。
+
+    python scripts/bench_sse_compression.py --corpus replies.jsonl --batch 4
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.core.sse_stream import StreamCompressor
+from app.services.message_broker import MessageEvent, encode_sse_frame
+
+_SYNTHETIC_PARAGRAPHS = [
+    "根据你的训练目标，本周建议安排三次全身力量训练，每次训练前进行十分钟动态热身。",
+    "深蹲：4 组 x 6-8 次，组间休息 2-3 分钟，注意膝盖与脚尖方向一致，下蹲至大腿与地面平行。",
+    "卧推：4 组 x 8 次，肩胛骨收紧下沉，杠铃下放至胸骨中下部，推起时保持手腕中立。",
+    "硬拉：3 组 x 5 次，起始时背部保持中立，杠铃贴近小腿，髋膝同时伸展完成动作。",
+    "饮食方面，每日蛋白质摄入建议为每公斤体重 1.6-2.2 克，训练后一小时内补充碳水与蛋白质。",
+    "如果出现持续的关节疼痛，请降低训练重量并咨询专业康复师，不要带伤训练。",
+]
+
+
+def load_corpus(path: Optional[str], synthetic_count: int) -> List[str]:
+    if not path:
+        return [
+            "\n".join(_SYNTHETIC_PARAGRAPHS[(index + offset) % len(_SYNTHETIC_PARAGRAPHS)] for offset in range(8))
+            for index in range(synthetic_count)
+        ]
+
+    content = Path(path).read_text(encoding="utf-8")
+    if path.endswith(".jsonl"):
+        replies = []
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            reply = record.get("reply") or record.get("ai_reply") or record.get("text")
+            if reply:
+                replies.append(reply)
+        return replies
+    return [block.strip() for block in content.split("\n\n") if block.strip()]
+
+
+def reply_frames(message_id: str, reply: str, chunk: int) -> List[bytes]:
+    events = [MessageEvent(event="status", data={"message_id": message_id, "state": "working"})]
+    events += [
+        MessageEvent(event="content_delta", data={"message_id": message_id, "delta": reply[index : index + chunk]})
+        for index in range(0, len(reply), chunk)
+    ]
+    events.append(MessageEvent(event="completed", data={"message_id": message_id, "reply": reply}))
+    frames = []
+    for sequence, event in enumerate(events, start=1):
+        event.id = sequence
+        frames.append(encode_sse_frame(event))
+    return frames
+
+
+def run_case(streams: List[List[bytes]], encoding: Optional[str], level: int, batch: int) -> Dict[str, float]:
+    raw = 0
+    sent = 0
+    cpu = 0.0
+    for frames in streams:
+        compressor = StreamCompressor(encoding, level) if encoding else None
+        for index in range(0, len(frames), batch):
+            chunk = b"".join(frames[index : index + batch])
+            raw += len(chunk)
+            if compressor is None:
+                sent += len(chunk)
+                continue
+            started = time.perf_counter()
+            sent += len(compressor.compress(chunk))
+            cpu += time.perf_counter() - started
+        if compressor is not None:
+            started = time.perf_counter()
+            sent += len(compressor.finish())
+            cpu += time.perf_counter() - started
+    return {"raw": raw, "sent": sent, "cpu_ms": cpu * 1000}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SSE streaming compression benchmark")
+    parser.add_argument("--corpus", help="录制的回复语料（.jsonl 或空行分隔的文本）")
+    parser.add_argument("--synthetic-count", type=int, default=200, help="未提供语料时生成的回复条数")
+    parser.add_argument("--chunk", type=int, default=120, help="每个 content_delta 的字符数")
+    parser.add_argument("--batch", type=int, default=1, help="每次写出合并的帧数（模拟写合并）")
+    parser.add_argument("--levels", default="1,6,9", help="逗号分隔的压缩级别")
+    args = parser.parse_args()
+
+    replies = load_corpus(args.corpus, args.synthetic_count)
+    if not replies:
+        raise SystemExit("语料为空")
+    streams = [reply_frames(f"{index:032x}", reply, args.chunk) for index, reply in enumerate(replies)]
+    source = args.corpus or "synthetic"
+    print(f"corpus={source} replies={len(replies)} frames={sum(len(frames) for frames in streams)} batch={args.batch}")
+
+    baseline = run_case(streams, None, 0, args.batch)
+    print(f"{'encoding':>8} {'level':>5} {'bytes':>10} {'ratio':>7} {'saved':>7} {'cpu_ms':>8} {'us/KB':>7}")
+    print(f"{'identity':>8} {'-':>5} {baseline['sent']:>10} {1:>7.3f} {0:>7.1%} {0:>8.1f} {0:>7.2f}")
+    for encoding in ("gzip", "deflate"):
+        for level in (int(value) for value in args.levels.split(",") if value.strip()):
+            result = run_case(streams, encoding, level, args.batch)
+            ratio = result["sent"] / result["raw"]
+            per_kb = result["cpu_ms"] * 1000 / (result["raw"] / 1024)
+            print(
+                f"{encoding:>8} {level:>5} {result['sent']:>10} {ratio:>7.3f} {1 - ratio:>7.1%} "
+                f"{result['cpu_ms']:>8.1f} {per_kb:>7.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
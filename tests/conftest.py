@@ -1,13 +1,52 @@
 from __future__ import annotations
 
 import asyncio
-from typing import AsyncIterator
+import json
+from typing import Any, AsyncIterator, Callable, Optional
 
 import pytest
 
+from app.auth.jwt_verifier import AuthenticatedUser
+from app.auth.provider import InMemoryProvider
+from app.services.ai_service import AIService
+
 
 @pytest.fixture(scope="session")
 def event_loop() -> AsyncIterator[asyncio.AbstractEventLoop]:
     loop = asyncio.new_event_loop()
     yield loop
     loop.close()
+
+
+@pytest.fixture
+def sse_chunk() -> Callable[[str], bytes]:
+    """把一段增量编码为 OpenAI 兼容上游的 SSE 数据行。"""
+
+    def encode(delta: str) -> bytes:
+        return b"data: %s\n\n" % json.dumps({"choices": [{"delta": {"content": delta}}]}).encode()
+
+    return encode
+
+
+@pytest.fixture
+def make_user() -> Callable[[str], AuthenticatedUser]:
+    """按 uid 构造已认证用户。"""
+
+    def build(uid: str) -> AuthenticatedUser:
+        return AuthenticatedUser(uid=uid, claims={"sub": uid})
+
+    return build
+
+
+@pytest.fixture
+def make_ai_service() -> Callable[..., AIService]:
+    """构造走 OpenAI 兼容上游的 AIService，关键字参数覆盖对应配置。"""
+
+    def build(provider: Optional[InMemoryProvider] = None, **settings: Any) -> AIService:
+        service = AIService(provider or InMemoryProvider())
+        service._settings = service._settings.model_copy(
+            update={"ai_provider": "openai", "ai_api_key": "sk-test", **settings}
+        )
+        return service
+
+    return build
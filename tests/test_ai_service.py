@@ -0,0 +1,185 @@
+"""AI 服务流式生成测试。"""
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import httpx
+
+from app.auth.jwt_verifier import AuthenticatedUser
+from app.auth.provider import InMemoryProvider
+from app.services.ai_service import AIMessageInput
+from app.services.message_broker import MessageEventBroker
+from app.services.reply_cache import ReplyCache
+
+
+class TestStreamingCompletion:
+    """上游增量逐段推送测试。"""
+
+    def test_deltas_are_published_before_upstream_finishes(self, sse_chunk, make_ai_service):
+        async def scenario():
+            release_tail = asyncio.Event()
+            requests = []
+
+            async def body():
+                yield b": keep-alive\n\n" + sse_chunk("  深蹲")
+                await release_tail.wait()
+                yield sse_chunk("5x5\n") + sse_chunk("") + b"data: [DONE]\n\n"
+
+            def handler(request: httpx.Request) -> httpx.Response:
+                requests.append(json.loads(request.content))
+                return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body())
+
+            provider = InMemoryProvider()
+            service = make_ai_service(provider)
+            broker = MessageEventBroker()
+            await broker.create_channel("m1")
+            subscription = await broker.subscribe("m1")
+            pool = SimpleNamespace(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+            async def next_event():
+                while True:
+                    item = subscription.next_event()
+                    if item is not None:
+                        return item
+                    await asyncio.wait_for(subscription.wait(), timeout=1)
+
+            with patch("app.services.ai_service.get_upstream_pool", return_value=pool):
+                task = asyncio.create_task(
+                    service.run_conversation(
+                        "m1", AuthenticatedUser(uid="u1", claims={"sub": "u1"}), AIMessageInput(text="计划"), broker
+                    )
+                )
+                events = [await next_event() for _ in range(3)]
+                # 上游尚未结束时首个增量已经推送，开头空白被去除
+                assert [event.event for event in events] == ["status", "status", "content_delta"]
+                assert events[-1].data["delta"] == "深蹲"
+
+                release_tail.set()
+                await asyncio.wait_for(task, timeout=1)
+
+            tail = [await next_event() for _ in range(2)]
+            # 增量原样推送，完整回复与非流式实现一致去掉首尾空白
+            assert tail[0].data["delta"] == "5x5\n"
+            assert tail[1].event == "completed" and tail[1].data["reply"] == "深蹲5x5"
+            assert provider.records[0]["ai_reply"] == "深蹲5x5"
+            assert requests[0]["stream"] is True
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_empty_stream_publishes_error(self, make_ai_service):
+        async def scenario():
+            def handler(request: httpx.Request) -> httpx.Response:
+                return httpx.Response(200, content=b"data: [DONE]\n\n")
+
+            broker = MessageEventBroker()
+            await broker.create_channel("m2")
+            subscription = await broker.subscribe("m2")
+            pool = SimpleNamespace(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+            with patch("app.services.ai_service.get_upstream_pool", return_value=pool):
+                await make_ai_service(InMemoryProvider()).run_conversation(
+                    "m2", AuthenticatedUser(uid="u1", claims={"sub": "u1"}), AIMessageInput(text="hi"), broker
+                )
+
+            events = []
+            while (item := subscription.next_event()) is not None:
+                events.append(item)
+            assert events[-1].event == "error"
+            assert "did not return content" in events[-1].data["error"]
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+
+class TestReplyCaching:
+    """重复提示词复用缓存或在途生成，不再重复请求上游。"""
+
+    def test_repeated_prompt_replays_cached_reply(self, sse_chunk, make_ai_service):
+        async def scenario():
+            calls = []
+
+            def handler(request: httpx.Request) -> httpx.Response:
+                calls.append(request)
+                body = sse_chunk("先热身") + sse_chunk("再训练") + b"data: [DONE]\n\n"
+                return httpx.Response(200, content=body)
+
+            service = make_ai_service(InMemoryProvider())
+            service._settings = service._settings.model_copy(update={"ai_reply_cache_enabled": True})
+            pool = SimpleNamespace(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+            broker = MessageEventBroker()
+            user = AuthenticatedUser(uid="anon", claims={"sub": "anon"})
+
+            async def run(message_id: str, text: str, metadata=None):
+                await broker.create_channel(message_id)
+                subscription = await broker.subscribe(message_id)
+                await service.run_conversation(message_id, user, AIMessageInput(text=text, metadata=metadata or {}), broker)
+                events = []
+                while (item := subscription.next_event()) is not None:
+                    events.append(item)
+                return events
+
+            with patch("app.services.ai_service.get_upstream_pool", return_value=pool), patch(
+                "app.services.ai_service.get_reply_cache", return_value=ReplyCache(1 << 20, 60)
+            ):
+                first = await run("c1", "今天练什么")
+                second = await run("c2", " 今天练什么 ")
+                assert len(calls) == 1
+                # 命中时仍走正常的事件管道
+                assert [event.event for event in second] == ["status", "status", "content_delta", "completed"]
+                assert second[-1].data["reply"] == first[-1].data["reply"] == "先热身再训练"
+
+                await run("c3", "今天练什么", {"cache": False})
+                assert len(calls) == 2
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_concurrent_identical_prompts_share_one_upstream_call(self, sse_chunk, make_ai_service):
+        async def scenario():
+            calls = []
+            release = asyncio.Event()
+
+            async def body():
+                yield sse_chunk("热身")
+                await release.wait()
+                yield sse_chunk("拉伸") + b"data: [DONE]\n\n"
+
+            def handler(request: httpx.Request) -> httpx.Response:
+                calls.append(request)
+                return httpx.Response(200, content=body())
+
+            service = make_ai_service(InMemoryProvider())
+            pool = SimpleNamespace(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+            broker = MessageEventBroker()
+            subscriptions = []
+            for index in range(3):
+                await broker.create_channel(f"s{index}")
+                subscriptions.append(await broker.subscribe(f"s{index}"))
+
+            with patch("app.services.ai_service.get_upstream_pool", return_value=pool):
+                tasks = [
+                    asyncio.create_task(
+                        service.run_conversation(
+                            f"s{index}",
+                            AuthenticatedUser(uid=f"u{index}", claims={"sub": f"u{index}"}),
+                            AIMessageInput(text="拉伸动作"),
+                            broker,
+                        )
+                    )
+                    for index in range(3)
+                ]
+                await asyncio.sleep(0.05)
+                release.set()
+                await asyncio.wait_for(asyncio.gather(*tasks), timeout=1)
+
+            assert len(calls) == 1
+            for subscription in subscriptions:
+                events = []
+                while (item := subscription.next_event()) is not None:
+                    events.append(item)
+                assert [event.data["delta"] for event in events if event.event == "content_delta"] == ["热身", "拉伸"]
+                assert events[-1].data["reply"] == "热身拉伸"
+            await broker.shutdown()
+
+        asyncio.run(scenario())
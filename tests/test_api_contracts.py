@@ -7,6 +7,7 @@ from fastapi.testclient import TestClient
 
 from app import app
 from app.auth.jwt_verifier import AuthenticatedUser
+from app.core.rate_limiter import RateLimiter
 
 
 class TestAPIContracts:
@@ -108,6 +109,19 @@ class TestAPIContracts:
         data = response.json()
         assert "detail" in data
 
+    @patch('app.auth.dependencies.get_jwt_verifier')
+    def test_messages_events_owner_contract(self, mock_get_verifier, mock_auth_user, auth_headers):
+        """测试他人的消息事件流返回404。"""
+        mock_verifier = Mock()
+        mock_verifier.verify_token.return_value = mock_auth_user
+        mock_get_verifier.return_value = mock_verifier
+
+        with patch.object(RateLimiter, "check_rate_limit", return_value=(True, None, None)), TestClient(app) as client:
+            broker = app.state.message_broker
+            client.portal.call(lambda: broker.create_channel("other-users-message", owner="someone-else"))
+            response = client.get("/api/v1/messages/other-users-message/events", headers=auth_headers)
+        assert response.status_code == 404
+
     def test_error_response_contract(self, client):
         """测试错误响应契约。"""
         # 测试401错误
@@ -166,6 +180,24 @@ class TestAPIContracts:
         if response.status_code == 200:
             assert "text/event-stream" in response.headers.get("content-type", "")
 
+    def test_frame_encoding_negotiation_contract(self):
+        """测试 Accept 按媒体类型与 q 值协商帧编码。"""
+        pytest.importorskip("msgpack")
+        from starlette.requests import Request
+
+        from app.api.v1.messages import _negotiate_encoding
+
+        def negotiate(accept):
+            return _negotiate_encoding(Request({"type": "http", "headers": [(b"accept", accept.encode())]}))
+
+        assert negotiate("application/vnd.msgpack") == "msgpack"
+        assert negotiate("text/event-stream, application/x-msgpack") == "msgpack"
+        assert negotiate("application/x-msgpack;q=0, text/event-stream") == "sse"
+        assert negotiate("application/msgpack; q=0.0") == "sse"
+        assert negotiate("text/event-stream;q=1.0, application/vnd.msgpack;q=0.5") == "sse"
+        assert negotiate("application/x-msgpack-extended") == "sse"
+        assert negotiate("*/*") == "sse"
+
     def test_cors_contract(self, client):
         """测试CORS契约。"""
         # 发送OPTIONS预检请求
@@ -0,0 +1,167 @@
+"""上游熔断、重试与快速失败测试。"""
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from app.auth.jwt_verifier import AuthenticatedUser
+from app.auth.provider import InMemoryProvider
+from app.services.ai_service import AIMessageInput, AIService
+from app.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.services.message_broker import MessageEventBroker
+from app.services.model_router import ModelRouter, UpstreamBackend
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _backend(name: str, clock=None, threshold: int = 2) -> UpstreamBackend:
+    breaker = CircuitBreaker(name, failure_threshold=threshold, reset_timeout=10.0, clock=clock or _Clock())
+    return UpstreamBackend(name, f"http://{name}.test/v1", "sk-test", "gpt-4o-mini", breaker=breaker)
+
+
+def _status_error(code: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://upstream.test/v1/chat/completions")
+    return httpx.HTTPStatusError("upstream error", request=request, response=httpx.Response(code, request=request))
+
+
+class TestCircuitBreaker:
+    """closed / open / half_open 状态流转。"""
+
+    def test_opens_after_threshold_and_probes_after_cooldown(self):
+        clock = _Clock()
+        breaker = CircuitBreaker("b1", failure_threshold=2, reset_timeout=10.0, clock=clock)
+        breaker.record_failure()
+        assert breaker.state == "closed"
+        breaker.record_failure()
+        assert breaker.state == "open" and not breaker.acquire()
+        clock.now = 4.0
+        assert breaker.retry_after() == pytest.approx(6.0)
+
+        clock.now = 10.0
+        # 冷却结束只放行一个探测请求
+        assert breaker.acquire() and breaker.state == "half_open"
+        assert not breaker.acquire()
+        breaker.record_failure()
+        assert breaker.state == "open"
+
+        clock.now = 20.0
+        assert breaker.acquire()
+        breaker.record_success()
+        assert breaker.state == "closed" and breaker.acquire()
+
+
+class TestBoundedRetries:
+    """首个增量前的瞬时故障按退避重试，其他错误立即失败。"""
+
+    def test_transient_failures_are_retried_with_backoff(self):
+        async def scenario():
+            backend = _backend("solo", threshold=5)
+            router = ModelRouter([backend], max_attempts=3, backoff_base=0.01, backoff_max=0.02)
+            calls = []
+
+            async def flaky(target):
+                calls.append(target.name)
+                if len(calls) < 3:
+                    raise _status_error(503)
+                yield "ok"
+
+            assert [chunk async for chunk in router.stream(flaky)] == ["ok"]
+            assert calls == ["solo"] * 3
+            assert backend.breaker.state == "closed"
+
+            calls.clear()
+
+            async def rejected(target):
+                calls.append(target.name)
+                raise _status_error(400)
+                yield  # pragma: no cover
+
+            with pytest.raises(httpx.HTTPStatusError):
+                [chunk async for chunk in router.stream(rejected)]
+            assert calls == ["solo"]
+
+        asyncio.run(scenario())
+
+    def test_open_circuit_fails_fast_without_calling_upstream(self):
+        async def scenario():
+            backend = _backend("solo")
+            router = ModelRouter([backend], max_attempts=2, backoff_base=0)
+            calls = []
+
+            async def down(target):
+                calls.append(target.name)
+                raise httpx.ConnectError("refused")
+                yield  # pragma: no cover
+
+            with pytest.raises(httpx.ConnectError):
+                [chunk async for chunk in router.stream(down)]
+            assert backend.breaker.state == "open"
+
+            with pytest.raises(CircuitOpenError) as excinfo:
+                [chunk async for chunk in router.stream(down)]
+            assert calls == ["solo", "solo"]
+            assert excinfo.value.retry_after == pytest.approx(10.0)
+
+        asyncio.run(scenario())
+
+
+class TestFastFailEvents:
+    """熔断时消息通道收到带重试建议的 error 事件，readyz 暴露熔断状态。"""
+
+    def test_error_event_carries_retry_guidance(self):
+        async def scenario():
+            calls = []
+
+            def handler(request: httpx.Request) -> httpx.Response:
+                calls.append(request)
+                return httpx.Response(200)
+
+            service = AIService(InMemoryProvider())
+            service._settings = service._settings.model_copy(update={"ai_provider": "openai", "ai_api_key": "sk-test"})
+            backend = service.router.backends[0]
+            for _ in range(backend.breaker.failure_threshold):
+                backend.breaker.record_failure()
+
+            broker = MessageEventBroker()
+            await broker.create_channel("f1")
+            subscription = await broker.subscribe("f1")
+            pool = SimpleNamespace(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+            with patch("app.services.ai_service.get_upstream_pool", return_value=pool):
+                await service.run_conversation(
+                    "f1", AuthenticatedUser(uid="u1", claims={"sub": "u1"}), AIMessageInput(text="hi"), broker
+                )
+
+            events = []
+            while (item := subscription.next_event()) is not None:
+                events.append(item)
+            assert calls == []
+            assert events[-1].event == "error"
+            assert events[-1].data["code"] == "AI_UPSTREAM_UNAVAILABLE"
+            assert events[-1].data["retryable"] is True
+            assert events[-1].data["retry_after"] >= 1
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_readyz_reports_breaker_state(self):
+        with TestClient(app) as client:
+            model_router = app.state.ai_service.router
+            breaker = model_router.backends[0].breaker
+            for _ in range(breaker.failure_threshold):
+                breaker.record_failure()
+            try:
+                body = client.get("/api/v1/readyz").json()
+            finally:
+                breaker.record_success()
+        assert body["status"] == "degraded"
+        assert body["upstream"][model_router.backends[0].name]["state"] == "open"
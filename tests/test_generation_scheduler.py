@@ -0,0 +1,118 @@
+"""生成任务调度测试。"""
+import asyncio
+
+import pytest
+
+from app.services.generation_scheduler import GenerationJob, GenerationScheduler, SchedulerQueueFull
+
+
+def _scheduler(**overrides) -> GenerationScheduler:
+    options = {
+        "max_concurrent": 1,
+        "max_per_user": 1,
+        "max_queued": 100,
+        "weights": {"permanent": 4.0, "anonymous": 1.0},
+    }
+    options.update(overrides)
+    return GenerationScheduler(**options)
+
+
+class _Gate:
+    """可控结束的生成任务，记录启动顺序。"""
+
+    def __init__(self, started: list) -> None:
+        self.started = started
+        self.releases: dict = {}
+
+    def job(self, message_id: str, user_id: str, user_class: str = "permanent", on_position=None) -> GenerationJob:
+        release = self.releases.setdefault(message_id, asyncio.Event())
+
+        async def run() -> None:
+            self.started.append(message_id)
+            await release.wait()
+
+        return GenerationJob(message_id, user_id, user_class, run, on_position=on_position)
+
+    async def finish(self, message_id: str) -> None:
+        self.releases[message_id].set()
+        await asyncio.sleep(0.01)
+
+
+class TestGenerationScheduler:
+    """并发上限、公平排队与排队位置测试。"""
+
+    def test_global_and_per_user_caps(self):
+        async def scenario():
+            started = []
+            gate = _Gate(started)
+            scheduler = _scheduler(max_concurrent=2)
+            assert scheduler.submit(gate.job("a1", "u1")) == 0
+            assert scheduler.submit(gate.job("a2", "u1")) > 0
+            assert scheduler.submit(gate.job("b1", "u2")) == 0
+            assert scheduler.submit(gate.job("c1", "u3")) > 0
+            await asyncio.sleep(0.01)
+            # u1 已有在途任务，a2 排队；全局上限 2，c1 排队
+            assert started == ["a1", "b1"]
+
+            await gate.finish("b1")
+            # 全局名额空出，但 a2 仍受单用户上限约束，c1 先运行
+            assert started == ["a1", "b1", "c1"]
+            await gate.finish("a1")
+            assert started[-1] == "a2"
+            assert scheduler.queued_count == 0
+            await scheduler.shutdown()
+            assert scheduler.running_count == 0
+
+        asyncio.run(scenario())
+
+    def test_weighted_fair_queuing_between_user_classes(self):
+        async def scenario():
+            started = []
+            gate = _Gate(started)
+            scheduler = _scheduler(max_per_user=10)
+            scheduler.submit(gate.job("blocker", "p0"))
+            for index in range(5):
+                scheduler.submit(gate.job(f"anon{index}", f"a{index}", "anonymous"))
+            for index in range(5):
+                scheduler.submit(gate.job(f"perm{index}", f"p{index + 1}"))
+
+            await gate.finish("blocker")
+            for _ in range(5):
+                await gate.finish(started[-1])
+            dispatched = started[1:6]
+            # 4:1 权重下，匿名洪峰不会挤占正式用户
+            assert sum(name.startswith("perm") for name in dispatched) == 4
+            assert sum(name.startswith("anon") for name in dispatched) == 1
+            await scheduler.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_queue_positions_are_announced_and_bounded(self):
+        async def scenario():
+            started = []
+            positions = {}
+            gate = _Gate(started)
+            scheduler = _scheduler(max_per_user=10, max_queued=2)
+
+            def recorder(message_id):
+                async def on_position(position, depth):
+                    positions.setdefault(message_id, []).append((position, depth))
+
+                return on_position
+
+            for message_id in ("m1", "m2", "m3"):
+                scheduler.submit(gate.job(message_id, "u1", on_position=recorder(message_id)))
+            with pytest.raises(SchedulerQueueFull):
+                scheduler.submit(gate.job("m4", "u1"))
+
+            await asyncio.sleep(0.01)
+            assert positions == {"m2": [(1, 1)], "m3": [(2, 2)]}
+            await gate.finish("m1")
+            assert positions["m3"][-1] == (1, 1)
+            assert "m1" not in positions
+
+            assert scheduler.cancel("m3")
+            assert started == ["m1", "m2"]
+            await scheduler.shutdown()
+
+        asyncio.run(scenario())
@@ -0,0 +1,45 @@
+"""SSE 心跳调度测试。"""
+import asyncio
+import time
+
+from app.core.heartbeat import HeartbeatScheduler
+
+
+class TestHeartbeatScheduler:
+    """全局心跳节拍测试。"""
+
+    def test_tick_only_wakes_idle_streams(self):
+        async def scenario():
+            scheduler = HeartbeatScheduler(interval=10)
+            woken = []
+            idle = scheduler.register(lambda: woken.append("idle"))
+            busy = scheduler.register(lambda: woken.append("busy"))
+            idle.last_write = time.monotonic() - 11
+
+            assert scheduler.tick() == 1
+            assert woken == ["idle"]
+            assert idle.due and not busy.due
+            # 已到期但尚未写出的流不会被重复唤醒
+            assert scheduler.tick() == 0
+
+            assert idle.consume_due()
+            assert not idle.consume_due()
+            scheduler.unregister(idle)
+            scheduler.unregister(busy)
+
+        asyncio.run(scenario())
+
+    def test_background_task_fires_and_stops_when_empty(self):
+        async def scenario():
+            scheduler = HeartbeatScheduler(interval=0.5)
+            fired = asyncio.Event()
+            handle = scheduler.register(fired.set)
+
+            await asyncio.wait_for(fired.wait(), timeout=2)
+            assert handle.due
+
+            scheduler.unregister(handle)
+            await asyncio.sleep(0.5)
+            assert scheduler._task is None
+
+        asyncio.run(scenario())
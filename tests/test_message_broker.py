@@ -0,0 +1,347 @@
+"""消息事件通道测试。"""
+import asyncio
+import struct
+
+import pytest
+
+from app.services.message_broker import MessageEvent, MessageEventBroker, encode_frame
+
+
+def _event(index: int) -> MessageEvent:
+    return MessageEvent(event="content_delta", data={"message_id": "msg-1", "delta": str(index)})
+
+
+def _drain(subscription) -> list:
+    items = []
+    while (item := subscription.next_event()) is not None:
+        items.append(item.data["delta"])
+    return items
+
+
+class TestMessageEventBroker:
+    """回放缓冲与断线续传测试。"""
+
+    def test_events_are_sequenced_and_pre_encoded(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=8, retention_seconds=60)
+            await broker.create_channel("msg-1")
+            await broker.publish("msg-1", _event(0))
+            await broker.publish("msg-1", _event(1))
+
+            subscription = await broker.subscribe("msg-1")
+            first = subscription.next_event()
+            second = subscription.next_event()
+            assert (first.id, second.id) == (1, 2)
+            assert second.frame == b'id: 2\nevent: content_delta\ndata: {"message_id":"msg-1","delta":"1"}\n\n'
+            assert subscription.next_event() is None
+
+        asyncio.run(scenario())
+
+    def test_replay_from_last_event_id(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=8, retention_seconds=60)
+            await broker.create_channel("msg-1")
+            for index in range(5):
+                await broker.publish("msg-1", _event(index))
+
+            assert _drain(await broker.subscribe("msg-1", last_event_id=3)) == ["3", "4"]
+
+        asyncio.run(scenario())
+
+    def test_ring_evicts_oldest_and_resumes_from_window_start(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=4, retention_seconds=60)
+            channel = await broker.create_channel("msg-1")
+            for index in range(10):
+                await broker.publish("msg-1", _event(index))
+
+            subscription = channel.subscribe()
+            assert channel.ring.first_id == 7
+            assert subscription.next_event().id == 7
+            assert subscription.skipped == 6
+
+        asyncio.run(scenario())
+
+    def test_closed_channel_is_retained_then_expired(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=4, retention_seconds=30)
+            channel = await broker.create_channel("msg-1")
+            await broker.publish("msg-1", _event(0))
+            await broker.close("msg-1")
+
+            assert broker.get_channel("msg-1") is channel
+            subscription = channel.subscribe()
+            assert subscription.next_event().id == 1
+            assert subscription.exhausted
+
+            broker.sweep(now=channel.closed_at + 29)
+            assert broker.get_channel("msg-1") is channel
+            broker.sweep(now=channel.closed_at + 31)
+            assert broker.get_channel("msg-1") is None
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+
+class TestFrameEncoding:
+    """协商编码测试。"""
+
+    def test_msgpack_frame_is_length_prefixed_and_cached(self):
+        msgpack = pytest.importorskip("msgpack")
+
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=8, retention_seconds=60)
+            channel = await broker.create_channel("msg-1")
+            await broker.publish("msg-1", _event(0))
+            await broker.publish("msg-1", _event(1))
+
+            first, second = channel.subscribe(), channel.subscribe()
+            frame = encode_frame(first.next_event(), "msgpack")
+            assert encode_frame(second.next_event(), "msgpack") is frame
+
+            (length,) = struct.unpack(">I", frame[:4])
+            assert length == len(frame) - 4
+            assert msgpack.unpackb(frame[4:]) == {
+                "id": 1,
+                "event": "content_delta",
+                "data": {"message_id": "msg-1", "delta": "0"},
+            }
+
+        asyncio.run(scenario())
+
+    def test_completed_reply_omitted_per_encoding(self):
+        pytest.importorskip("msgpack")
+        event = MessageEvent(event="completed", data={"message_id": "msg-1", "reply": "done"}, id=3)
+
+        assert b"done" not in encode_frame(event, "sse", omit_reply=True)
+        assert b"done" not in encode_frame(event, "msgpack", omit_reply=True)
+        assert set(event.variants) == {"sse_slim", "msgpack_slim"}
+
+
+class TestFanOut:
+    """多订阅者扇出测试。"""
+
+    def test_subscribers_do_not_steal_events(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=16, retention_seconds=60)
+            channel = await broker.create_channel("msg-1")
+            phone = channel.subscribe()
+            dashboard = channel.subscribe()
+            for index in range(3):
+                await broker.publish("msg-1", _event(index))
+
+            assert _drain(phone) == ["0", "1", "2"]
+            assert _drain(dashboard) == ["0", "1", "2"]
+            assert channel.subscriber_count == 2
+
+        asyncio.run(scenario())
+
+    def test_frames_are_shared_between_subscribers(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=16, retention_seconds=60)
+            channel = await broker.create_channel("msg-1")
+            first, second = channel.subscribe(), channel.subscribe()
+            await broker.publish("msg-1", _event(0))
+
+            assert first.next_event().frame is second.next_event().frame
+
+        asyncio.run(scenario())
+
+    def test_all_waiting_subscribers_wake_on_publish(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=16, retention_seconds=60)
+            channel = await broker.create_channel("msg-1")
+            subscriptions = [channel.subscribe() for _ in range(3)]
+            waiters = [asyncio.create_task(sub.wait()) for sub in subscriptions]
+            await asyncio.sleep(0)
+            assert not any(waiter.done() for waiter in waiters)
+
+            await broker.publish("msg-1", _event(0))
+            await asyncio.wait_for(asyncio.gather(*waiters), timeout=1)
+
+        asyncio.run(scenario())
+
+    def test_lag_policies_are_independent(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=16, retention_seconds=60)
+            channel = await broker.create_channel("msg-1")
+            patient = channel.subscribe()
+            skipping = channel.subscribe(max_lag=2, on_lag="skip")
+            strict = channel.subscribe(max_lag=2, on_lag="disconnect")
+            for index in range(6):
+                await broker.publish("msg-1", _event(index))
+
+            assert _drain(patient) == ["0", "1", "2", "3", "4", "5"]
+            assert _drain(skipping) == ["4", "5"]
+            assert strict.next_event() is None
+            assert strict.lagged and strict.exhausted
+            assert channel.subscriber_count == 2
+
+        asyncio.run(scenario())
+
+    def test_close_wakes_waiting_subscriber(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=16, retention_seconds=60)
+            channel = await broker.create_channel("msg-1")
+            subscription = channel.subscribe()
+            waiter = asyncio.create_task(subscription.wait())
+            await asyncio.sleep(0)
+
+            await broker.close("msg-1")
+            await asyncio.wait_for(waiter, timeout=1)
+            assert subscription.exhausted
+
+        asyncio.run(scenario())
+
+
+class TestOwnerFeed:
+    """按用户多路复用测试。"""
+
+    def test_feed_includes_open_and_new_messages_only(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=16, retention_seconds=60)
+            await broker.create_channel("done", owner="u1")
+            await broker.close("done")
+            await broker.create_channel("running", owner="u1")
+            await broker.create_channel("other", owner="u2")
+
+            feed = await broker.watch_owner("u1")
+            assert feed.message_ids == ["running"]
+            await broker.create_channel("later", owner="u1")
+            assert sorted(feed.message_ids) == ["later", "running"]
+            await broker.publish("other", _event(9))
+            assert feed.next_event() is None
+
+            await broker.publish("running", _event(0))
+            await broker.publish("later", _event(1))
+            await broker.publish("running", _event(2))
+            items = []
+            while (item := feed.next_event()) is not None:
+                items.append((item[0], item[1].data["delta"]))
+            # 按消息轮转读取
+            assert items == [("running", "0"), ("later", "1"), ("running", "2")]
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_wait_wakes_on_any_member_or_new_message(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=16, retention_seconds=60)
+            await broker.create_channel("a", owner="u1")
+            feed = await broker.watch_owner("u1")
+
+            waiter = asyncio.create_task(feed.wait())
+            await asyncio.sleep(0)
+            await broker.publish("a", _event(0))
+            await asyncio.wait_for(waiter, timeout=1)
+            assert feed.next_event()[0] == "a"
+
+            waiter = asyncio.create_task(feed.wait())
+            await asyncio.sleep(0)
+            await broker.create_channel("b", owner="u1")
+            await broker.publish("b", _event(1))
+            await asyncio.wait_for(waiter, timeout=1)
+            assert feed.next_event()[0] == "b"
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_finished_messages_leave_feed_and_resume_uses_last_event_id(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=16, retention_seconds=60)
+            await broker.create_channel("a", owner="u1")
+            for index in range(3):
+                await broker.publish("a", _event(index))
+            await broker.close("a")
+
+            feed = await broker.watch_owner("u1", {"a": 2})
+            assert feed.next_event()[1].data["delta"] == "2"
+            assert feed.next_event() is None
+            assert feed.message_ids == []
+
+            feed.close()
+            await broker.create_channel("b", owner="u1")
+            assert feed.message_ids == []
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+
+class TestChannelReaper:
+    """孤儿通道回收测试。"""
+
+    def test_unsubscribed_channel_is_reaped_after_deadline(self):
+        async def scenario():
+            broker = MessageEventBroker(subscribe_timeout_seconds=10, max_lifetime_seconds=100)
+            channel = await broker.create_channel("orphan")
+            watched = await broker.create_channel("watched")
+            watched.subscribe()
+            created = channel.lease.created_at
+
+            assert broker.sweep(now=created + 5) == 0
+            assert broker.sweep(now=created + 11) == 1
+            assert broker.get_channel("orphan") is None
+            assert channel.closed
+            assert broker.get_channel("watched") is watched
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_channel_without_producer_is_reaped_at_max_lifetime(self):
+        async def scenario():
+            broker = MessageEventBroker(subscribe_timeout_seconds=10, max_lifetime_seconds=100)
+            channel = await broker.create_channel("stuck")
+            subscription = channel.subscribe()
+            created = channel.lease.created_at
+
+            assert broker.sweep(now=created + 50) == 0
+            assert broker.sweep(now=created + 101) == 1
+            assert subscription.exhausted
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_sweep_is_incremental(self):
+        async def scenario():
+            broker = MessageEventBroker(subscribe_timeout_seconds=1, sweep_batch_size=3)
+            for index in range(7):
+                await broker.create_channel(f"orphan-{index}")
+            later = max(broker.get_channel(f"orphan-{index}").lease.subscribe_deadline for index in range(7)) + 1
+
+            assert [broker.sweep(now=later) for _ in range(4)] == [3, 3, 1, 0]
+            assert broker.channel_count == 0
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_backlog_drains_past_batches_without_reaps(self):
+        async def scenario():
+            broker = MessageEventBroker(subscribe_timeout_seconds=1, sweep_batch_size=2)
+            for index in range(2):
+                (await broker.create_channel(f"live-{index}")).subscribe()
+            for index in range(2):
+                await broker.create_channel(f"orphan-{index}")
+            later = broker.get_channel("orphan-1").lease.subscribe_deadline + 1
+
+            # 第一批只弹出两个已订阅通道的条目并重新登记，没有回收任何通道，积压仍需继续处理
+            await broker._drain(now=later)
+            assert broker.channel_count == 2
+            assert broker.get_channel("live-0") is not None
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_close_after_lease_reschedules_single_check(self):
+        async def scenario():
+            broker = MessageEventBroker(subscribe_timeout_seconds=10, retention_seconds=5)
+            channel = await broker.create_channel("msg-1")
+            channel.subscribe()
+            await broker.close("msg-1")
+
+            # 创建时登记的检查条目已失效，只按关闭后的保留期回收
+            assert broker.sweep(now=channel.closed_at + 4) == 0
+            assert broker.sweep(now=channel.lease.subscribe_deadline + 1) == 1
+            assert broker.channel_count == 0
+            await broker.shutdown()
+
+        asyncio.run(scenario())
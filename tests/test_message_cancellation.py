@@ -0,0 +1,232 @@
+"""生成取消测试：用户停止、无人订阅自动取消与上游中止。"""
+import asyncio
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import httpx
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from app import app
+from app.auth import get_current_user
+from app.auth.provider import InMemoryProvider
+from app.core.rate_limiter import RateLimiter
+from app.services.ai_service import AIMessageInput
+from app.services.generation_scheduler import GenerationJob, GenerationScheduler
+from app.services.message_broker import MessageEventBroker
+
+
+class _StalledUpstream:
+    """先返回一段增量然后挂起的上游，记录连接是否被中止。"""
+
+    def __init__(self, first_chunk: bytes) -> None:
+        self.first_chunk = first_chunk
+        self.aborted = asyncio.Event()
+
+    async def body(self):
+        try:
+            yield self.first_chunk
+            await asyncio.sleep(30)
+            yield b"data: [DONE]\n\n"  # pragma: no cover
+        finally:
+            self.aborted.set()
+
+    def pool(self) -> SimpleNamespace:
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, content=self.body()))
+        return SimpleNamespace(client=httpx.AsyncClient(transport=transport))
+
+
+def _scheduler(max_concurrent: int) -> GenerationScheduler:
+    return GenerationScheduler(
+        max_concurrent=max_concurrent, max_per_user=1, max_queued=10, weights={"permanent": 1.0, "anonymous": 1.0}
+    )
+
+
+async def _events_until(subscription, name: str):
+    events = []
+    while not events or events[-1].event != name:
+        item = subscription.next_event()
+        if item is None:
+            await asyncio.wait_for(subscription.wait(), timeout=1)
+            continue
+        events.append(item)
+    return events
+
+
+class TestCancellation:
+    """取消时中止上游流、保存部分回复并推送 cancelled 事件。"""
+
+    def test_user_cancel_aborts_upstream_and_persists_partial_reply(self, sse_chunk, make_ai_service, make_user):
+        async def scenario():
+            upstream = _StalledUpstream(sse_chunk("先做热身"))
+            provider = InMemoryProvider()
+            service = make_ai_service(provider)
+            broker = MessageEventBroker()
+            await broker.create_channel("c1")
+            subscription = await broker.subscribe("c1")
+            scheduler = _scheduler(1)
+
+            async def run() -> None:
+                await service.run_conversation("c1", make_user("u1"), AIMessageInput(text="计划"), broker)
+
+            with patch("app.services.ai_service.get_upstream_pool", return_value=upstream.pool()):
+                scheduler.submit(GenerationJob("c1", "u1", "permanent", run))
+                started = await _events_until(subscription, "content_delta")
+                assert [event.data["state"] for event in started if event.event == "status"] == ["running", "working"]
+                assert scheduler.cancel("c1", reason="user")
+                events = await _events_until(subscription, "cancelled")
+
+            assert events[-1].data == {"message_id": "c1", "reason": "user", "reply": "先做热身"}
+            await asyncio.wait_for(upstream.aborted.wait(), timeout=1)
+            assert provider.records[0]["ai_reply"] == "先做热身"
+            assert provider.records[0]["metadata"]["cancelled"] == "user"
+            await scheduler.shutdown()
+            assert scheduler.running_count == 0
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_cancel_closes_reply_stream_and_trims_partial_reply(self, make_ai_service, make_user):
+        async def scenario():
+            provider = InMemoryProvider()
+            service = make_ai_service(provider)
+            broker = MessageEventBroker()
+            await broker.create_channel("c5")
+            subscription = await broker.subscribe("c5")
+            closed = []
+
+            async def stalled_reply(message, user, user_details):
+                try:
+                    yield "先做热身  \n"
+                    await asyncio.sleep(30)
+                finally:
+                    closed.append(True)
+
+            service._generate_reply = stalled_reply
+            task = asyncio.create_task(
+                service.run_conversation("c5", make_user("u1"), AIMessageInput(text="计划"), broker)
+            )
+            await _events_until(subscription, "content_delta")
+            task.cancel("user")
+            events = await _events_until(subscription, "cancelled")
+            assert closed == [True]
+            assert events[-1].data["reply"] == "先做热身"
+            assert provider.records[0]["ai_reply"] == "先做热身"
+            await asyncio.gather(task, return_exceptions=True)
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_generation_is_cancelled_after_last_subscriber_leaves(self, sse_chunk, make_ai_service, make_user):
+        async def scenario():
+            upstream = _StalledUpstream(sse_chunk("先做热身"))
+            service = make_ai_service(InMemoryProvider(), ai_idle_cancel_grace_seconds=0.05)
+            service.router.ewma_completion_tokens = 100.0
+            broker = MessageEventBroker()
+            await broker.create_channel("c2")
+            listener = await broker.subscribe("c2")
+            saved_before = REGISTRY.get_sample_value("ai_upstream_tokens_saved_total") or 0.0
+
+            with patch("app.services.ai_service.get_upstream_pool", return_value=upstream.pool()):
+                task = asyncio.create_task(
+                    service.run_conversation("c2", make_user("u1"), AIMessageInput(text="计划"), broker)
+                )
+                await _events_until(listener, "content_delta")
+                # 重新订阅前的短暂断线不触发取消
+                listener.close()
+                listener = await broker.subscribe("c2", 3)
+                await asyncio.sleep(0.1)
+                assert not task.done()
+
+                listener.close()
+                await asyncio.wait_for(upstream.aborted.wait(), timeout=1)
+                await asyncio.gather(task, return_exceptions=True)
+
+            assert task.cancelled()
+            replay = await broker.subscribe("c2")
+            events = await _events_until(replay, "cancelled")
+            assert events[-1].data["reason"] == "idle"
+            saved = REGISTRY.get_sample_value("ai_upstream_tokens_saved_total") - saved_before
+            assert 90 < saved < 100
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+
+class _SlowProvider(InMemoryProvider):
+    """保存聊天记录时阻塞，直到测试放行。"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.saving = threading.Event()
+        self.release = threading.Event()
+
+    def sync_chat_record(self, record) -> None:
+        self.saving.set()
+        self.release.wait(timeout=5)
+        super().sync_chat_record(record)
+
+
+class TestCancelAfterCompletion:
+    """回复已完整生成、正在保存时到达的取消不再重复保存。"""
+
+    def test_cancel_during_final_persist_keeps_completed_reply(self, make_ai_service, make_user):
+        async def scenario():
+            provider = _SlowProvider()
+            service = make_ai_service(provider, ai_provider="local")
+            broker = MessageEventBroker()
+            await broker.create_channel("c3")
+            subscription = await broker.subscribe("c3")
+
+            task = asyncio.create_task(
+                service.run_conversation("c3", make_user("u1"), AIMessageInput(text="计划"), broker)
+            )
+            await asyncio.to_thread(provider.saving.wait, 1)
+            task.cancel("user")
+            await asyncio.sleep(0.01)
+            provider.release.set()
+            await asyncio.gather(task, return_exceptions=True)
+
+            events = []
+            while (item := subscription.next_event()) is not None:
+                events.append(item.event)
+            assert events[-1] == "completed" and "cancelled" not in events
+            assert len(provider.records) == 1
+            assert "cancelled" not in provider.records[0]["metadata"]
+            await broker.shutdown()
+
+        asyncio.run(scenario())
+
+
+class TestCancelEndpoint:
+    """DELETE /api/v1/messages/{id} 只能取消自己进行中的消息。"""
+
+    def test_cancel_queued_message(self, make_user):
+        scheduler = _scheduler(0)
+
+        async def never_run() -> None:  # pragma: no cover
+            raise AssertionError("queued job must not run")
+
+        scheduler.submit(GenerationJob("q1", "owner", "permanent", never_run))
+        app.dependency_overrides[get_current_user] = lambda: make_user("owner")
+        try:
+            # 限流器为进程级单例，其他用例的失败请求可能让测试客户端 IP 进入冷静期
+            with patch("app.api.v1.messages.get_generation_scheduler", return_value=scheduler), patch.object(
+                RateLimiter, "check_rate_limit", return_value=(True, None, None)
+            ), TestClient(app) as client:
+                headers = {"Authorization": "Bearer test"}
+                assert client.delete("/api/v1/messages/unknown", headers=headers).status_code == 404
+
+                app.dependency_overrides[get_current_user] = lambda: make_user("other")
+                assert client.delete("/api/v1/messages/q1", headers=headers).status_code == 404
+                assert scheduler.queued_count == 1
+
+                app.dependency_overrides[get_current_user] = lambda: make_user("owner")
+                response = client.delete("/api/v1/messages/q1", headers=headers)
+        finally:
+            app.dependency_overrides.pop(get_current_user, None)
+
+        assert response.status_code == 202
+        assert response.json() == {"message_id": "q1", "state": "cancelled"}
+        assert scheduler.queued_count == 0
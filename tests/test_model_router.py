@@ -0,0 +1,179 @@
+"""多上游路由与对冲请求测试。"""
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+
+from app.auth.jwt_verifier import AuthenticatedUser
+from app.auth.provider import InMemoryProvider
+from app.services.ai_service import AIMessageInput, AIService
+from app.services.message_broker import MessageEventBroker
+from app.services.model_router import ModelRouter, UpstreamBackend
+
+
+def _backends(*names: str):
+    return [UpstreamBackend(name, f"http://{name}.test/v1", "sk-test", "gpt-4o-mini") for name in names]
+
+
+async def _collect(router: ModelRouter, open_stream, hedge: bool = False):
+    return [chunk async for chunk in router.stream(open_stream, hedge=hedge)]
+
+
+class TestModelRouter:
+    """按延迟与错误率选择后端。"""
+
+    def test_routes_to_fastest_healthy_backend(self):
+        async def scenario():
+            slow, fast, broken = _backends("slow", "fast", "broken")
+            slow.ewma_latency, fast.ewma_latency, broken.ewma_latency = 0.9, 0.2, 0.05
+            broken.ewma_error = 0.8
+            router = ModelRouter([slow, fast, broken])
+            assert router.ranked() == [fast, slow]
+
+            used = []
+
+            async def open_stream(backend):
+                used.append(backend.name)
+                yield "ok"
+
+            assert await _collect(router, open_stream) == ["ok"]
+            assert used == ["fast"]
+            # 首字延迟按 EWMA 平滑
+            assert 0.06 < fast.ewma_latency < 0.2
+
+        asyncio.run(scenario())
+
+    def test_fails_over_before_first_token(self):
+        async def scenario():
+            primary, backup = _backends("primary", "backup")
+            router = ModelRouter([primary, backup], max_attempts=2)
+
+            async def open_stream(backend):
+                if backend is primary:
+                    raise httpx.ConnectError("refused")
+                yield "备用"
+
+            assert await _collect(router, open_stream) == ["备用"]
+            assert primary.ewma_error > 0 and backup.ewma_error == 0
+            assert backup.ewma_latency is not None
+
+            async def always_fail(backend):
+                raise httpx.ConnectError("refused")
+                yield  # pragma: no cover
+
+            with pytest.raises(httpx.ConnectError):
+                await _collect(router, always_fail)
+            # 连续失败后 primary 被视为不健康，不再优先尝试
+            assert router.ranked() == [backup]
+
+        asyncio.run(scenario())
+
+
+    def test_non_retryable_error_is_not_failed_over(self):
+        async def scenario():
+            primary, backup = _backends("primary", "backup")
+            router = ModelRouter([primary, backup], max_attempts=2)
+            request = httpx.Request("POST", "http://primary.test/v1/chat/completions")
+            used = []
+
+            async def open_stream(backend):
+                used.append(backend.name)
+                raise httpx.HTTPStatusError("bad request", request=request, response=httpx.Response(400))
+                yield  # pragma: no cover
+
+            with pytest.raises(httpx.HTTPStatusError):
+                await _collect(router, open_stream)
+            assert used == ["primary"]
+            # 请求本身的问题不计入熔断
+            assert primary.breaker.state == "closed"
+
+        asyncio.run(scenario())
+
+
+    def test_cancel_before_first_token_counts_saved_tokens(self):
+        async def scenario():
+            router = ModelRouter(_backends("a", "b"), hedge_enabled=True, hedge_default_delay=0.01)
+            router.ewma_completion_tokens = 100.0
+            opened = []
+            saved_before = REGISTRY.get_sample_value("ai_upstream_tokens_saved_total") or 0.0
+
+            async def stalled(backend):
+                opened.append(backend.name)
+                await asyncio.sleep(30)
+                yield "迟到"  # pragma: no cover
+
+            task = asyncio.create_task(_collect(router, stalled, hedge=True))
+            await asyncio.sleep(0.05)
+            # 对冲请求已发出，两路都在等待首个增量
+            assert opened == ["a", "b"]
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+            assert REGISTRY.get_sample_value("ai_upstream_tokens_saved_total") - saved_before == 100
+
+        asyncio.run(scenario())
+
+
+class TestHedgedRequests:
+    """对冲请求：次优后端先产出首个增量时胜出，主请求被取消。"""
+
+    def test_hedge_wins_and_loser_is_cancelled(self, sse_chunk):
+        async def scenario():
+            requests = []
+            cancelled = []
+
+            async def body(host: str):
+                try:
+                    if host == "slow.test":
+                        await asyncio.sleep(5)
+                    yield sse_chunk(f"来自{host}") + b"data: [DONE]\n\n"
+                except BaseException:
+                    cancelled.append(host)
+                    raise
+
+            def handler(request: httpx.Request) -> httpx.Response:
+                requests.append(request.url.host)
+                return httpx.Response(200, content=body(request.url.host))
+
+            service = AIService(InMemoryProvider())
+            service._settings = service._settings.model_copy(
+                update={
+                    "ai_provider": "openai",
+                    "ai_api_key": "sk-test",
+                    "ai_backends": [
+                        {"name": "slow", "base_url": "http://slow.test/v1"},
+                        {"name": "fast", "base_url": "http://fast.test/v1"},
+                    ],
+                    "ai_hedge_enabled": True,
+                    "ai_hedge_delay_ms": 50,
+                    "ai_single_flight_enabled": False,
+                }
+            )
+            pool = SimpleNamespace(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+            broker = MessageEventBroker()
+            await broker.create_channel("h1")
+            subscription = await broker.subscribe("h1")
+
+            with patch("app.services.ai_service.get_upstream_pool", return_value=pool):
+                await asyncio.wait_for(
+                    service.run_conversation(
+                        "h1", AuthenticatedUser(uid="u1", claims={"sub": "u1"}), AIMessageInput(text="热身"), broker
+                    ),
+                    timeout=2,
+                )
+
+            events = []
+            while (item := subscription.next_event()) is not None:
+                events.append(item)
+            assert events[-1].data["reply"] == "来自fast.test"
+            assert requests == ["slow.test", "fast.test"]
+            assert cancelled == ["slow.test"]
+
+            # 长提示词不对冲
+            assert not service.router.should_hedge("x" * 500)
+            await broker.shutdown()
+
+        asyncio.run(scenario())
@@ -0,0 +1,153 @@
+"""Redis Streams Broker 测试（使用 fakeredis 作为本地替身）。"""
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.services.message_broker import MessageEvent  # noqa: E402
+from app.services.redis_broker import RedisStreamBroker  # noqa: E402
+
+
+def _make_pair():
+    """模拟两个 worker：各自持有 Broker 实例，共享同一个 Redis。"""
+
+    server = fakeredis.FakeServer()
+
+    def broker() -> RedisStreamBroker:
+        client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        return RedisStreamBroker(
+            client,
+            key_prefix="test:msg",
+            buffer_size=64,
+            retention_seconds=60,
+            max_lifetime_seconds=600,
+            block_ms=50,
+        )
+
+    return broker(), broker()
+
+
+def _event(index: int) -> MessageEvent:
+    return MessageEvent(event="content_delta", data={"message_id": "msg-1", "delta": str(index)})
+
+
+async def _collect(subscription, timeout: float = 2.0) -> list:
+    items = []
+
+    async def run():
+        while True:
+            item = subscription.next_event()
+            if item is None:
+                if subscription.exhausted:
+                    return
+                await subscription.wait()
+                continue
+            items.append((item.id, item.data["delta"]))
+
+    await asyncio.wait_for(run(), timeout=timeout)
+    return items
+
+
+class TestRedisStreamBroker:
+    """跨进程事件流测试。"""
+
+    def test_events_produced_on_one_worker_stream_from_another(self):
+        async def scenario():
+            producer, consumer = _make_pair()
+            await producer.create_channel("msg-1")
+            assert await consumer.has_channel("msg-1")
+
+            subscription = await consumer.subscribe("msg-1")
+            for index in range(3):
+                await producer.publish("msg-1", _event(index))
+            await producer.close("msg-1")
+
+            assert await _collect(subscription) == [(1, "0"), (2, "1"), (3, "2")]
+            await producer.shutdown()
+            await consumer.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_last_event_id_resumes_across_workers(self):
+        async def scenario():
+            producer, consumer = _make_pair()
+            await producer.create_channel("msg-1")
+            for index in range(4):
+                await producer.publish("msg-1", _event(index))
+            await producer.close("msg-1")
+
+            subscription = await consumer.subscribe("msg-1", last_event_id=2)
+            items = await _collect(subscription)
+            assert items == [(3, "2"), (4, "3")]
+            await producer.shutdown()
+            await consumer.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_frames_are_encoded_by_producer(self):
+        async def scenario():
+            producer, consumer = _make_pair()
+            await producer.create_channel("msg-1")
+            event = _event(0)
+            await producer.publish("msg-1", event)
+            await producer.close("msg-1")
+
+            subscription = await consumer.subscribe("msg-1")
+            await _collect(subscription)
+            mirrored = subscription.channel.ring.get(1)
+            assert mirrored.frame == event.frame
+            await producer.shutdown()
+            await consumer.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_unknown_message_returns_none(self):
+        async def scenario():
+            _, consumer = _make_pair()
+            assert await consumer.subscribe("missing") is None
+            await consumer.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_ownership_is_visible_from_other_workers(self):
+        async def scenario():
+            producer, consumer = _make_pair()
+            await producer.create_channel("msg-1", owner="u1")
+            await producer.create_channel("shared")
+
+            assert await consumer.owner_of("msg-1") == "u1"
+            assert await consumer.is_visible_to("msg-1", "u1")
+            assert not await consumer.is_visible_to("msg-1", "u2")
+            assert await consumer.is_visible_to("shared", "u2")
+            assert not await consumer.is_visible_to("missing", "u1")
+            await producer.shutdown()
+            await consumer.shutdown()
+
+        asyncio.run(scenario())
+
+    def test_owner_feed_discovers_messages_from_other_workers(self):
+        async def scenario():
+            producer, consumer = _make_pair()
+            await producer.create_channel("finished", owner="u1")
+            await producer.close("finished")
+            await producer.create_channel("msg-1", owner="u1")
+
+            feed = await consumer.watch_owner("u1")
+            assert feed.message_ids == ["msg-1"]
+            await producer.create_channel("msg-2", owner="u1")
+            await producer.publish("msg-2", _event(0))
+            await producer.close("msg-2")
+
+            async def first_event():
+                while (item := feed.next_event()) is None:
+                    await feed.wait()
+                return item
+
+            message_id, event = await asyncio.wait_for(first_event(), timeout=2)
+            assert (message_id, event.data["delta"]) == ("msg-2", "0")
+            feed.close()
+            await producer.shutdown()
+            await consumer.shutdown()
+
+        asyncio.run(scenario())
@@ -0,0 +1,62 @@
+"""AI 回复缓存测试。"""
+from prometheus_client import REGISTRY
+
+from app.services.reply_cache import ReplyCache, normalize_prompt
+
+
+def _lookups(result: str) -> float:
+    return REGISTRY.get_sample_value("ai_reply_cache_requests_total", {"result": result}) or 0.0
+
+
+class TestReplyCache:
+    """键归一化、LRU 与 TTL 测试。"""
+
+    def test_key_normalizes_prompt_but_not_model_or_version(self):
+        assert normalize_prompt("  今天 练什么？\n") == normalize_prompt("今天\t练什么?")
+        key = ReplyCache.key("Leg Day", "gpt-4o-mini", "v1")
+        assert key == ReplyCache.key(" leg   day ", "gpt-4o-mini", "v1")
+        assert key != ReplyCache.key("leg day", "gpt-4o", "v1")
+        assert key != ReplyCache.key("leg day", "gpt-4o-mini", "v2")
+
+    def test_lru_eviction_respects_memory_bound(self):
+        cache = ReplyCache(max_bytes=700, ttl_seconds=60)
+        for name in ("a", "b", "c"):
+            cache.set(name, "x" * 100, now=0)
+        assert len(cache) == 2 and cache.size_bytes <= 700
+
+        cache.set("b", "x" * 100, now=0)
+        assert cache.get("b", now=1) is not None
+        cache.set("d", "x" * 100, now=1)
+        # c 最久未使用，被淘汰
+        assert cache.get("c", now=1) is None
+        assert cache.get("b", now=1) is not None
+
+        cache.set("huge", "x" * 1000, now=1)
+        assert cache.get("huge", now=1) is None
+
+    def test_entries_expire_and_lookups_are_counted(self):
+        cache = ReplyCache(max_bytes=10_000, ttl_seconds=10)
+        hits, misses = _lookups("hit"), _lookups("miss")
+        cache.set("k", "reply", now=0)
+        assert cache.get("k", now=5) == "reply"
+        assert cache.get("k", now=11) is None
+        assert len(cache) == 0 and cache.size_bytes == 0
+        assert (_lookups("hit"), _lookups("miss")) == (hits + 1, misses + 1)
+
+    def test_key_follows_routed_backend_models(self, make_ai_service):
+        # 后端自带模型时缓存键以后端模型为准，而不是 AI_MODEL
+        qwen = make_ai_service(
+            ai_model="gpt-4o-mini",
+            ai_backends=[{"name": "a", "base_url": "http://a.test/v1", "model": "qwen-max"}],
+        )
+        assert qwen._cache_model() == "qwen-max"
+
+        mixed = make_ai_service(
+            ai_model="gpt-4o-mini",
+            ai_backends=[
+                {"name": "a", "base_url": "http://a.test/v1", "model": "qwen-max"},
+                {"name": "b", "base_url": "http://b.test/v1"},
+            ]
+        )
+        assert mixed._cache_model() == "gpt-4o-mini,qwen-max"
+        assert make_ai_service(ai_model="gpt-4o-mini")._cache_model() == "gpt-4o-mini"
@@ -0,0 +1,126 @@
+"""在途生成合并测试。"""
+import asyncio
+
+import pytest
+
+from app.services.single_flight import FlightAborted, SingleFlight
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+
+class TestSingleFlight:
+    """相同键共享一次生成。"""
+
+    def test_late_joiner_receives_prefix_then_live_deltas(self):
+        async def scenario():
+            step = asyncio.Event()
+            calls = []
+            completed = []
+
+            async def source():
+                calls.append(1)
+                yield "a"
+                yield "b"
+                await step.wait()
+                yield "c"
+
+            flights = SingleFlight()
+            first = flights.stream("k", source, completed.append)
+            leader = asyncio.create_task(_collect(first))
+            await asyncio.sleep(0.01)
+
+            follower = asyncio.create_task(_collect(flights.stream("k", source)))
+            await asyncio.sleep(0.01)
+            step.set()
+
+            assert await leader == ["a", "b", "c"]
+            assert await follower == ["a", "b", "c"]
+            assert calls == [1] and completed == ["abc"]
+            assert len(flights) == 0
+
+        asyncio.run(scenario())
+
+    def test_errors_reach_every_participant(self):
+        async def scenario():
+            async def source():
+                yield "a"
+                await asyncio.sleep(0.01)
+                raise RuntimeError("upstream failed")
+
+            flights = SingleFlight()
+            streams = [flights.stream("k", source), flights.stream("k", source)]
+            results = await asyncio.gather(*(_collect(stream) for stream in streams), return_exceptions=True)
+            assert all(isinstance(result, RuntimeError) for result in results)
+
+        asyncio.run(scenario())
+
+    def test_upstream_is_cancelled_when_all_participants_leave(self):
+        async def scenario():
+            cancelled = asyncio.Event()
+
+            async def source():
+                try:
+                    yield "a"
+                    await asyncio.Event().wait()
+                finally:
+                    cancelled.set()
+
+            flights = SingleFlight()
+            streams = [flights.stream("k", source), flights.stream("k", source)]
+            for stream in streams:
+                assert await stream.__anext__() == "a"
+
+            await streams[0].aclose()
+            await asyncio.sleep(0.01)
+            assert not cancelled.is_set()
+
+            await streams[1].aclose()
+            await asyncio.wait_for(cancelled.wait(), timeout=1)
+            assert len(flights) == 0
+            with pytest.raises(StopAsyncIteration):
+                await streams[1].__anext__()
+
+        asyncio.run(scenario())
+
+    def test_request_after_last_participant_leaves_starts_fresh_flight(self):
+        async def scenario():
+            calls = []
+
+            async def source():
+                calls.append(1)
+                yield "a"
+                await asyncio.sleep(0.01)
+                yield "b"
+
+            flights = SingleFlight()
+            first = flights.stream("k", source)
+            assert await first.__anext__() == "a"
+            # A 离开后生成还在取消途中，B 紧接着到达
+            await first.aclose()
+            second = flights.stream("k", source)
+
+            assert await _collect(second) == ["a", "b"]
+            assert calls == [1, 1]
+            assert len(flights) == 0
+
+        asyncio.run(scenario())
+
+    def test_abandoned_participant_sees_flight_aborted(self):
+        async def scenario():
+            async def source():
+                yield "a"
+                await asyncio.Event().wait()
+
+            flights = SingleFlight()
+            leader, follower = flights.stream("k", source), flights.stream("k", source)
+            assert await leader.__anext__() == "a"
+            await leader.aclose()
+            await asyncio.sleep(0.01)
+
+            # 尚未开始读取的参与者拿到普通异常，而不是共享的 CancelledError
+            with pytest.raises(FlightAborted):
+                await _collect(follower)
+
+        asyncio.run(scenario())
@@ -0,0 +1,254 @@
+"""SSE 并发守卫测试。"""
+import asyncio
+import time
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from app import app
+from app.auth import get_current_user
+from app.auth.jwt_verifier import AuthenticatedUser
+from app.core.rate_limiter import RateLimiter, TokenBucket
+from app.core.sse_guard import SSEConcurrencyGuard
+from app.core.sse_stream import EventStreamResponse
+
+
+def _user(uid: str) -> AuthenticatedUser:
+    return AuthenticatedUser(uid=uid, claims={"sub": uid})
+
+
+async def _register(guard, connection_id, uid="u1", conversation_id=None):
+    return await guard.check_and_register_connection(
+        connection_id, _user(uid), conversation_id, "msg", "127.0.0.1", "pytest"
+    )
+
+
+class TestSSEConcurrencyGuard:
+    """分片计数与强制断开测试。"""
+
+    def test_limits_and_counters(self):
+        async def scenario():
+            guard = SSEConcurrencyGuard()
+            guard.settings = guard.settings.model_copy(
+                update={"sse_max_concurrent_per_user": 2, "sse_max_concurrent_per_conversation": 1}
+            )
+            assert (await _register(guard, "a", conversation_id="c1"))[0]
+            allowed, reason, retry_after = await _register(guard, "b", conversation_id="c1")
+            assert not allowed and retry_after == 10 and "Conversation" in reason
+            assert (await _register(guard, "b"))[0]
+            assert not (await _register(guard, "c"))[0]
+            assert (await _register(guard, "d", uid="u2"))[0]
+
+            stats = await guard.get_stats()
+            assert (stats["active_connections"], stats["active_users"], stats["active_conversations"]) == (3, 2, 1)
+
+            await guard.unregister_connection("a")
+            await guard.unregister_connection("a")
+            assert guard.connection_count("u1") == 1
+            assert (await guard.get_stats())["active_conversations"] == 0
+            assert (await _register(guard, "e", conversation_id="c1"))[0]
+
+        asyncio.run(scenario())
+
+    def test_force_disconnect_terminates_without_deadlock(self):
+        async def scenario():
+            guard = SSEConcurrencyGuard()
+            cancelled = []
+            for connection_id in ("a", "b"):
+                await _register(guard, connection_id)
+                guard.bind_cancel(connection_id, lambda cid=connection_id: cancelled.append(cid))
+            await _register(guard, "other", uid="u2")
+
+            count = await asyncio.wait_for(guard.force_disconnect_user("u1"), timeout=1)
+            assert count == 2
+            assert sorted(cancelled) == ["a", "b"]
+            assert guard.connection_count("u1") == 0
+            assert guard.active_count == 1
+            # 连接已被注销后再绑定回调会失败，调用方据此直接结束
+            assert not guard.bind_cancel("a", lambda: None)
+
+        asyncio.run(scenario())
+
+    def test_cleanup_stale_connections_terminates_old_streams(self):
+        async def scenario():
+            guard = SSEConcurrencyGuard()
+            cancelled = []
+            await _register(guard, "old")
+            await _register(guard, "new")
+            guard.bind_cancel("old", lambda: cancelled.append("old"))
+            guard._shards["u1"].connections["old"].start_time -= 7200
+
+            assert await asyncio.wait_for(guard.cleanup_stale_connections(3600), timeout=1) == 1
+            assert cancelled == ["old"]
+            assert await guard.get_user_connections("u1") == {"new"}
+
+        asyncio.run(scenario())
+
+
+class TestConnectionReaper:
+    """空闲与超龄连接回收测试。"""
+
+    def test_idle_and_old_connections_are_reaped(self):
+        async def scenario():
+            guard = SSEConcurrencyGuard()
+            guard.settings = guard.settings.model_copy(
+                update={"sse_idle_timeout_seconds": 60, "sse_max_connection_age_seconds": 3600}
+            )
+            cancelled = []
+            last_writes = {"fresh": 1000.0, "stalled": 900.0, "old": 1000.0}
+            for connection_id in ("fresh", "stalled", "old", "unbound"):
+                await _register(guard, connection_id, uid=connection_id)
+                if connection_id in last_writes:
+                    guard.bind_cancel(
+                        connection_id,
+                        lambda cid=connection_id: cancelled.append(cid),
+                        lambda cid=connection_id: last_writes[cid],
+                    )
+                guard._shards[connection_id].connections[connection_id].started_at = 0.0
+            guard._shards["old"].connections["old"].started_at = -3000.0
+            for connection_id in ("fresh", "stalled", "unbound"):
+                guard._shards[connection_id].connections[connection_id].started_at = 500.0
+
+            before = _reaped("idle")
+            assert guard.reap(now=1010.0) == {"idle": 1, "max_age": 1}
+            assert sorted(cancelled) == ["old", "stalled"]
+            assert _reaped("idle") == before + 1
+            assert guard.connection_count("fresh") == 1
+            # 未绑定写出探针的连接只受最长存活时间约束
+            assert guard.connection_count("unbound") == 1
+
+        asyncio.run(scenario())
+
+
+def _reaped(reason: str) -> float:
+    return REGISTRY.get_sample_value("sse_connections_reaped_total", {"reason": reason}) or 0.0
+
+
+class TestServerSideCancel:
+    """服务端主动终止 SSE 流测试。"""
+
+    def test_cancel_ends_response_and_releases(self):
+        async def scenario():
+            released = []
+            generator_closed = asyncio.Event()
+            sent = []
+
+            async def frames():
+                try:
+                    yield b"event: status\ndata: {}\n\n"
+                    await asyncio.Event().wait()
+                finally:
+                    generator_closed.set()
+
+            async def on_close():
+                released.append(True)
+
+            async def receive():
+                await asyncio.Event().wait()
+
+            async def send(message):
+                sent.append(message)
+
+            response = EventStreamResponse(frames(), on_close=on_close, retry_hint_ms=2500)
+            task = asyncio.create_task(response({"type": "http"}, receive, send))
+            while len(sent) < 3:
+                await asyncio.sleep(0)
+            response.cancel()
+            await asyncio.wait_for(task, timeout=1)
+
+            assert generator_closed.is_set()
+            assert released == [True]
+            assert sent[1]["body"] == b"retry: 2500\n\n"
+            # 关闭前下发 retry: 提示让客户端退避
+            assert sent[-1] == {"type": "http.response.body", "body": b"retry: 2500\n\n", "more_body": False}
+            assert not response.disconnected
+
+        asyncio.run(scenario())
+
+
+    def test_stream_ends_when_connection_was_reaped_before_binding(self):
+        app.dependency_overrides[get_current_user] = lambda: _user("reaped-user")
+        try:
+            with patch("app.api.v1.messages.bind_sse_cancel", return_value=False), patch.object(
+                RateLimiter, "check_rate_limit", return_value=(True, None, None)
+            ), TestClient(app) as client:
+                broker = app.state.message_broker
+                client.portal.call(lambda: broker.create_channel("reaped", owner="reaped-user"))
+                response = client.get("/api/v1/messages/reaped/events", headers={"Authorization": "Bearer t"})
+        finally:
+            app.dependency_overrides.pop(get_current_user, None)
+
+        # 没有终止句柄的流不能继续写出，立即结束并只下发 retry: 提示
+        assert response.status_code == 200
+        assert response.text.startswith("retry: ") and response.text.count("\n\n") == 1
+
+
+class TestReconnectSmoothing:
+    """重连风暴平滑测试。"""
+
+    def test_admission_bucket_limits_new_connections(self):
+        async def scenario():
+            guard = SSEConcurrencyGuard()
+            guard.settings = guard.settings.model_copy(update={"sse_reconnect_jitter_ms": 0})
+            guard._admission = TokenBucket(capacity=2, tokens=2, last_refill=time.time(), refill_rate=0.5)
+            assert (await _register(guard, "a", uid="u1"))[0]
+            assert (await _register(guard, "b", uid="u2"))[0]
+            allowed, reason, retry_after = await _register(guard, "c", uid="u3")
+            assert not allowed and "admission" in reason
+            assert retry_after == 2
+            assert guard.rejection_reasons["admission_rate_limited"] == 1
+
+        asyncio.run(scenario())
+
+    def test_drain_spreads_reconnects_over_window(self):
+        async def scenario():
+            guard = SSEConcurrencyGuard()
+            guard.settings = guard.settings.model_copy(update={"sse_max_concurrent_per_user": 10})
+            delays = []
+            cancelled = []
+            for index in range(4):
+                await _register(guard, f"c{index}")
+                guard.bind_cancel(f"c{index}", lambda: None, drain=delays.append)
+            await _register(guard, "ws")
+            guard.bind_cancel("ws", lambda: cancelled.append("ws"))
+
+            assert guard.drain(window_seconds=10) == 5
+            assert cancelled == ["ws"]
+            assert guard.active_count == 0
+            # 每条连接落在窗口的不同分层内
+            assert len({delay * 5 // 10000 for delay in delays}) == 4
+            assert all(0 <= delay < 10000 for delay in delays)
+
+            allowed, reason, retry_after = await _register(guard, "late")
+            assert not allowed and "draining" in reason and retry_after >= 10
+            guard.start()
+            assert (await _register(guard, "late"))[0]
+            await guard.stop()
+
+        asyncio.run(scenario())
+
+    def test_response_drain_sends_reconnect_event(self):
+        async def scenario():
+            sent = []
+
+            async def frames():
+                yield b"event: status\ndata: {}\n\n"
+                await asyncio.Event().wait()
+
+            async def receive():
+                await asyncio.Event().wait()
+
+            async def send(message):
+                sent.append(message)
+
+            response = EventStreamResponse(frames(), retry_hint_ms=3000)
+            task = asyncio.create_task(response({"type": "http"}, receive, send))
+            while len(sent) < 3:
+                await asyncio.sleep(0)
+            response.drain(1500, b"event: reconnect\ndata: {\"reconnect_in_ms\":1500}\n\n")
+            await asyncio.wait_for(task, timeout=1)
+
+            assert sent[-1]["body"] == b"event: reconnect\ndata: {\"reconnect_in_ms\":1500}\n\nretry: 1500\n\n"
+
+        asyncio.run(scenario())
@@ -0,0 +1,128 @@
+"""SSE 集群租约测试（使用 fakeredis 作为本地替身）。"""
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.auth.jwt_verifier import AuthenticatedUser  # noqa: E402
+from app.core.sse_guard import SSEConcurrencyGuard  # noqa: E402
+from app.core.sse_leases import LeaseClaim, RedisLeaseBackend  # noqa: E402
+
+
+def _make_workers(ttl_seconds: float = 30.0):
+    """模拟两个 worker：各自持有守卫与租约后端，共享同一个 Redis。"""
+
+    server = fakeredis.FakeServer()
+
+    def worker() -> SSEConcurrencyGuard:
+        client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        guard = SSEConcurrencyGuard(RedisLeaseBackend(client, key_prefix="test:sse", ttl_seconds=ttl_seconds))
+        guard.settings = guard.settings.model_copy(
+            update={"sse_max_concurrent_per_user": 2, "sse_max_concurrent_per_conversation": 1}
+        )
+        return guard
+
+    return worker(), worker()
+
+
+async def _register(guard, connection_id, uid="u1", conversation_id=None):
+    user = AuthenticatedUser(uid=uid, claims={"sub": uid})
+    return await guard.check_and_register_connection(
+        connection_id, user, conversation_id, "msg", "127.0.0.1", "pytest"
+    )
+
+
+class TestClusterLeases:
+    """跨 worker 并发上限测试。"""
+
+    def test_limits_are_shared_across_workers(self):
+        async def scenario():
+            first, second = _make_workers()
+            assert (await _register(first, "a", conversation_id="c1"))[0]
+            assert (await _register(second, "b"))[0]
+
+            # 两个 worker 各自只有一个连接，但集群内用户名额已满
+            allowed, reason, retry_after = await _register(second, "c")
+            assert not allowed and retry_after == 30 and "cluster" in reason
+            assert second.connection_count("u1") == 1
+
+            allowed, reason, _ = await _register(second, "d", uid="u2", conversation_id="c1")
+            assert not allowed and "Conversation" in reason
+            assert second.active_count == 1
+
+            # 注销后租约释放，名额可被其他 worker 使用
+            await first.unregister_connection("a")
+            await first.stop()
+            assert (await _register(second, "c", conversation_id="c1"))[0]
+            await second.stop()
+
+        asyncio.run(scenario())
+
+    def test_crashed_worker_leases_expire(self):
+        async def scenario():
+            first, second = _make_workers(ttl_seconds=0.2)
+            assert (await _register(first, "a"))[0]
+            assert (await _register(first, "b"))[0]
+            assert not (await _register(second, "c"))[0]
+
+            # first 停止续约（模拟进程崩溃），租约在 TTL 后过期
+            await asyncio.sleep(0.3)
+            assert (await _register(second, "c"))[0]
+
+        asyncio.run(scenario())
+
+    def test_renewal_extends_all_leases_in_one_pipeline(self):
+        async def scenario():
+            client = fakeredis.FakeAsyncRedis(decode_responses=True)
+            backend = RedisLeaseBackend(client, key_prefix="test:sse", ttl_seconds=0.2)
+            claims = {
+                "a": (LeaseClaim("user", "u1", 2),),
+                "b": (LeaseClaim("user", "u1", 2), LeaseClaim("conversation", "c1", 1)),
+            }
+            for lease_id, lease_claims in claims.items():
+                assert await backend.acquire(lease_id, lease_claims) is None
+
+            executed = []
+            original = client.pipeline
+
+            def tracking_pipeline(*args, **kwargs):
+                pipe = original(*args, **kwargs)
+                execute = pipe.execute
+
+                async def counted_execute(*a, **kw):
+                    executed.append(len(pipe.command_stack))
+                    return await execute(*a, **kw)
+
+                pipe.execute = counted_execute
+                return pipe
+
+            client.pipeline = tracking_pipeline
+            for _ in range(3):
+                await asyncio.sleep(0.1)
+                await backend.renew(claims)
+            # 每次续约一次往返，按键分组：两个 ZSET 各一条 ZADD 与 PEXPIRE
+            assert executed == [4, 4, 4]
+
+            client.pipeline = original
+            assert await backend.acquire("c", (LeaseClaim("conversation", "c1", 1),)) == LeaseClaim(
+                "conversation", "c1", 1
+            )
+
+        asyncio.run(scenario())
+
+    def test_renewal_does_not_resurrect_released_lease(self):
+        async def scenario():
+            client = fakeredis.FakeAsyncRedis(decode_responses=True)
+            backend = RedisLeaseBackend(client, key_prefix="test:sse", ttl_seconds=30)
+            claims = (LeaseClaim("conversation", "c1", 1),)
+            assert await backend.acquire("a", claims) is None
+
+            # 续约快照在释放之前取得，但写入发生在释放之后
+            await backend.release("a", claims)
+            await backend.renew({"a": claims})
+
+            assert await client.zscore("test:sse:conversation:c1", "a") is None
+            assert await backend.acquire("b", claims) is None
+
+        asyncio.run(scenario())
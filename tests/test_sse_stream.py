@@ -0,0 +1,199 @@
+"""SSE 响应封装测试。"""
+import asyncio
+import zlib
+
+from app.core.heartbeat import HeartbeatHandle
+from app.core.sse_stream import (
+    EventStreamResponse,
+    StreamCompressor,
+    compress_stream,
+    negotiate_stream_encoding,
+    stream_subscription,
+)
+from app.services.message_broker import MessageEvent, MessageEventBroker, encode_frame
+
+
+class TestEventStreamResponse:
+    """断线检测与资源释放测试。"""
+
+    def test_disconnect_cancels_generator_and_releases(self):
+        async def scenario():
+            released = []
+            generator_closed = asyncio.Event()
+            disconnect = asyncio.Event()
+            sent = []
+
+            async def frames():
+                try:
+                    yield "event: status\ndata: {}\n\n"
+                    await asyncio.Event().wait()  # 模拟长时间无事件
+                finally:
+                    generator_closed.set()
+
+            async def on_close():
+                released.append(True)
+
+            async def receive():
+                await disconnect.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+                if message.get("body"):
+                    disconnect.set()
+
+            response = EventStreamResponse(frames(), on_close=on_close)
+            await asyncio.wait_for(response({"type": "http"}, receive, send), timeout=1)
+
+            assert response.disconnected
+            assert generator_closed.is_set()
+            assert released == [True]
+            assert sent[0]["type"] == "http.response.start"
+
+        asyncio.run(scenario())
+
+    def test_normal_completion_releases_once(self):
+        async def scenario():
+            released = []
+
+            async def frames():
+                yield "event: completed\ndata: {}\n\n"
+
+            async def on_close():
+                released.append(True)
+
+            async def receive():
+                await asyncio.Event().wait()
+
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            response = EventStreamResponse(frames(), on_close=on_close)
+            await asyncio.wait_for(response({"type": "http"}, receive, send), timeout=1)
+
+            assert not response.disconnected
+            assert released == [True]
+            assert sent[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+        asyncio.run(scenario())
+
+
+async def _frames(subscription, *, window: float, omit_reply: bool = False) -> list:
+    heartbeat = HeartbeatHandle(subscription.wake)
+    stream = stream_subscription(
+        subscription,
+        heartbeat,
+        b"event: heartbeat\ndata: {}\n\n",
+        render=lambda item: encode_frame(item, "sse", omit_reply),
+        coalesce_seconds=window,
+    )
+    return [frame async for frame in stream]
+
+
+class TestWriteCoalescing:
+    """写合并与 completed 瘦身测试。"""
+
+    def test_frames_within_window_are_sent_together(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=64, retention_seconds=60)
+            channel = await broker.create_channel("msg-1")
+            subscription = channel.subscribe()
+
+            async def produce():
+                for index in range(5):
+                    await broker.publish("msg-1", MessageEvent(event="content_delta", data={"delta": str(index)}))
+                    await asyncio.sleep(0)
+                await broker.close("msg-1")
+
+            producer = asyncio.create_task(produce())
+            frames = await asyncio.wait_for(_frames(subscription, window=0.05), timeout=1)
+            await producer
+
+            assert len(frames) == 1
+            assert frames[0].count(b"event: content_delta") == 5
+
+        asyncio.run(scenario())
+
+    def test_zero_window_writes_each_frame(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=64, retention_seconds=60)
+            channel = await broker.create_channel("msg-1")
+            subscription = channel.subscribe()
+            for index in range(3):
+                await broker.publish("msg-1", MessageEvent(event="content_delta", data={"delta": str(index)}))
+            await broker.close("msg-1")
+
+            assert len(await _frames(subscription, window=0)) == 3
+
+        asyncio.run(scenario())
+
+    def test_completed_can_omit_reply(self):
+        async def scenario():
+            broker = MessageEventBroker(buffer_size=64, retention_seconds=60)
+            channel = await broker.create_channel("msg-1")
+            slim, full = channel.subscribe(), channel.subscribe()
+            await broker.publish("msg-1", MessageEvent(event="completed", data={"message_id": "msg-1", "reply": "x" * 500}))
+            await broker.close("msg-1")
+
+            slim_frame = b"".join(await _frames(slim, window=0, omit_reply=True))
+            full_frame = b"".join(await _frames(full, window=0))
+            assert b'"reply_omitted":true' in slim_frame and b"xxx" not in slim_frame
+            assert b'"reply":"' in full_frame
+            assert channel.ring.get(1).variants["sse_slim"] == slim_frame
+
+        asyncio.run(scenario())
+
+
+class TestStreamCompression:
+    """流式压缩测试。"""
+
+    def test_negotiation_prefers_gzip_and_honours_q(self):
+        assert negotiate_stream_encoding("gzip, deflate, br") == "gzip"
+        assert negotiate_stream_encoding("deflate;q=1.0, gzip;q=0.5") == "deflate"
+        assert negotiate_stream_encoding("gzip;q=0, br") is None
+        assert negotiate_stream_encoding(None) is None
+
+    def test_each_batch_is_decodable_immediately(self):
+        async def scenario():
+            frames = [
+                'event: content_delta\ndata: {"delta":"深蹲 5x5"}\n\n'.encode() for _ in range(3)
+            ]
+
+            async def source():
+                for frame in frames:
+                    yield frame
+
+            decoder = zlib.decompressobj(31)
+            compressed = compress_stream(source(), StreamCompressor("gzip"))
+            decoded = []
+            async for chunk in compressed:
+                decoded.append(decoder.decompress(chunk))
+
+            # sync flush 后每批都能独立解出，最后一块只是 gzip 尾部
+            assert decoded[:3] == frames
+            assert decoded[3] == b"" and decoder.eof
+            # 压缩字典跨帧复用，重复帧压缩后明显变小
+            compressor = StreamCompressor("deflate")
+            assert len(compressor.compress(frames[0])) > len(compressor.compress(frames[1]))
+
+        asyncio.run(scenario())
+
+    def test_closing_compressed_stream_closes_source(self):
+        async def scenario():
+            closed = asyncio.Event()
+
+            async def source():
+                try:
+                    yield b"event: status\ndata: {}\n\n"
+                    await asyncio.Event().wait()
+                finally:
+                    closed.set()
+
+            compressed = compress_stream(source(), StreamCompressor("deflate"))
+            await compressed.__anext__()
+            await compressed.aclose()
+            assert closed.is_set()
+
+        asyncio.run(scenario())
@@ -0,0 +1,131 @@
+"""粘性路由测试。"""
+import asyncio
+
+import httpx
+
+from app.core.message_ids import new_message_id, parse_message_id
+from app.core.sticky_dispatch import StickyDispatcher, parse_worker_sockets
+
+
+def _worker_client(worker_id: str) -> httpx.AsyncClient:
+    def handler(request: httpx.Request) -> httpx.Response:
+        async def frames():
+            yield f"event: status\ndata: {worker_id} {request.url.path}\n\n".encode()
+
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=frames())
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://worker")
+
+
+class TestMessageIds:
+    """消息 ID 编解码测试。"""
+
+    def test_worker_tag_round_trip(self):
+        message_id = new_message_id("w2")
+        worker_id, token = parse_message_id(message_id)
+        assert worker_id == "w2"
+        assert len(token) == 32 and message_id.endswith(token)
+
+    def test_legacy_ids_have_no_worker(self):
+        message_id = new_message_id()
+        assert len(message_id) == 32
+        assert parse_message_id(message_id) == (None, message_id)
+        assert parse_message_id("not_a-valid-id") == (None, "not_a-valid-id")
+
+
+class TestStickyDispatcher:
+    """分发器路由测试。"""
+
+    def test_parse_worker_sockets(self):
+        assert parse_worker_sockets("a=/run/a.sock, B=/run/b.sock,broken") == {
+            "a": "/run/a.sock",
+            "b": "/run/b.sock",
+        }
+
+    def test_events_route_to_owning_worker(self):
+        dispatcher = StickyDispatcher({"a": _worker_client("a"), "b": _worker_client("b")})
+        message_id = new_message_id("b")
+        for _ in range(3):
+            assert dispatcher.route(f"/api/v1/messages/{message_id}/events") == "b"
+
+    def test_cancel_routes_to_owning_worker(self):
+        async def scenario():
+            calls = []
+
+            def worker(worker_id: str) -> httpx.AsyncClient:
+                def handler(request: httpx.Request) -> httpx.Response:
+                    calls.append((worker_id, request.method, request.url.path))
+
+                    async def body():
+                        yield b'{"state": "cancelling"}'
+
+                    return httpx.Response(202, headers={"content-type": "application/json"}, content=body())
+
+                return httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://worker")
+
+            dispatcher = StickyDispatcher({"a": worker("a"), "b": worker("b")})
+            message_id = new_message_id("b")
+            # 停止生成必须落到持有生成任务的 worker，轮询会让一半请求 404
+            async with httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=dispatcher), base_url="http://dispatcher"
+            ) as client:
+                for _ in range(3):
+                    response = await client.delete(f"/api/v1/messages/{message_id}")
+                    assert response.status_code == 202
+            assert calls == [("b", "DELETE", f"/api/v1/messages/{message_id}")] * 3
+            # batch 等非消息 ID 路径仍然轮询
+            assert dispatcher.route("/api/v1/messages/batch") in {"a", "b"}
+            await dispatcher.aclose()
+
+        asyncio.run(scenario())
+
+    def test_other_requests_round_robin(self):
+        dispatcher = StickyDispatcher({"a": _worker_client("a"), "b": _worker_client("b")})
+        routed = {dispatcher.route("/api/v1/messages") for _ in range(4)}
+        assert routed == {"a", "b"}
+        # 未知 worker 标识回退到轮询
+        assert dispatcher.route(f"/api/v1/messages/{new_message_id('zz')}/events") in {"a", "b"}
+
+    def test_forwarding_streams_worker_response(self):
+        async def scenario():
+            dispatcher = StickyDispatcher({"a": _worker_client("a"), "b": _worker_client("b")})
+            message_id = new_message_id("a")
+            transport = httpx.ASGITransport(app=dispatcher)
+            async with httpx.AsyncClient(transport=transport, base_url="http://dispatcher") as client:
+                response = await client.get(f"/api/v1/messages/{message_id}/events")
+            assert response.status_code == 200
+            assert response.text == f"event: status\ndata: a /api/v1/messages/{message_id}/events\n\n"
+            await dispatcher.aclose()
+
+        asyncio.run(scenario())
+
+    def test_websocket_is_closed_instead_of_hanging(self):
+        async def scenario():
+            dispatcher = StickyDispatcher({"a": _worker_client("a")})
+            sent = []
+
+            async def receive():
+                return {"type": "websocket.connect"}
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {"type": "websocket", "path": "/api/v1/ws", "headers": []}
+            await asyncio.wait_for(dispatcher(scope, receive, send), timeout=1)
+            assert sent == [{"type": "websocket.close", "code": 1011}]
+            await dispatcher.aclose()
+
+        asyncio.run(scenario())
+
+    def test_owner_feed_is_rejected(self):
+        async def scenario():
+            dispatcher = StickyDispatcher({"a": _worker_client("a"), "b": _worker_client("b")})
+            transport = httpx.ASGITransport(app=dispatcher)
+            async with httpx.AsyncClient(transport=transport, base_url="http://dispatcher") as client:
+                response = await client.get("/api/v1/events")
+            # 任一 worker 都只持有该用户的部分消息，不能静默轮询
+            assert response.status_code == 501
+            assert response.json()["code"] == "STICKY_UNSUPPORTED"
+            await dispatcher.aclose()
+
+        asyncio.run(scenario())
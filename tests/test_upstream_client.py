@@ -0,0 +1,115 @@
+"""上游 HTTP 连接池测试。"""
+import asyncio
+from unittest.mock import patch
+
+import httpcore
+import pytest
+from prometheus_client import REGISTRY
+
+from app.services.upstream_client import CachingDNSBackend, UpstreamClientPool
+from app.settings.config import get_settings
+
+_RESPONSE = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: keep-alive\r\n\r\nok"
+
+
+async def _start_server():
+    """最小的 HTTP/1.1 keep-alive 服务端，记录接受的 TCP 连接数。"""
+
+    accepted = []
+
+    async def handle(reader, writer):
+        accepted.append(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                if not head:
+                    break
+                # HEAD 响应不带响应体
+                writer.write(_RESPONSE[:-2] if head.startswith(b"HEAD") else _RESPONSE)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}/", accepted
+
+
+def _opened() -> float:
+    return REGISTRY.get_sample_value("upstream_connections_opened_total") or 0.0
+
+
+class TestUpstreamClientPool:
+    """连接复用与预热测试。"""
+
+    def test_requests_reuse_one_connection(self):
+        async def scenario():
+            server, url, accepted = await _start_server()
+            pool = UpstreamClientPool(get_settings())
+            before = _opened()
+            for _ in range(5):
+                response = await pool.client.get(url)
+                assert response.text == "ok"
+
+            assert len(accepted) == 1
+            assert _opened() == before + 1
+            assert pool.stats() == {"active": 0, "idle": 1, "waiting": 0}
+            # 排队请求数依赖 httpcore 私有状态，缺失时按 0 统计
+            with patch.object(pool._transport.pool, "_requests", None):
+                assert pool.stats()["waiting"] == 0
+
+            await pool.aclose()
+            assert pool.stats() == {"active": 0, "idle": 0, "waiting": 0}
+            server.close()
+
+        asyncio.run(scenario())
+
+    def test_prewarm_opens_idle_connections(self):
+        async def scenario():
+            server, url, accepted = await _start_server()
+            pool = UpstreamClientPool(get_settings())
+            assert await pool.prewarm(url, 3) == 3
+            assert len(accepted) == 3
+            assert pool.stats()["idle"] == 3
+
+            # 预热后的请求直接复用已建立的连接
+            await pool.client.get(url)
+            assert len(accepted) == 3
+            await pool.aclose()
+            server.close()
+
+        asyncio.run(scenario())
+
+
+class TestCachingDNSBackend:
+    """DNS 缓存测试。"""
+
+    def test_lookups_are_cached_and_evicted_on_failure(self):
+        async def scenario():
+            lookups = []
+
+            async def fake_getaddrinfo(host, port, **kwargs):
+                lookups.append(host)
+                return [(None, None, None, "", ("10.0.0.1", port)), (None, None, None, "", ("10.0.0.1", port))]
+
+            backend = CachingDNSBackend(ttl_seconds=60, backend=httpcore.AsyncMockBackend([]))
+            with patch("app.services.upstream_client.anyio.getaddrinfo", fake_getaddrinfo):
+                assert await backend.resolve("api.example.com", 443) == ["10.0.0.1"]
+                assert await backend.resolve("api.example.com", 443) == ["10.0.0.1"]
+                assert await backend.resolve("127.0.0.1", 443) == ["127.0.0.1"]
+                assert lookups == ["api.example.com"]
+
+                class RefusingBackend(httpcore.AsyncMockBackend):
+                    async def connect_tcp(self, *args, **kwargs):
+                        raise httpcore.ConnectError("refused")
+
+                backend._backend = RefusingBackend([])
+                with pytest.raises(httpcore.ConnectError):
+                    await backend.connect_tcp("api.example.com", 443)
+                # 全部地址不可达时丢弃缓存，下次重新解析
+                await backend.resolve("api.example.com", 443)
+                assert lookups == ["api.example.com", "api.example.com"]
+
+        asyncio.run(scenario())
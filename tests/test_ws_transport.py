@@ -0,0 +1,142 @@
+"""WebSocket 多路订阅测试。"""
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app import app
+from app.core.sse_guard import get_sse_guard
+from app.services.message_broker import MessageEvent
+
+
+@pytest.fixture
+def verifier():
+    with patch("app.api.v1.ws.get_jwt_verifier") as get_verifier:
+        mock_verifier = Mock()
+        get_verifier.return_value = mock_verifier
+        yield mock_verifier
+
+
+def _wait_until(predicate, timeout: float = 1.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestWebSocketTransport:
+    """单连接多消息订阅测试。"""
+
+    def test_one_socket_streams_several_messages(self, make_user, verifier):
+        verifier.verify_token.return_value = make_user("ws-user-1")
+        with TestClient(app) as client:
+            broker = app.state.message_broker
+            for message_id in ("m-a", "m-b"):
+                client.portal.call(broker.create_channel, message_id)
+
+            with client.websocket_connect("/api/v1/ws") as ws:
+                ws.send_json({"op": "auth", "token": "t"})
+                assert ws.receive_json() == {"type": "ready", "uid": "ws-user-1"}
+
+                for message_id in ("m-a", "m-b"):
+                    ws.send_json({"op": "subscribe", "message_id": message_id})
+                    assert ws.receive_json() == {"type": "subscribed", "message_id": message_id}
+
+                client.portal.call(broker.publish, "m-b", MessageEvent(event="content_delta", data={"delta": "b"}))
+                client.portal.call(broker.close, "m-b")
+                assert ws.receive_json() == {
+                    "type": "event",
+                    "message_id": "m-b",
+                    "id": 1,
+                    "event": "content_delta",
+                    "data": {"delta": "b"},
+                }
+                assert ws.receive_json() == {"type": "end", "message_id": "m-b", "reason": "completed"}
+
+                ws.send_json({"op": "unsubscribe", "message_id": "m-a"})
+                assert ws.receive_json() == {"type": "unsubscribed", "message_id": "m-a"}
+                verifier.verify_token.assert_called_once_with("t")
+
+    def test_limits_apply_to_subscriptions_not_sockets(self, make_user, verifier):
+        verifier.verify_token.return_value = make_user("ws-user-2")
+        with TestClient(app) as client:
+            broker = app.state.message_broker
+            for message_id in ("l-1", "l-2", "l-3"):
+                client.portal.call(broker.create_channel, message_id)
+
+            with client.websocket_connect("/api/v1/ws?token=t") as ws:
+                assert ws.receive_json()["type"] == "ready"
+                ws.send_json({"op": "subscribe", "message_id": "l-1"})
+                ws.send_json({"op": "subscribe", "message_id": "l-2"})
+                assert ws.receive_json()["type"] == "subscribed"
+                assert ws.receive_json()["type"] == "subscribed"
+
+                ws.send_json({"op": "subscribe", "message_id": "l-3"})
+                rejected = ws.receive_json()
+                assert rejected["type"] == "error"
+                assert rejected["code"] == "SSE_CONCURRENCY_LIMIT_EXCEEDED"
+
+                # 退订后名额立即归还
+                ws.send_json({"op": "unsubscribe", "message_id": "l-1"})
+                assert ws.receive_json()["type"] == "unsubscribed"
+                ws.send_json({"op": "subscribe", "message_id": "l-3"})
+                assert ws.receive_json() == {"type": "subscribed", "message_id": "l-3"}
+
+            # 断开连接释放全部订阅名额（清理在服务端事件循环中异步完成）
+            assert _wait_until(lambda: get_sse_guard().connection_count("ws-user-2") == 0)
+
+    def test_invalid_token_closes_socket(self, verifier):
+        from fastapi import HTTPException
+
+        verifier.verify_token.side_effect = HTTPException(status_code=401)
+        with TestClient(app) as client:
+            with client.websocket_connect("/api/v1/ws?token=bad") as ws:
+                assert ws.receive_json()["code"] == "unauthorized"
+                with pytest.raises(WebSocketDisconnect) as exc_info:
+                    ws.receive_json()
+                assert exc_info.value.code == 4401
+
+    def test_binary_frame_is_rejected_without_closing(self, make_user, verifier):
+        verifier.verify_token.return_value = make_user("ws-user-3")
+        with TestClient(app) as client:
+            with client.websocket_connect("/api/v1/ws?token=t") as ws:
+                assert ws.receive_json()["type"] == "ready"
+                ws.send_bytes(b"\x81\x00")
+                assert ws.receive_json()["code"] == "invalid_json"
+
+                # 连接仍然可用
+                ws.send_json({"op": "ping"})
+                assert ws.receive_json() == {"type": "pong"}
+
+    def test_cannot_subscribe_to_another_users_message(self, make_user, verifier):
+        verifier.verify_token.return_value = make_user("ws-user-4")
+        with TestClient(app) as client:
+            broker = app.state.message_broker
+            client.portal.call(lambda: broker.create_channel("private", owner="someone-else"))
+
+            with client.websocket_connect("/api/v1/ws?token=t") as ws:
+                assert ws.receive_json()["type"] == "ready"
+                ws.send_json({"op": "subscribe", "message_id": "private"})
+                assert ws.receive_json() == {
+                    "type": "error",
+                    "code": "not_found",
+                    "message": "message not found",
+                    "message_id": "private",
+                }
+
+    def test_subscription_reaped_before_binding_is_dropped(self, make_user, verifier):
+        verifier.verify_token.return_value = make_user("ws-user-5")
+        with patch("app.api.v1.ws.bind_sse_cancel", return_value=False), TestClient(app) as client:
+            broker = app.state.message_broker
+            client.portal.call(broker.create_channel, "r-1")
+
+            with client.websocket_connect("/api/v1/ws?token=t") as ws:
+                assert ws.receive_json()["type"] == "ready"
+                ws.send_json({"op": "subscribe", "message_id": "r-1"})
+                assert ws.receive_json()["code"] == "terminated"
+                ws.send_json({"op": "unsubscribe", "message_id": "r-1"})
+                assert ws.receive_json()["code"] == "not_subscribed"